@@ -0,0 +1,92 @@
+## Benchmark: end-to-end NodeMonitor cycle time at scale
+##
+## Serves a synthetic fleet with the ic-api simulator on localhost, points
+## a NodeMonitor at it, and times NodeMonitor.step() for every poll of a
+## scripted timeline. Every node provider is subscribed to everything, and
+## the database and bots are mocks, so this measures our own work only:
+## fetching, parsing, the detector, correlation and message building.
+## The simulator runs in the same process, so the times also include it
+## encoding each poll (~0.2 s per 100k nodes).
+##
+## Usage:
+##   python -m benchmarks.bench_cycle
+##   python -m benchmarks.bench_cycle --nodes 1000000 --scenario mixed
+
+import argparse
+import time
+from unittest.mock import Mock
+
+import requests
+
+import node_monitor.ic_api as ic_api
+from node_monitor.node_monitor import NodeMonitor
+from node_monitor.node_provider_db import NodeProviderDB
+from node_monitor.bot_email import EmailBot
+from node_monitor.bot_slack import SlackBot
+from node_monitor.bot_telegram import TelegramBot
+from simulator.fleet import Fleet, scenarios
+from simulator.server import Simulator, serve_in_thread
+
+
+def subscribed_db(fleet: Fleet) -> Mock:
+    """A mock NodeProviderDB where every node provider is subscribed."""
+    db = Mock(spec=NodeProviderDB)
+    db.get_subscribers_as_dict.return_value = {
+        p['principal_id']: {
+            'node_provider_id': p['principal_id'],
+            'notify_on_status_change': True,
+            'notify_email': True,
+            'notify_slack': True,
+            'notify_telegram': True,
+            'node_provider_name': p['display_name']}
+        for p in fleet.node_providers}
+    db.get_emails_as_dict.return_value = {
+        p['principal_id']: ['bench@example.com'] for p in fleet.node_providers}
+    db.get_slack_channels_as_dict.return_value = {}
+    db.get_telegram_chats_as_dict.return_value = {}
+    db.get_routing_table.return_value = {
+        k: dict(v, email_addresses=['bench@example.com'],
+                slack_channel_ids=[], telegram_chat_ids=[])
+        for k, v in db.get_subscribers_as_dict.return_value.items()}
+    db.get_node_labels_as_dict.return_value = {}
+    return db
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=100_000)
+    parser.add_argument('--scenario', choices=scenarios, default='mixed')
+    parser.add_argument('--polls', type=int, default=12)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    fleet = scenarios[args.scenario](Fleet(args.nodes))
+    print(f"{len(fleet.nodes)} nodes, {len(fleet.node_providers)} providers,"
+          f" {args.scenario} (generated in {time.perf_counter() - start:.1f} s)")
+    server, url = serve_in_thread(Simulator(fleet))
+    email_bot = Mock(spec=EmailBot)
+    nm = NodeMonitor(subscribed_db(fleet), email_bot,
+                     Mock(spec=SlackBot), Mock(spec=TelegramBot),
+                     ic_api_client=ic_api.ICAPIClient(url))
+
+    times = []
+    for poll in range(args.polls):
+        email_bot.reset_mock()
+        start = time.perf_counter()
+        nm.step()
+        times.append(time.perf_counter() - start)
+        print(f"  poll {poll:>3}  {times[-1] * 1000:8.1f} ms"
+              f"  {len(nm.compromised_nodes):>6} compromised"
+              f"  {len(nm.incidents):>3} incidents"
+              f"  {email_bot.post_emails.call_count:>5} emails")
+        requests.post(f"{url}/advance")
+    server.shutdown()
+    # The first poll also fills the string tables, report it separately
+    steady = times[1:] or times
+    print(f"first {times[0] * 1000:.1f} ms,"
+          f" then mean {sum(steady) / len(steady) * 1000:.1f} ms,"
+          f" max {max(steady) * 1000:.1f} ms per step")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+## Benchmark: memory held per snapshot
+##
+## Measures the memory retained by one snapshot of the fleet, as:
+##   nodes      ic_api.Nodes, a list of pydantic Node objects
+##   first      the first ic_api.Snapshot, which also fills the string table
+##   snapshot   an ic_api.Snapshot once the string table is warm
+##   next       an ic_api.Snapshot built with previous=, as _resync does
+##
+## Usage:
+##   python -m benchmarks.bench_snapshot_memory
+##   python -m benchmarks.bench_snapshot_memory --nodes 10000
+
+import argparse
+import tracemalloc
+from typing import Any, Callable, Tuple
+
+import node_monitor.ic_api as ic_api
+from benchmarks.bench_ic_api import scaled_payload
+
+
+def retained(build: Callable[[], Any]) -> Tuple[Any, int]:
+    """Returns the built object and the bytes it retains."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, after - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=100_000)
+    args = parser.parse_args()
+
+    raw0 = scaled_payload("data/t1.json", args.nodes)
+    raw1 = scaled_payload("data/t2.json", args.nodes)
+
+    _, nodes_size = retained(lambda: ic_api.parse_nodes(raw0))
+    first, first_size = retained(lambda: ic_api.parse_snapshot(raw0))
+    _, snapshot_size = retained(lambda: ic_api.parse_snapshot(raw1))
+    first.index  # built lazily on the first poll, then shared
+    _, next_size = retained(lambda: ic_api.parse_snapshot(raw1, previous=first))
+
+    print(f"{args.nodes} nodes per snapshot")
+    for name, size in [('nodes', nodes_size),
+                       ('first', first_size),
+                       ('snapshot', snapshot_size),
+                       ('next', next_size)]:
+        print(f"  {name:<10} {size / 1e6:8.2f} MB"
+              f"  ({nodes_size / size:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+## Benchmark suite: the hot paths of one monitoring cycle
+##
+## Times each case below against synthetic fleets (see simulator/) of a few
+## sizes, with a mocked database and no-op bots, so it runs offline:
+##   parse_nodes                ic_api.parse_nodes on a /nodes payload
+##   parse_snapshot             ic_api.parse_snapshot, sharing with previous=
+##   resync                     NodeMonitor._resync, a poll with 1% changes
+##   node_state_update          NodeStateTracker.update on the same delta
+##   analyze                    NodeMonitor._analyze
+##   nodes_compromised_message  one alert for every provider with a node down
+##   nodes_status_message       the status report of the largest provider
+##   dispatch                   Dispatcher.dispatch, one message/subscriber
+##   broadcast_status_report    NodeMonitor.broadcast_status_report
+##
+## Each result is the best mean time per call over --repeat rounds. Results
+## are compared to a JSON baseline, and the run fails (exit code 1) if any
+## case is slower than baseline * (1 + --threshold), by more than the noise:
+## the spread between the fastest and slowest round, of this run plus of
+## the baseline's, and at least --min-delta seconds, so that cases that
+## take microseconds don't fail on jitter. The first run, or a run with
+## --save, records the baseline instead. Baselines only make sense on the
+## machine they were recorded on, so they are not checked in.
+##
+## Usage:
+##   python -m benchmarks.suite
+##   python -m benchmarks.suite --save
+##   python -m benchmarks.suite --sizes 1000 10000 --only parse_nodes analyze
+
+import argparse
+import copy
+import itertools
+import json
+import os
+import platform
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+from unittest.mock import Mock
+
+import node_monitor.ic_api as ic_api
+import node_monitor.node_monitor_helpers.messages as messages
+from node_monitor.node_monitor import NodeMonitor
+from node_monitor.node_monitor_helpers.dispatcher import Dispatcher
+from node_monitor.bot_email import EmailBot
+from node_monitor.bot_slack import SlackBot
+from node_monitor.bot_telegram import TelegramBot
+from simulator.fleet import Fleet
+from benchmarks.bench_cycle import subscribed_db
+
+default_baseline = os.path.join(os.path.dirname(__file__), "baseline.json")
+default_sizes = [1_000, 10_000, 100_000]
+
+
+def null_bot(spec: type) -> Any:
+    """A bot that sends nothing and, unlike a plain Mock, records nothing."""
+    bot = Mock(spec=spec)
+    bot.send_emails = bot.send_messages = lambda *args: None
+    bot.post_emails = bot.post_messages = \
+        lambda destinations, *args: dict.fromkeys(destinations)
+    return bot
+
+
+class Fixture:
+    """Everything the cases need, for a fleet of `n_nodes` nodes where 1%
+    of the nodes go DOWN after the first poll."""
+
+    def __init__(self, n_nodes: int) -> None:
+        self.fleet = Fleet(n_nodes).nodes_down(
+            max(1, n_nodes // 100), start=1, duration=10)
+        self.payloads = [self.fleet.nodes_payload(t) for t in range(3)]
+        self.nodes = [ic_api.parse_nodes(raw) for raw in self.payloads]
+        self.snapshots: List[ic_api.Snapshot] = []
+        for raw in self.payloads:
+            previous = self.snapshots[-1] if self.snapshots else None
+            self.snapshots.append(ic_api.parse_snapshot(raw, previous=previous))
+        self.nm = self.node_monitor()
+        self.nm._analyze()
+        latest = self.snapshots[-1]
+        largest = max(latest.by_provider.values(), key=len)
+        self.largest_provider = latest.nodes(largest)
+
+
+    def node_monitor(self) -> NodeMonitor:
+        """A NodeMonitor that has synced the first 3 polls."""
+        nm = NodeMonitor(
+            subscribed_db(self.fleet), null_bot(EmailBot),
+            null_bot(SlackBot), null_bot(TelegramBot))
+        for nodes in self.nodes:
+            nm._resync(nodes)
+        return nm
+
+
+def case_parse_nodes(f: Fixture) -> Callable[[], Any]:
+    return lambda: ic_api.parse_nodes(f.payloads[2])
+
+def case_parse_snapshot(f: Fixture) -> Callable[[], Any]:
+    return lambda: ic_api.parse_snapshot(f.payloads[2], previous=f.snapshots[1])
+
+def case_resync(f: Fixture) -> Callable[[], Any]:
+    # Alternates between the first two polls, so every resync sees the 1%
+    # of nodes that went down, or came back
+    nm = f.node_monitor()
+    polls = itertools.cycle([f.nodes[0], f.nodes[1]])
+    return lambda: nm._resync(next(polls))
+
+def case_node_state_update(f: Fixture) -> Callable[[], Any]:
+    tracker = copy.deepcopy(f.nm.node_states)
+    delta = ic_api.SnapshotDelta.between(f.snapshots[0], f.snapshots[1])
+    timestamps = itertools.count()
+    return lambda: tracker.update(delta, next(timestamps))
+
+def case_analyze(f: Fixture) -> Callable[[], Any]:
+    return f.nm._analyze
+
+def case_nodes_compromised_message(f: Fixture) -> Callable[[], Any]:
+    def run() -> None:
+        for nodes in f.nm.actionables.values():
+            messages.nodes_compromised_message(nodes, {})
+    return run
+
+def case_nodes_status_message(f: Fixture) -> Callable[[], Any]:
+    return lambda: messages.nodes_status_message(f.largest_provider, {})
+
+def case_dispatch(f: Fixture) -> Callable[[], Any]:
+    routing_table = f.nm.node_provider_db.get_routing_table()
+    dispatcher = Dispatcher(f.nm.email_bot, f.nm.slack_bot, f.nm.telegram_bot)
+    outgoing = [(node_provider_id, "subject", "message")
+                for node_provider_id in routing_table]
+    return lambda: dispatcher.dispatch(routing_table, outgoing)
+
+def case_broadcast_status_report(f: Fixture) -> Callable[[], Any]:
+    return f.nm.broadcast_status_report
+
+cases: Dict[str, Callable[[Fixture], Callable[[], Any]]] = {
+    name[len("case_"):]: fn for name, fn in globals().items()
+    if name.startswith("case_")}
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, float]:
+    """Best mean time per call, and the spread between the best and worst
+    round, in seconds."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    rounds = timer.repeat(repeat, number)
+    return min(rounds) / number, (max(rounds) - min(rounds)) / number
+
+
+def report(key: str, seconds: float, spread: float,
+           baseline: Dict[str, float], baseline_spread: Dict[str, float],
+           threshold: float, min_delta: float) -> bool:
+    """Prints a result next to its baseline. Returns True if it regressed,
+    by more than `threshold` and by more than the noise."""
+    line = f"  {key:<36} {seconds * 1000:10.3f} ms ±{spread * 1000:.3f}"
+    regressed = False
+    if key in baseline:
+        ratio = seconds / baseline[key]
+        noise = max(spread + baseline_spread.get(key, 0.0), min_delta)
+        regressed = ratio > 1 + threshold \
+            and seconds - baseline[key] > noise
+        line += f"  {ratio:6.2f}x baseline" + ("  REGRESSION" * regressed)
+    print(line)
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time the hot paths of one cycle against a baseline.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes)
+    parser.add_argument('--only', nargs='+', choices=cases, default=list(cases))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument('--min-delta', type=float, default=100e-6,
+                        help="slowdowns smaller than this many seconds "
+                             "are noise (default 100µs)")
+    parser.add_argument('--baseline', default=default_baseline)
+    parser.add_argument('--save', action='store_true',
+                        help="record these results as the new baseline")
+    args = parser.parse_args()
+
+    baseline: Dict[str, float] = {}
+    baseline_spread: Dict[str, float] = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved['results']
+        baseline_spread = saved.get('spread', {})
+        print(f"Comparing to {args.baseline} (threshold {args.threshold:.0%},"
+              f" at least {args.min_delta * 1e6:.0f}µs)")
+
+    results: Dict[str, float] = {}
+    spreads: Dict[str, float] = {}
+    regressions = []
+    for size in args.sizes:
+        print(f"{size} nodes")
+        fixture = Fixture(size)
+        for name in args.only:
+            key = f"{name}@{size}"
+            results[key], spreads[key] = measure(cases[name](fixture),
+                                                 args.repeat)
+            if report(key, results[key], spreads[key], baseline,
+                      baseline_spread, args.threshold, args.min_delta):
+                regressions.append(key)
+
+    if not baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results,
+                       'spread': spreads}, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
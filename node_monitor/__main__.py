@@ -5,8 +5,13 @@ from node_monitor.bot_email import EmailBot
 from node_monitor.bot_slack import SlackBot
 from node_monitor.bot_telegram import TelegramBot
 from node_monitor.node_monitor import NodeMonitor
+from node_monitor.node_monitor_helpers.dispatcher import channel_workers
+from node_monitor.node_provider_db_base import BaseNodeProviderDB
 from node_monitor.node_provider_db import NodeProviderDB
+from node_monitor.node_provider_db_sqlite import SQLiteNodeProviderDB
 from node_monitor.server import create_server
+from node_monitor.ic_api import ICAPIClient
+from node_monitor.outbox import Outbox
 import node_monitor.load_config as c
 
 
@@ -24,11 +29,22 @@ logging.basicConfig(
 ## instance and work on the same data in different functions/threads
 email_bot = EmailBot(c.EMAIL_USERNAME, c.EMAIL_PASSWORD)
 slack_bot = SlackBot(c.TOKEN_SLACK)
-telegram_bot = TelegramBot(c.TOKEN_TELEGRAM)
-node_provider_db = NodeProviderDB(
-    c.DB_HOST, c.DB_NAME, c.DB_PORT,
-    c.DB_USERNAME, c.DB_PASSWORD)
-nm = NodeMonitor(node_provider_db, email_bot, slack_bot, telegram_bot)
+telegram_bot = TelegramBot(c.TOKEN_TELEGRAM,
+                           concurrent_calls=channel_workers['telegram'])
+if c.DB_BACKEND == 'sqlite':
+    node_provider_db: BaseNodeProviderDB = SQLiteNodeProviderDB(c.DB_PATH)
+else:
+    node_provider_db = NodeProviderDB(
+        c.DB_HOST, c.DB_NAME, c.DB_PORT,
+        c.DB_USERNAME, c.DB_PASSWORD,
+        pool_min=c.DB_POOL_MIN, pool_max=c.DB_POOL_MAX,
+        statement_timeout=c.DB_STATEMENT_TIMEOUT)
+ic_api_client = ICAPIClient(c.IC_API_URL)
+nm = NodeMonitor(node_provider_db, email_bot, slack_bot, telegram_bot,
+                 ic_api_client=ic_api_client,
+                 debounce_window=c.DEBOUNCE_POLLS,
+                 checkpoint_path=c.CHECKPOINT_PATH or None,
+                 outbox=Outbox(c.OUTBOX_PATH) if c.OUTBOX_PATH else None)
 
 
 ## Run NodeMonitor in a separate thread
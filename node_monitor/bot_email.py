@@ -1,40 +1,151 @@
 from email.message import EmailMessage
 import smtplib
-from typing import List
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+## Sessions:
+## Logging in to the SMTP server takes several round-trips and a TLS
+## handshake (EHLO, STARTTLS, EHLO, LOGIN), so we keep up to `pool_size`
+## authenticated sessions open and reuse them across send_emails() calls.
+## A session that has been idle for longer than `health_check_interval`
+## is checked with a NOOP before it is reused. If the server has dropped
+## it anyway, we log in again and send the rest of the emails.
 
 
 class EmailBot:
     def __init__(
-            self, email_username: str, email_password: str, 
-            smtp_server: str = 'smtp.gmail.com', smtp_port: int = 587) -> None:
+            self, email_username: str, email_password: str,
+            smtp_server: str = 'smtp.gmail.com', smtp_port: int = 587,
+            pool_size: int = 4, health_check_interval: float = 60,
+            timeout: float = 30) -> None:
         """Create an EmailBot object that can send emails from the given
         email account. The default SMTP server is gmail, but this can be
-        changed if desired."""
+        changed if desired. Up to `pool_size` emails are sent at once,
+        each over its own SMTP session, see Sessions above."""
         self.email_username = email_username
         self.email_password = email_password
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle: List[Tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
 
 
-    def send_emails(self, 
-            recipients: List[str], subject: str, body: str) -> None:
+    def _connect(self) -> smtplib.SMTP:
+        """Opens a new authenticated SMTP session."""
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port,
+                              timeout=self.timeout)
+        try:
+            server.ehlo()
+            server.starttls()
+            server.ehlo()
+            server.login(self.email_username, self.email_password)
+        except Exception:
+            self._close(server)
+            raise
+        return server
+
+
+    @staticmethod
+    def _close(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except OSError: # includes SMTPException
+            server.close()
+
+
+    def _checkout(self) -> smtplib.SMTP:
+        """Takes the most recently used idle session, or opens one."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.health_check_interval:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            server.close()
+        return self._connect()
+
+
+    def _checkin(self, server: smtplib.SMTP) -> None:
+        with self._lock:
+            self._idle.append((server, time.monotonic()))
+
+
+    def close(self) -> None:
+        """Logs out of every idle session."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+
+    def post_emails(self, recipients: List[str], subject: str,
+                    body: str) -> Dict[str, Optional[Exception]]:
         """Send an email to each recipient with the given subject and body.
-        Logs in and out of the SMTP server only once even if multiple 
-        recipients are specified."""
+        Uses one pooled SMTP session for all recipients, and logs in again
+        once if the server drops it. A recipient the server refuses doesn't
+        stop the others.
+        Returns the error of each recipient, None if the email was sent."""
         email_message = EmailMessage()
         email_message['Subject'] = subject
         email_message['From'] = "Node Monitor"
         email_message['To'] = 'will-be-overwritten'
         email_message.set_content(body)
+        errors: Dict[str, Optional[Exception]] = {}
         # # # #
-        with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-            server.ehlo()
-            server.starttls()
-            server.ehlo()
-            server.login(self.email_username, self.email_password)
+        with self._slots:
+            try:
+                server = self._checkout()
+            except Exception as e:
+                return dict.fromkeys(recipients, e)
+            reconnected = False
             # Note: You can pass a list to 'To'
             # I chose not to do this to keep recipients mutually blind:
-            for recipient in recipients:
+            for i, recipient in enumerate(recipients):
                 del email_message['To']
                 email_message['To'] = recipient
-                server.send_message(email_message)
+                while True:
+                    try:
+                        server.send_message(email_message)
+                        errors[recipient] = None
+                        break
+                    except smtplib.SMTPServerDisconnected as e:
+                        server.close()
+                        if reconnected:
+                            return {**errors,
+                                    **dict.fromkeys(recipients[i:], e)}
+                        try:
+                            server, reconnected = self._connect(), True
+                        except Exception as login_error:
+                            return {**errors, **dict.fromkeys(
+                                recipients[i:], login_error)}
+                    except (smtplib.SMTPResponseException,
+                            smtplib.SMTPRecipientsRefused) as e:
+                        # The server refused this email, the session is fine
+                        errors[recipient] = e
+                        break
+                    except Exception as e:
+                        server.close()
+                        return {**errors,
+                                **dict.fromkeys(recipients[i:], e)}
+            self._checkin(server)
+        return errors
+
+
+    def send_emails(self,
+            recipients: List[str], subject: str, body: str) -> None:
+        """Send an email to each recipient with the given subject and body.
+        Raises the first error, once every recipient was tried. See
+        post_emails() for the result of every recipient."""
+        for error in self.post_emails(recipients, subject, body).values():
+            if error is not None:
+                raise error
@@ -1,40 +1,99 @@
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 import slack_sdk
 from slack_sdk.errors import SlackApiError
 
+from node_monitor.rate_limit import TokenBucket, TokenBuckets, \
+    parse_retry_after
+
+## Rate limits:
+## chat.postMessage allows about one message per second per channel, with
+## short bursts, and a workspace-wide limit of several hundred a minute.
+## Going over gets a `ratelimited` error with a Retry-After header. We pace
+## ourselves with a token bucket for the workspace and one per channel,
+## and if we still get rate limited, wait Retry-After seconds and retry
+## rather than drop the message. Channels are posted to concurrently, and
+## an error on one channel, of any kind, never loses the others' results.
+## https://api.slack.com/methods/chat.postMessage#rate_limiting
+## https://api.slack.com/docs/rate-limits
+
 class SlackBot:
 
-    def __init__(self, slack_token: str) -> None:
+    def __init__(self, slack_token: str,
+                 workspace_rate: float = 5, channel_rate: float = 1,
+                 max_workers: int = 8, max_retries: int = 5) -> None:
         self.client = slack_sdk.WebClient(token=slack_token)
-        
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.workspace_bucket = TokenBucket(
+            workspace_rate, capacity=workspace_rate)
+        self.channel_buckets: TokenBuckets[str] = TokenBuckets(channel_rate)
+
 
     def send_message(
             self, slack_channel_name: str,
-            message: str) -> None | SlackApiError:
-        """Send a message to a single Slack channel."""
-        try:
-            self.client.chat_postMessage(
-                channel=slack_channel_name,
-                text=message)
-        except SlackApiError as e:
-            # You will get a SlackApiError if "ok" is False
-            # If ok is False, e.response["error"] contains a
-            # str like 'invalid_auth', 'channel_not_found'
-            assert e.response["ok"] is False
-            assert e.response["error"]
-            # print(f"Got an error: {e.response['error']}")
-            return e
+            message: str) -> None | Exception:
+        """Send a message to a single Slack channel. Retries, within
+        max_retries, when Slack asks us to slow down. Returns the error,
+        including connection errors and timeouts, rather than raise it."""
+        channel_bucket = self.channel_buckets[slack_channel_name]
+        for attempt in range(self.max_retries):
+            channel_bucket.acquire()
+            self.workspace_bucket.acquire()
+            try:
+                self.client.chat_postMessage(
+                    channel=slack_channel_name,
+                    text=message)
+            except SlackApiError as e:
+                # You will get a SlackApiError if "ok" is False
+                # If ok is False, e.response["error"] contains a
+                # str like 'invalid_auth', 'channel_not_found'
+                assert e.response["ok"] is False
+                assert e.response["error"]
+                # print(f"Got an error: {e.response['error']}")
+                retry_after = self._retry_after(e)
+                if retry_after is None or attempt == self.max_retries - 1:
+                    return e
+                channel_bucket.pause(retry_after)
+                continue
+            except Exception as e:
+                return e
+            return None
         return None
-    
+
+
+    @staticmethod
+    def _retry_after(e: SlackApiError) -> Optional[float]:
+        """The seconds to wait before retrying, if we were rate limited."""
+        if e.response["error"] != "ratelimited":
+            return None
+        return parse_retry_after(e.response.headers.get("Retry-After"))
+
+
+    def post_messages(
+            self, slack_channel_names: List[str],
+            message: str) -> Dict[str, None | Exception]:
+        """Send a message to multiple Slack channels, concurrently.
+        Returns the error of each channel, None if the message was sent."""
+        if len(slack_channel_names) <= 1:
+            return {name: self.send_message(name, message)
+                    for name in slack_channel_names}
+        workers = min(self.max_workers, len(slack_channel_names))
+        with ThreadPoolExecutor(workers) as pool:
+            errors = pool.map(lambda name: self.send_message(name, message),
+                              slack_channel_names)
+            return dict(zip(slack_channel_names, errors))
+
 
     def send_messages(
             self, slack_channel_names: List[str],
-            message: str) -> None | SlackApiError:
-        """Send a message to multiple Slack channels."""
+            message: str) -> None | Exception:
+        """Send a message to multiple Slack channels, concurrently.
+        See post_messages() for the result of every channel."""
         # Propagate the last error that occurs
         err = None
-        for slack_channel_name in slack_channel_names:
-            this_err = self.send_message(slack_channel_name, message)
+        for this_err in self.post_messages(
+                slack_channel_names, message).values():
             if this_err is not None:
                 err = this_err
         return err
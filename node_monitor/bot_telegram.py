@@ -1,46 +1,117 @@
 import requests
+import requests.adapters
 import textwrap
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from node_monitor.rate_limit import TokenBucket, TokenBuckets, \
+    parse_retry_after
+
+## Rate limits:
+## The Bot API allows about 30 messages per second per bot, and about one
+## per second per chat, and answers 429 with a `retry_after` when we go
+## over. We pace ourselves with a token bucket for the bot and one per
+## chat, and if we still get a 429, wait `retry_after` seconds and retry
+## rather than drop the message. The flood limit is bot-wide, so a 429
+## pauses every chat, not just the one it was for. Chats are sent to
+## concurrently, over one keep-alive session.
+## https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
 
 
 class TelegramBot:
-    def __init__(self, telegram_token: str) -> None:
+    def __init__(self, telegram_token: str,
+                 global_rate: float = 30, chat_rate: float = 1,
+                 max_workers: int = 8, max_retries: int = 5,
+                 timeout: float = 30, concurrent_calls: int = 1) -> None:
+        """`concurrent_calls` is how many post_messages() calls are made at
+        once, e.g. channel_workers['telegram'] when used by the Dispatcher.
+        Each one sends to up to `max_workers` chats at once."""
         self.telegram_token = telegram_token
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_buckets: TokenBuckets[str] = TokenBuckets(chat_rate)
+        # Keep a connection for every send that can be in flight, rather
+        # than open and discard the extras
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(
+            pool_maxsize=concurrent_calls * max_workers))
+
+
+    def _post(self, chat_id: str, text: str) -> requests.Response:
+        """Sends one message within the rate limits, retrying on 429."""
+        url = f"https://api.telegram.org/bot{self.telegram_token}/sendMessage"
+        payload = {"chat_id": chat_id, "text": text}
+        chat_bucket = self.chat_buckets[chat_id]
+        for _ in range(self.max_retries):
+            chat_bucket.acquire()
+            self.global_bucket.acquire()
+            response = self.session.post(url, data=payload,
+                                         timeout=self.timeout)
+            retry_after = self._retry_after(response)
+            if retry_after is None:
+                break
+            chat_bucket.pause(retry_after)
+            self.global_bucket.pause(retry_after)
+        return response
+
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> Optional[float]:
+        """The seconds to wait before retrying, if we were rate limited."""
+        if response.status_code != 429:
+            return None
+        try:
+            return float(response.json()["parameters"]["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            return parse_retry_after(response.headers.get("Retry-After"))
 
 
     def send_message(
             self, chat_id: str, message: str
-        ) -> None | requests.exceptions.HTTPError:
-        """Send a message to a single Telegram chat."""
+        ) -> None | requests.exceptions.RequestException:
+        """Send a message to a single Telegram chat. Returns the error,
+        including connection errors and timeouts, rather than raise it."""
         max_message_length = 4096
 
         # TODO: use itertools.batched here when python version is updated to >=3.12.
         message_parts = [
-            message[i:i + max_message_length] 
+            message[i:i + max_message_length]
             for i in range(0, len(message), max_message_length)]
 
         try:
             for part in message_parts:
-                payload = {"chat_id": chat_id, "text": part}
-                response = requests.post(
-                    f"https://api.telegram.org/bot{self.telegram_token}/sendMessage",
-                    data=payload
-                )
+                response = self._post(chat_id, part)
                 response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
+        except requests.exceptions.RequestException as e:
             return e
         return None
-    
+
+
+    def post_messages(
+            self, chat_ids: List[str], message: str
+            ) -> Dict[str, None | requests.exceptions.RequestException]:
+        """Send a message to multiple Telegram chats, concurrently. An
+        error on one chat doesn't stop the others.
+        Returns the error of each chat, None if the message was sent."""
+        if len(chat_ids) <= 1:
+            return {chat_id: self.send_message(chat_id, message)
+                    for chat_id in chat_ids}
+        with ThreadPoolExecutor(min(self.max_workers, len(chat_ids))) as pool:
+            errors = pool.map(
+                lambda chat_id: self.send_message(chat_id, message), chat_ids)
+            return dict(zip(chat_ids, errors))
+
 
     def send_messages(
             self, chat_ids: List[str], message: str
-            ) -> None | requests.exceptions.HTTPError:
-        """Send a message to multiple Telegram chats."""
+            ) -> None | requests.exceptions.RequestException:
+        """Send a message to multiple Telegram chats, concurrently.
+        See post_messages() for the result of every chat."""
         # Propagate the last error that occurs
         err = None
-        for chat_id in chat_ids:
-            this_err = self.send_message(chat_id, message)
+        for this_err in self.post_messages(chat_ids, message).values():
             if this_err is not None:
                 err = this_err
         return err
-        
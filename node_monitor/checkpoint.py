@@ -0,0 +1,187 @@
+import os
+import json
+import mmap
+import struct
+from array import array
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+
+import node_monitor.ic_api as ic_api
+from node_monitor.node_monitor_helpers.node_state_tracker import \
+    NodeStateTracker
+from node_monitor.node_monitor_helpers.status_ring import StatusRing
+
+Seconds = float
+
+## A checkpoint holds the debounce window of a NodeMonitor (its last K
+## snapshots) and the state of its NodeStateTracker, so that a restarted
+## Node Monitor can resume alerting straight away instead of waiting K
+## polls to fill its window again.
+##
+## File layout:
+##   magic      b"NMCK"
+##   version    uint32
+##   length     uint32, of the header
+##   header     json: string tables, scalars, and the (offset, length) of
+##              every buffer, relative to the start of the data section.
+##              Only the strings the snapshots refer to are saved, and the
+##              columns are renumbered to index into that list.
+##   padding    to a multiple of 8 bytes
+##   data       the raw buffers, each aligned on 8 bytes
+##
+## The file is memory-mapped for reading, so buffers are copied straight
+## from the page cache into their arrays. The file is written to a temp
+## file first and then renamed, so a crash never leaves half a checkpoint.
+
+magic = b"NMCK"
+version = 1
+_prelude = struct.Struct("<4sII")
+
+
+class Checkpoint(NamedTuple):
+    timestamp: Seconds
+    snapshots: List[ic_api.Snapshot]
+    node_states: NodeStateTracker
+
+
+class _Writer:
+    """Collects buffers, recording where each will land in the file."""
+
+    def __init__(self) -> None:
+        self.buffers: List[bytes] = []
+        self.offset = 0
+
+    def add(self, buffer: bytes) -> Tuple[int, int]:
+        location = (self.offset, len(buffer))
+        padding = -len(buffer) % 8
+        self.buffers.append(buffer + b"\0" * padding)
+        self.offset += len(buffer) + padding
+        return location
+
+
+def _referenced_strings(
+        snapshots: List[ic_api.Snapshot]) -> Tuple[List[str], Any]:
+    """The strings the snapshots' columns refer to, and a lookup table
+    from process-wide string codes to their index in that list.
+    The process-wide table only ever grows, so we don't save all of it.
+    """
+    # One extra slot, so that NULL (-1) indexes it and maps to NULL again
+    used = np.zeros(len(ic_api.strings) + 1, dtype=bool)
+    # Snapshots share unchanged columns, mark each one once
+    columns = {id(column): column for snapshot in snapshots
+               for column in snapshot.columns.values()}
+    for column in columns.values():
+        used[np.frombuffer(column, dtype=np.int32)] = True
+    used[-1] = False
+    codes_used = np.flatnonzero(used)
+    dense = np.full(len(used), ic_api.NULL, dtype=np.int32)
+    dense[codes_used] = np.arange(len(codes_used), dtype=np.int32)
+    strings = [ic_api.strings.strings[code] for code in codes_used]
+    return strings, dense
+
+
+def write_checkpoint(path: str, timestamp: Seconds,
+                     snapshots: List[ic_api.Snapshot],
+                     node_states: NodeStateTracker) -> None:
+    """Writes the window and tracker state to `path`, atomically."""
+    writer = _Writer()
+    ring = node_states.ring
+    strings, dense = _referenced_strings(snapshots)
+    header: Dict[str, Any] = {
+        'timestamp': timestamp,
+        'strings': strings,
+        'statuses': ic_api.statuses.strings,
+        'snapshots': [
+            {'columns': {field: writer.add(
+                             dense[np.frombuffer(column, np.int32)].tobytes())
+                         for field, column in snapshot.columns.items()},
+             'status': writer.add(snapshot.status.tobytes())}
+            for snapshot in snapshots],
+        'window': ring.window,
+        'head': ring.head,
+        'ring': writer.add(ring.matrix.tobytes()),
+        'capacity': len(ring.node_ids),
+        'node_ids': ring.node_ids,
+        'last_healthy': writer.add(node_states._last_healthy.tobytes()),
+        'last_update': node_states.last_update,
+        'compromised': node_states.compromised,
+        'recovered': node_states.recovered,
+    }
+    encoded = json.dumps(header).encode()
+    padding = -(_prelude.size + len(encoded)) % 8
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_prelude.pack(magic, version, len(encoded)))
+        f.write(encoded + b" " * padding)
+        for buffer in writer.buffers:
+            f.write(buffer)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: str) -> Optional[Checkpoint]:
+    """Reads a checkpoint written by write_checkpoint. Returns None if
+    there is no checkpoint, or if it was written by another version.
+    String codes are remapped if this process has already interned other
+    strings.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        got_magic, got_version, length = _prelude.unpack_from(mm)
+        if got_magic != magic or got_version != version:
+            return None
+        header = json.loads(mm[_prelude.size:_prelude.size + length])
+        start = _prelude.size + length + (-(_prelude.size + length) % 8)
+
+        def read(location: List[int], dtype: Any) -> Any:
+            """Copies a buffer out of the mapped file into a new ndarray."""
+            offset, size = location
+            itemsize = np.dtype(dtype).itemsize
+            return np.frombuffer(mm, dtype=dtype, count=size // itemsize,
+                                 offset=start + offset).copy()
+
+        # Map the saved string codes onto this process's string tables.
+        # In a fresh process this is the identity.
+        strings = [ic_api.strings.code(s) for s in header['strings']]
+        identity = strings == list(range(len(strings)))
+        # NULL is -1, which indexes the last entry: NULL again
+        string_codes = np.array(strings + [ic_api.NULL], dtype=np.int32)
+        # ABSENT (255) is not a status code either, keep it as is
+        status_codes = np.full(256, 255, dtype=np.uint8)
+        for code, s in enumerate(header['statuses']):
+            status_codes[code] = ic_api.statuses.code(s)
+
+        snapshots: List[ic_api.Snapshot] = []
+        for saved in header['snapshots']:
+            columns = {}
+            for field, location in saved['columns'].items():
+                codes = read(location, np.int32)
+                if not identity:
+                    codes = string_codes[codes]
+                columns[field] = array('i', codes.tobytes())
+            status = status_codes[read(saved['status'], np.uint8)]
+            snapshot = ic_api.Snapshot(columns, array('B', status.tobytes()))
+            if snapshots:
+                snapshot._share_indexes(snapshots[-1])
+            snapshots.append(snapshot)
+
+        window, capacity = header['window'], header['capacity']
+        ring = StatusRing(window, capacity=capacity)
+        ring.matrix = status_codes[read(header['ring'], np.uint8)] \
+            .reshape(capacity, window)
+        ring.head = header['head']
+        ring.node_ids = header['node_ids']
+        ring.rows = {node_id: row for row, node_id
+                     in enumerate(ring.node_ids) if node_id is not None}
+        ring._free = [row for row in range(capacity - 1, -1, -1)
+                      if ring.node_ids[row] is None]
+        node_states = NodeStateTracker(window)
+        node_states.ring = ring
+        node_states._last_healthy = read(header['last_healthy'], np.float64)
+        node_states.last_update = header['last_update']
+        node_states.compromised = header['compromised']
+        node_states.recovered = header['recovered']
+        node_states.resume()
+
+    return Checkpoint(header['timestamp'], snapshots, node_states)
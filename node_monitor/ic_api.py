@@ -1,6 +1,11 @@
-import json
+import gc
+import sys
+import hashlib
+from array import array
+from contextlib import contextmanager
 import requests
-from typing import List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, NamedTuple, \
+    Optional, Sequence, Tuple, Type, TypeVar
 import pydantic
 from pydantic import BaseModel
 
@@ -8,8 +13,9 @@ from pydantic import BaseModel
 ##############################################
 ## Prelim
 assert pydantic.__version__.startswith("2.")
-nodes_endpoint = "https://ic-api.internetcomputer.org/api/v3/nodes"
-node_provider_endpoint = "https://ic-api.internetcomputer.org/api/v3/node-providers"
+ic_api_url = "https://ic-api.internetcomputer.org"
+nodes_endpoint = f"{ic_api_url}/api/v3/nodes"
+node_provider_endpoint = f"{ic_api_url}/api/v3/node-providers"
 
 
 
@@ -46,31 +52,583 @@ class NodeProviders(BaseModel):
     node_providers: List[NodeProvider]
 
 
+
+##############################################
+## Parsing
+
+# We validate straight from the raw response bytes with
+# model_validate_json, which skips building an intermediate tree of python
+# dicts. It is faster than json.loads followed by model_construct without
+# any validation, so there is no unvalidated fast path.
+#
+# Parsing a large payload allocates hundreds of thousands of
+# objects that all survive, which triggers the cyclic garbage collector
+# over and over for nothing. We pause it while parsing.
+# See benchmarks/bench_ic_api.py for numbers.
+
+M = TypeVar('M', bound=BaseModel)
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _construct_all(model: Type[M], items: List[Dict[str, Any]]) -> List[M]:
+    """Equivalent to [model.model_construct(**item) for item in items], but
+    several times faster. When an item has exactly the model's fields, the
+    decoded dict is reused as the instance __dict__ instead of being copied.
+    """
+    fields = set(model.model_fields.keys())
+    setattr_ = object.__setattr__
+    constructed = []
+    for item in items:
+        if item.keys() != fields:
+            item = {k: item[k] for k in fields}
+        obj = model.__new__(model)
+        setattr_(obj, '__dict__', item)
+        setattr_(obj, '__pydantic_fields_set__', fields)
+        setattr_(obj, '__pydantic_extra__', None)
+        setattr_(obj, '__pydantic_private__', None)
+        constructed.append(obj)
+    return constructed
+
+def parse_nodes(raw: str | bytes) -> Nodes:
+    """Parses a json payload from the /nodes endpoint into Nodes"""
+    with _gc_paused():
+        return Nodes.model_validate_json(raw)
+
+def parse_node_providers(raw: str | bytes) -> NodeProviders:
+    """Parses a json payload from the /node-providers endpoint into
+    NodeProviders"""
+    with _gc_paused():
+        return NodeProviders.model_validate_json(raw)
+
+
+
+##############################################
+## Columnar Snapshots
+
+# A Snapshot holds the same information as Nodes, in a fraction of the
+# memory. Instead of one pydantic Node per node, each carrying ten strings,
+# every field is stored as a column of small integer codes that point into
+# a string table shared by all snapshots. Most of these strings repeat
+# across nodes (dc, owner, region...) and across snapshots (node_id...),
+# so each distinct string is only stored once per process. Snapshots built
+# with `previous` also share any column that didn't change, which in
+# practice is every column except `status`.
+# Node objects are only materialized for the rows that are rendered.
+#
+# Every snapshot also carries lazily built indexes (node_id -> row, and
+# field value -> rows for provider, dc, subnet, operator and status).
+# Consumers should use these rather than grouping the nodes themselves;
+# like columns, they are shared by later snapshots for as long as they
+# remain valid.
+
+NULL = -1  # code for a missing value (subnet_id is Optional)
+
+class StringTable:
+    """Interns strings to consecutive integer codes. Append-only."""
+
+    def __init__(self, seed: Iterable[str] = ()) -> None:
+        self.strings: List[str] = []
+        self.codes: Dict[str, int] = {}
+        for s in seed:
+            self.code(s)
+
+    def code(self, s: Optional[str]) -> int:
+        if s is None:
+            return NULL
+        code = self.codes.get(s)
+        if code is None:
+            code = len(self.strings)
+            s = sys.intern(s)
+            self.strings.append(s)
+            self.codes[s] = code
+        return code
+
+    def __getitem__(self, code: int) -> Optional[str]:
+        return None if code == NULL else self.strings[code]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+
+# Shared by all snapshots in the process. Statuses are seeded so that the
+# codes for the statuses we know about never change.
+strings = StringTable()
+statuses = StringTable(['UP', 'UNASSIGNED', 'DEGRADED', 'DOWN'])
+UP, UNASSIGNED, DEGRADED, DOWN = range(4)
+HEALTHY = frozenset({UP, UNASSIGNED})
+COMPROMISED = frozenset({DEGRADED, DOWN})
+
+
+class Snapshot:
+    """A compact, columnar, read-only view of the nodes at one point in time.
+    
+    Attributes:
+        columns: One array of string codes per Node field, except status
+        status: One status code per row, see `statuses`
+    """
+    fields = tuple(k for k in Node.model_fields.keys() if k != 'status')
+
+    def __init__(self, columns: Dict[str, 'array[int]'],
+                 status: 'array[int]') -> None:
+        self.columns = columns
+        self.status = status
+        self._index: Optional[Dict[Principal, int]] = None
+        self._groups: Dict[str, Dict[Optional[str], 'array[int]']] = {}
+
+
+    def _share_indexes(self, previous: 'Snapshot') -> None:
+        """Reuses the indexes of `previous` for every column we share."""
+        if previous.columns['node_id'] is self.columns['node_id']:
+            self._index = previous.index
+        for field, groups in previous._groups.items():
+            if field != 'status' and \
+                    previous.columns[field] is self.columns[field]:
+                self._groups[field] = groups
+
+
+    @classmethod
+    def from_dicts(cls, items: Sequence[Mapping[str, Any]],
+                   previous: Optional['Snapshot'] = None) -> 'Snapshot':
+        """Builds a snapshot from objects with Node's fields, which may be
+        dicts from a json payload or Node instances (see from_nodes)."""
+        code = strings.code
+        columns = {}
+        for field in cls.fields:
+            column = array('i', [code(item[field]) for item in items])
+            if previous is not None and previous.columns[field] == column:
+                column = previous.columns[field]
+            columns[field] = column
+        status = array('B', [statuses.code(item['status']) for item in items])
+        snapshot = cls(columns, status)
+        if previous is not None:
+            snapshot._share_indexes(previous)
+        return snapshot
+
+    @classmethod
+    def from_nodes(cls, nodes: Nodes,
+                   previous: Optional['Snapshot'] = None) -> 'Snapshot':
+        return cls.from_dicts([node.__dict__ for node in nodes.nodes], previous)
+
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    @property
+    def index(self) -> Dict[Principal, int]:
+        """node_id -> row, built on first use."""
+        if self._index is None:
+            node_ids = self.columns['node_id']
+            self._index = {strings.strings[c]: row
+                           for row, c in enumerate(node_ids)}
+        return self._index
+
+    def groups(self, field: str) -> Dict[Optional[str], 'array[int]']:
+        """The rows of every distinct value of a field, built on first use
+        and shared with later snapshots for as long as the column is.
+        Ex. snapshot.groups('dc_id') -> {'an1': array('i', [0, 4, 5]), ...}
+        """
+        groups = self._groups.get(field)
+        if groups is None:
+            groups = {}
+            column = self.status if field == 'status' else self.columns[field]
+            table = statuses if field == 'status' else strings
+            for code, rows in self._group_codes(column, range(len(self))).items():
+                groups[table[code]] = array('i', rows)
+            self._groups[field] = groups
+        return groups
+
+    @staticmethod
+    def _group_codes(column: 'array[int]',
+                     rows: Iterable[int]) -> Dict[int, List[int]]:
+        grouped: Dict[int, List[int]] = {}
+        for row in rows:
+            code = column[row]
+            if code in grouped:
+                grouped[code].append(row)
+            else:
+                grouped[code] = [row]
+        return grouped
+
+    def group(self, field: str, rows: Iterable[int]) -> Dict[Optional[str], List[int]]:
+        """Groups a subset of the rows by the value of a field, without
+        caching. Use groups() for all rows."""
+        column = self.status if field == 'status' else self.columns[field]
+        table = statuses if field == 'status' else strings
+        return {table[code]: rows
+                for code, rows in self._group_codes(column, rows).items()}
+
+    @property
+    def by_provider(self) -> Dict[Optional[str], 'array[int]']:
+        return self.groups('node_provider_id')
+
+    @property
+    def by_dc(self) -> Dict[Optional[str], 'array[int]']:
+        return self.groups('dc_id')
+
+    @property
+    def by_subnet(self) -> Dict[Optional[str], 'array[int]']:
+        return self.groups('subnet_id')
+
+    @property
+    def by_operator(self) -> Dict[Optional[str], 'array[int]']:
+        return self.groups('node_operator_id')
+
+    @property
+    def by_status(self) -> Dict[Optional[str], 'array[int]']:
+        return self.groups('status')
+
+    def node_id(self, row: int) -> Principal:
+        return strings.strings[self.columns['node_id'][row]]
+
+    def get(self, field: str, row: int) -> Optional[str]:
+        """Returns the value of a Node field for the given row."""
+        if field == 'status':
+            return statuses[self.status[row]]
+        return strings[self.columns[field][row]]
+
+    def node(self, row: int) -> Node:
+        """Materializes a single row as a Node."""
+        item = {field: self.get(field, row) for field in self.fields}
+        item['status'] = statuses[self.status[row]]
+        node: Node = _construct_all(Node, [item])[0]
+        return node
+
+    def nodes(self, rows: Optional[Iterable[int]] = None) -> List[Node]:
+        """Materializes the given rows, or every row, as Nodes."""
+        rows = range(len(self)) if rows is None else rows
+        return [self.node(row) for row in rows]
+
+
+    def take(self, rows: Sequence[int]) -> 'Snapshot':
+        """Returns a new snapshot holding only the given rows."""
+        columns = {field: array('i', [column[row] for row in rows])
+                   for field, column in self.columns.items()}
+        status = array('B', [self.status[row] for row in rows])
+        return Snapshot(columns, status)
+
+
+class SnapshotDelta:
+    """The changes between two consecutive snapshots.
+
+    A node whose dc, operator, provider, owner or region changed is recorded
+    as removed and added again, which keeps deltas small while still
+    allowing the later snapshot to be rebuilt exactly.
+
+    Attributes:
+        added: The rows of the nodes that are new in the later snapshot
+        removed: The node_ids that are gone from the later snapshot
+        status_changed: node_id -> (old, new) status code
+        subnet_changed: node_id -> (old, new) string code of the subnet_id
+    """
+
+    def __init__(
+            self,
+            added: Optional[Snapshot] = None,
+            removed: Optional[List[Principal]] = None,
+            status_changed: Optional[Dict[Principal, Tuple[int, int]]] = None,
+            subnet_changed: Optional[Dict[Principal, Tuple[int, int]]] = None
+            ) -> None:
+        self.added = added if added is not None \
+            else Snapshot({f: array('i') for f in Snapshot.fields}, array('B'))
+        self.removed = removed if removed is not None else []
+        self.status_changed = status_changed if status_changed is not None else {}
+        self.subnet_changed = subnet_changed if subnet_changed is not None else {}
+
+    def __bool__(self) -> bool:
+        return bool(len(self.added) or self.removed
+                    or self.status_changed or self.subnet_changed)
+
+    def __repr__(self) -> str:
+        return (f"SnapshotDelta(added={len(self.added)}, "
+                f"removed={len(self.removed)}, "
+                f"status_changed={len(self.status_changed)}, "
+                f"subnet_changed={len(self.subnet_changed)})")
+
+
+    @classmethod
+    def between(cls, previous: Optional[Snapshot],
+                current: Snapshot) -> 'SnapshotDelta':
+        """Computes the delta that turns `previous` into `current`. With no
+        previous snapshot, every node is reported as added."""
+        if previous is None:
+            return cls(added=current)
+        node_ids = current.columns['node_id']
+        same_order = previous.columns['node_id'] is node_ids \
+            or previous.columns['node_id'] == node_ids
+        removed: List[Principal] = []
+        added_rows: List[int] = []
+        pairs: List[Tuple[int, int]] = []
+        if not same_order:
+            pi, ci = previous.index, current.index
+            removed = [node_id for node_id in pi if node_id not in ci]
+            added_rows = [row for node_id, row in ci.items() if node_id not in pi]
+            pairs = [(pi[node_id], row) for node_id, row in ci.items()
+                     if node_id in pi]
+
+        def changed_pairs(old: 'array[int]', new: 'array[int]'
+                          ) -> List[Tuple[int, int]]:
+            """(previous row, current row) of the nodes whose value differs"""
+            if not same_order:
+                return [(p, c) for p, c in pairs if old[p] != new[c]]
+            if old is new or old == new:
+                return []
+            return [(row, row) for row, (o, n) in enumerate(zip(old, new))
+                    if o != n]
+
+        # nodes that changed anything other than status or subnet are
+        # replaced: removed, then added again
+        replaced = set()
+        for field in Snapshot.fields:
+            if field in ('node_id', 'subnet_id'):
+                continue
+            old, new = previous.columns[field], current.columns[field]
+            replaced.update(changed_pairs(old, new))
+        for p, c in sorted(replaced):
+            removed.append(previous.node_id(p))
+            added_rows.append(c)
+
+        node_id = current.node_id
+        status_changed = {
+            node_id(c): (previous.status[p], current.status[c])
+            for p, c in changed_pairs(previous.status, current.status)
+            if (p, c) not in replaced}
+        old_subnets = previous.columns['subnet_id']
+        new_subnets = current.columns['subnet_id']
+        subnet_changed = {
+            node_id(c): (old_subnets[p], new_subnets[c])
+            for p, c in changed_pairs(old_subnets, new_subnets)
+            if (p, c) not in replaced}
+        return cls(current.take(sorted(added_rows)), removed,
+                   status_changed, subnet_changed)
+
+
+    def apply(self, previous: Snapshot) -> Snapshot:
+        """Rebuilds the later snapshot from `previous`. Rows that didn't
+        change keep their order, added rows come last. Unchanged columns
+        are shared with `previous`."""
+        if self.removed or len(self.added):
+            gone = set(self.removed)
+            keep = [row for node_id, row in previous.index.items()
+                    if node_id not in gone]
+            snapshot = previous.take(keep)
+            for field in Snapshot.fields:
+                snapshot.columns[field].extend(self.added.columns[field])
+            snapshot.status.extend(self.added.status)
+        else:
+            columns = dict(previous.columns)
+            status = previous.status
+            if self.status_changed:
+                status = array('B', status)
+            if self.subnet_changed:
+                columns['subnet_id'] = array('i', columns['subnet_id'])
+            snapshot = Snapshot(columns, status)
+            snapshot._share_indexes(previous)
+        index = snapshot.index
+        for node_id, (_, new) in self.status_changed.items():
+            snapshot.status[index[node_id]] = new
+        for node_id, (_, new) in self.subnet_changed.items():
+            snapshot.columns['subnet_id'][index[node_id]] = new
+        return snapshot
+
+
+def parse_snapshot(raw: str | bytes,
+                   previous: Optional[Snapshot] = None) -> Snapshot:
+    """Parses a json payload from the /nodes endpoint into a Snapshot,
+    sharing unchanged columns with `previous` if given."""
+    with _gc_paused():
+        return Snapshot.from_nodes(Nodes.model_validate_json(raw), previous)
+
+
+
+##############################################
+## HTTP Client
+
+class _Validators(NamedTuple):
+    """What we remember about the last response we parsed for a URL."""
+    etag: Optional[str]
+    last_modified: Optional[str]
+    digest: str
+
+
+class ICAPIClient:
+
+    def __init__(
+            self,
+            base_url: str = ic_api_url,
+            session: Optional[requests.Session] = None,
+            timeout: float = 30) -> None:
+        """A keep-alive client for the ic-api.
+
+        All requests go through one pooled requests.Session, so we don't pay
+        for a new TCP/TLS handshake every poll. The `*_if_modified` methods
+        make conditional requests (If-None-Match / If-Modified-Since) and
+        also hash the raw body, returning None when the payload hasn't
+        changed since the last successful parse. This lets the caller skip
+        parsing and analysis entirely.
+
+        Args:
+            base_url: The scheme and host of the ic-api.
+            session: An optional requests.Session, useful for testing.
+            timeout: Seconds to wait for the ic-api before giving up.
+        """
+        self.base_url = base_url.rstrip('/')
+        self.session = session if session is not None else requests.Session()
+        self.timeout = timeout
+        self._validators: Dict[str, _Validators] = {}
+
+
+    @property
+    def nodes_endpoint(self) -> str:
+        return f"{self.base_url}/api/v3/nodes"
+
+    @property
+    def node_provider_endpoint(self) -> str:
+        return f"{self.base_url}/api/v3/node-providers"
+
+
+    def _fetch(self, url: str, params: Optional[Dict[str, str]] = None) -> bytes:
+        """Unconditional GET. Returns the raw response body."""
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+
+    def _fetch_if_modified(
+            self, url: str,
+            params: Optional[Dict[str, str]] = None) -> Optional[bytes]:
+        """Conditional GET. Returns the raw response body, or None if the
+        resource is unchanged since the last call for the same URL/params.
+        Unchanged means either a 304 from the server, or a 200 whose body
+        hashes to the same digest as last time.
+        """
+        key = requests.Request('GET', url, params=params).prepare().url or url
+        previous = self._validators.get(key)
+        headers = {}
+        if previous is not None:
+            if previous.etag:
+                headers['If-None-Match'] = previous.etag
+            if previous.last_modified:
+                headers['If-Modified-Since'] = previous.last_modified
+        response = self.session.get(
+            url, params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and previous is not None:
+            return None
+        response.raise_for_status()
+        digest = hashlib.sha256(response.content).hexdigest()
+        self._validators[key] = _Validators(
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            digest=digest)
+        if previous is not None and previous.digest == digest:
+            return None
+        return response.content
+
+
+    def _forget(self, url: str, params: Optional[Dict[str, str]] = None) -> None:
+        """Drop the cached validators for a URL, so that the next conditional
+        request downloads the full payload. Used when a body fails to parse,
+        otherwise we would keep reporting a broken payload as 'unchanged'.
+        """
+        key = requests.Request('GET', url, params=params).prepare().url or url
+        self._validators.pop(key, None)
+
+
+    def get_nodes(self, provider_id: Optional[Principal] = None) -> Nodes:
+        """slurps nodes from the dfinity api, optional node_provider_id"""
+        payload = {"node_provider_id": provider_id} if provider_id else None
+        raw = self._fetch(self.nodes_endpoint, payload)
+        return parse_nodes(raw)
+
+
+    def get_nodes_if_modified(
+            self, provider_id: Optional[Principal] = None) -> Optional[Nodes]:
+        """Like get_nodes, but returns None if the nodes are unchanged
+        since the last call."""
+        payload = {"node_provider_id": provider_id} if provider_id else None
+        raw = self._fetch_if_modified(self.nodes_endpoint, payload)
+        if raw is None:
+            return None
+        try:
+            return parse_nodes(raw)
+        except Exception:
+            self._forget(self.nodes_endpoint, payload)
+            raise
+
+
+    def get_snapshot(self, previous: Optional[Snapshot] = None) -> Snapshot:
+        """Like get_nodes, but returns a compact Snapshot of all nodes."""
+        raw = self._fetch(self.nodes_endpoint)
+        return parse_snapshot(raw, previous)
+
+
+    def get_snapshot_if_modified(
+            self, previous: Optional[Snapshot] = None) -> Optional[Snapshot]:
+        """Like get_snapshot, but returns None if the nodes are unchanged
+        since the last call."""
+        raw = self._fetch_if_modified(self.nodes_endpoint)
+        if raw is None:
+            return None
+        try:
+            return parse_snapshot(raw, previous)
+        except Exception:
+            self._forget(self.nodes_endpoint)
+            raise
+
+
+    def get_node_providers(self) -> NodeProviders:
+        """slurps node providers from the dfinity api"""
+        raw = self._fetch(self.node_provider_endpoint)
+        return parse_node_providers(raw)
+
+
+    def get_node_providers_if_modified(self) -> Optional[NodeProviders]:
+        """Like get_node_providers, but returns None if the node providers
+        are unchanged since the last call."""
+        raw = self._fetch_if_modified(self.node_provider_endpoint)
+        if raw is None:
+            return None
+        try:
+            return parse_node_providers(raw)
+        except Exception:
+            self._forget(self.node_provider_endpoint)
+            raise
+
+
+# Shared by the module-level functions below
+default_client = ICAPIClient()
+
+
+
 ##############################################
 ## API Fetch Functions
 
 def get_nodes(provider_id: Optional[Principal] = None) -> Nodes:
     """slurps nodes from the dfinity api, optional node_provider_id"""
-    payload = {"node_provider_id": provider_id} if provider_id else None
-    response = requests.get(nodes_endpoint, params=payload)
-    return Nodes(**response.json())
+    return default_client.get_nodes(provider_id)
 
 def get_nodes_from_file(file_path: str) -> Nodes:
     """slurps nodes from a json file previously retrieved with curl"""
-    with open(file_path) as f:
-        j = json.load(f)
-    return Nodes(**j)
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    return parse_nodes(raw)
 
 def get_node_providers() -> NodeProviders:
     """slurps node providers from the dfinity api"""
-    response = requests.get(node_provider_endpoint)
-    return NodeProviders(**response.json())
+    return default_client.get_node_providers()
 
 def get_node_providers_from_file(file_path: str) -> NodeProviders:
     """slurps node providers from a json file previously retrieved with curl"""
-    with open(file_path) as f:
-        j = json.load(f)
-    return NodeProviders(**j)
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    return parse_node_providers(raw)
 
 
 
@@ -22,6 +22,42 @@ NODE_MONITOR_URL    = os.environ.get('NODE_MONITOR_URL',    '')
 EMAIL_ADMINS_LIST   = os.environ.get('EMAIL_ADMINS_LIST',   '').split(',')
 
 
+##############################################
+## Settings
+
+# Number of polls a node must be seen healthy, then DOWN or DEGRADED,
+# before we alert on it. Raise it on noisy days to filter more blips.
+DEBOUNCE_POLLS      = int(os.environ.get('DEBOUNCE_POLLS',  '3'))
+
+# Database backend: 'postgres', or 'sqlite' for a single-node deployment
+# that keeps its subscribers in a local file at DB_PATH, no server needed.
+DB_BACKEND          = os.environ.get('DB_BACKEND',          'postgres')
+DB_PATH             = os.environ.get('DB_PATH',
+                                     'logs/node_provider_db.sqlite3')
+
+# Database connection pool, shared by the monitor thread and the server.
+# Statements running longer than DB_STATEMENT_TIMEOUT seconds are cancelled.
+DB_POOL_MIN         = int(os.environ.get('DB_POOL_MIN',     '1'))
+DB_POOL_MAX         = int(os.environ.get('DB_POOL_MAX',     '5'))
+DB_STATEMENT_TIMEOUT = float(os.environ.get('DB_STATEMENT_TIMEOUT', '10'))
+
+# The ic-api to poll. Point it at a local `python -m simulator` to run
+# Node Monitor against a synthetic fleet, without network access.
+IC_API_URL          = os.environ.get('IC_API_URL',
+                                     'https://ic-api.internetcomputer.org')
+
+# Where to checkpoint the debounce window, so that a restart can resume
+# alerting right away. Set it empty to disable checkpointing.
+CHECKPOINT_PATH     = os.environ.get('CHECKPOINT_PATH',
+                                     'logs/node_monitor.checkpoint')
+
+# Where to queue outgoing messages until they are delivered, so that slow
+# channels don't hold up polling and nothing is lost on a restart.
+# Set it empty to send messages inline instead.
+OUTBOX_PATH         = os.environ.get('OUTBOX_PATH',
+                                     'logs/outbox.sqlite3')
+
+
 
 ## Pre-flight check
 # We assert that the secrets are not empty so that
@@ -29,8 +65,10 @@ EMAIL_ADMINS_LIST   = os.environ.get('EMAIL_ADMINS_LIST',   '').split(',')
 # Note: it may be wise to move this into `__main__.py` instead
 assert EMAIL_USERNAME != '', "Please set email credentials in .env"
 assert EMAIL_PASSWORD != '', "Please set email credentials in .env"
-assert DB_HOST        != '', "Please set database credentials in .env"
-assert DB_USERNAME    != '', "Please set database credentials in .env"
-assert DB_PASSWORD    != '', "Please set database credentials in .env"
-assert DB_NAME        != '', "Please set database credentials in .env"
-assert DB_HOST        != '', "Please set database credentials in .env"
+assert DB_BACKEND in ('postgres', 'sqlite'), "DB_BACKEND: postgres or sqlite"
+if DB_BACKEND == 'postgres':
+    assert DB_HOST        != '', "Please set database credentials in .env"
+    assert DB_USERNAME    != '', "Please set database credentials in .env"
+    assert DB_PASSWORD    != '', "Please set database credentials in .env"
+    assert DB_NAME        != '', "Please set database credentials in .env"
+    assert DB_HOST        != '', "Please set database credentials in .env"
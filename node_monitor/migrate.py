@@ -0,0 +1,45 @@
+import argparse
+import logging
+
+from node_monitor.node_provider_db_base import BaseNodeProviderDB
+from node_monitor.node_provider_db import NodeProviderDB
+from node_monitor.node_provider_db_sqlite import SQLiteNodeProviderDB
+import node_monitor.load_config as c
+
+## Brings the database schema up to date, see NodeProviderDB.migrations.
+## NodeMonitor doesn't run DDL against Postgres when it starts, since the
+## database is shared and DDL needs owner privileges. Run this as the
+## owner when deploying a new version instead:
+##   python3 -m node_monitor.migrate
+## With --foreign-keys it also adds the opt-in cascading foreign keys,
+## see NodeProviderDB.add_foreign_keys().
+## The SQLite backend migrates its own file when it opens it.
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Apply the pending NodeProviderDB migrations.")
+    parser.add_argument(
+        "--foreign-keys", action="store_true",
+        help="delete a subscriber's destinations along with it (Postgres)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if c.DB_BACKEND == 'sqlite':
+        node_provider_db: BaseNodeProviderDB = SQLiteNodeProviderDB(
+            c.DB_PATH, migrate=False)
+        applied = node_provider_db.migrate()
+    else:
+        postgres_db = NodeProviderDB(
+            c.DB_HOST, c.DB_NAME, c.DB_PORT,
+            c.DB_USERNAME, c.DB_PASSWORD, listen=False)
+        applied = postgres_db.migrate()
+        if args.foreign_keys:
+            postgres_db.add_foreign_keys()
+        node_provider_db = postgres_db
+    print(f"Applied migrations: {applied or 'none, already up to date'}")
+    node_provider_db.close()
+
+
+if __name__ == "__main__":
+    main()
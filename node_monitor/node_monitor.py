@@ -1,31 +1,48 @@
+import json
 import time
+import hashlib
+import threading
 from collections import deque
-from typing import Deque, List, Dict, Optional, Callable
-from toolz import groupby # type: ignore
+from datetime import datetime, timezone
+from typing import Deque, List, Dict, Iterable, Optional, Tuple
 import schedule
 import logging
 
 from node_monitor.bot_email import EmailBot
 from node_monitor.bot_slack import SlackBot
 from node_monitor.bot_telegram import TelegramBot
-from node_monitor.node_provider_db import NodeProviderDB
-from node_monitor.node_monitor_helpers.get_compromised_nodes import \
-    get_compromised_nodes
+from node_monitor.node_provider_db_base import BaseNodeProviderDB
+from node_monitor.node_monitor_helpers.node_state_tracker import \
+    NodeStateTracker
+from node_monitor.node_monitor_helpers.snapshot_history import SnapshotHistory
+from node_monitor.node_monitor_helpers.correlate_incidents import \
+    Incident, correlate_incidents
+from node_monitor.node_monitor_helpers.dispatcher import Delivery, Dispatcher
 import node_monitor.node_monitor_helpers.messages as messages
 import node_monitor.ic_api as ic_api
+from node_monitor.checkpoint import write_checkpoint, read_checkpoint
+from node_monitor.outbox import Outbox
 
 Seconds = int
 Principal = str
 sync_interval: Seconds = 60 * 4 # 4 minutes -> Seconds
+history_length: int = 60 * 60 * 6 // sync_interval # 6 hours -> polls
+checkpoint_max_age: Seconds = 2 * sync_interval # older means a gap, start over
+outbox_poll_interval: Seconds = 5 # how often the outbox worker looks for retries
+outbox_purge_interval: Seconds = 60 * 60 # how often it deletes old messages
 
 class NodeMonitor:
 
     def __init__(
             self, 
-            node_provider_db: NodeProviderDB, 
+            node_provider_db: BaseNodeProviderDB, 
             email_bot: EmailBot, 
             slack_bot: Optional[SlackBot] = None, 
-            telegram_bot: Optional[TelegramBot] = None) -> None:
+            telegram_bot: Optional[TelegramBot] = None,
+            ic_api_client: Optional[ic_api.ICAPIClient] = None,
+            debounce_window: int = 3,
+            checkpoint_path: Optional[str] = None,
+            outbox: Optional[Outbox] = None) -> None:
         """NodeMonitor is a class that monitors the status of the nodes.
         It is responsible for syncing the nodes from the ic-api, analyzing
         the nodes, and broadcasting alerts to the appropriate channels.
@@ -34,14 +51,30 @@ class NodeMonitor:
             email_bot: An instance of EmailBot
             slack_bot: An instance of SlackBot
             telegram_bot: An instance of TelegramBot
-            node_provider_db: An instance of NodeProviderDB
+            node_provider_db: A NodeProviderDB or SQLiteNodeProviderDB
+            ic_api_client: An optional instance of ICAPIClient. A default
+                client pointing at the public ic-api is created if omitted.
+            debounce_window: The number of polls a node has to be seen
+                healthy then DOWN or DEGRADED before we alert on it.
+            checkpoint_path: An optional file to save the debounce window
+                to after every step, and to resume from after a restart.
+            outbox: An optional Outbox to queue messages in, delivered by
+                a worker thread. Without it, messages are sent inline.
 
         Attributes:
             email_bot: An instance of EmailBot
             slack_bot: An instance of SlackBot
             telegram_bot: An instance of TelegramBot
-            node_provider_db: An instance of NodeProviderDB
-            snapshots: A deque of the last 3 snapshots of the nodes
+            node_provider_db: A NodeProviderDB or SQLiteNodeProviderDB
+            ic_api_client: An instance of ICAPIClient
+            snapshots: A deque of the last `debounce_window` snapshots
+            history: A delta-encoded history of the last 6 hours of snapshots
+            last_delta: The changes between the last two snapshots, so that
+                later stages only have to look at what changed
+            node_states: The debounce state of every node, updated from
+                last_delta on every resync
+            checkpoint_path: Where the debounce window is checkpointed, or None
+            outbox: The Outbox messages are queued in, or None
             last_update: The timestamp of the last time the nodes were synced
             compromised_nodes: A list of compromised nodes
             compromised_nodes_by_provider: A dict of compromised nodes, grouped
@@ -49,18 +82,32 @@ class NodeMonitor:
             actionables: A dict of compromised nodes, grouped by 
                 node_provider_id, but only including node_providers that are 
                 subscribed to alerts.
+            incidents: A list of the data centers and subnets in an outage
+                that the compromised nodes are part of.
+            deliveries: The outcome of every message of the last broadcast,
+                one per node provider and channel.
         """
         self.node_provider_db = node_provider_db
         self.email_bot = email_bot
         self.slack_bot = slack_bot
         self.telegram_bot = telegram_bot
-        self.snapshots: Deque[ic_api.Nodes] = deque(maxlen=3)
+        self.ic_api_client = ic_api_client if ic_api_client is not None \
+            else ic_api.ICAPIClient()
+        self.snapshots: Deque[ic_api.Snapshot] = deque(maxlen=debounce_window)
+        self.history = SnapshotHistory(maxlen=history_length)
+        self.last_delta = ic_api.SnapshotDelta()
+        self.node_states = NodeStateTracker(window=debounce_window)
+        self.checkpoint_path = checkpoint_path
+        self.outbox = outbox
+        self._outbox_ready = threading.Event()
         self.last_update: float | None = None
         self.last_status_report: float = 0
         self.compromised_nodes: List[ic_api.Node] = []
         self.compromised_nodes_by_provider: \
             Dict[Principal, List[ic_api.Node]] = {}
         self.actionables: Dict[Principal, List[ic_api.Node]] = {}
+        self.incidents: List[Incident] = []
+        self.deliveries: List[Delivery] = []
         self.jobs = [
             schedule.every().day.at("15:00", "UTC").do(
                 self.broadcast_status_report),
@@ -71,99 +118,234 @@ class NodeMonitor:
 
     def _resync(self, override_data: ic_api.Nodes | None = None) -> None:
         """Fetches the current nodes from the ic-api and appends them to the
-        snapshots. Updates the last_update attribute.
+        snapshots and the history. Updates the last_update, last_delta and
+        node_states attributes.
+
+        If the ic-api reports that nothing has changed since the last resync,
+        the previous snapshot is appended again without being re-parsed.
+        The debounce still needs one entry per poll, and appending the same
+        object lets _analyze recognize a window where nothing has changed.
         
         Args:
             override_data: If provided, this arg will be used instead of 
                 live fetching Nodes from the ic-api. Useful for testing.
         """
         logging.info("Resyncing node states from ic-api...")
-        nodes_api = override_data if override_data else ic_api.get_nodes()
-        self.snapshots.append(nodes_api)
+        previous = self.snapshots[-1] if self.snapshots else None
+        if override_data:
+            snapshot = ic_api.Snapshot.from_nodes(override_data, previous)
+        elif previous is not None:
+            snapshot = self.ic_api_client.get_snapshot_if_modified(previous) \
+                or previous
+        else:
+            snapshot = self.ic_api_client.get_snapshot()
+        if snapshot is previous:
+            logging.info("Node states unchanged since last resync.")
         self.last_update = time.time()
+        self.last_delta = self.history.append(snapshot, self.last_update)
+        self.node_states.update(self.last_delta, self.last_update)
+        self.snapshots.append(snapshot)
     
 
     def _analyze(self) -> None:
         """Run analysis on the snapshots.
         Does not query any external services, rather just analyzes the data.
+        The debounce itself is done incrementally by node_states on every
+        resync, so this only has to look up the nodes it found.
         Updates the following attributes from most recently synced data:
             compromised_nodes
             compromised_nodes_by_provider
             actionables
         """
-        if len(self.snapshots) != 3:
+        self.incidents = []
+        if not self.snapshots:
+            return None
+        latest = self.snapshots[-1]
+        rows = [latest.index[node_id]
+                for node_id in self.node_states.compromised]
+        self.compromised_nodes = latest.nodes(rows)
+        if not self.compromised_nodes:
+            self.compromised_nodes_by_provider = {}
+            self.actionables = {}
             return None
-        self.compromised_nodes = get_compromised_nodes(self.snapshots)
-        self.compromised_nodes_by_provider = \
-            groupby(lambda node: node.node_provider_id, self.compromised_nodes)
+        self.compromised_nodes_by_provider = {
+            str(k): latest.nodes(v) for k, v
+            in latest.group('node_provider_id', rows).items()}
         subscriber_ids = self.node_provider_db.get_subscribers_as_dict().keys()
         self.actionables = {k: v for k, v
                             in self.compromised_nodes_by_provider.items()
                             if k in subscriber_ids}
 
 
-    def _make_broadcaster(self) -> Callable[[str, str, str], None]:
-        """A closure that returns a broadcast function with a local cache.
-        Allows the returned function to be run in a loop without
-        querying the database.
+    def _correlate(self) -> None:
+        """Correlates the compromised nodes into incidents, when a whole data
+        center or subnet goes down at once. Run after _analyze.
+        Updates the incidents attribute.
         """
-        subscribers = self.node_provider_db.get_subscribers_as_dict()
-        email_recipients = self.node_provider_db.get_emails_as_dict()
-        slack_channels = self.node_provider_db.get_slack_channels_as_dict()
-        telegram_chats = self.node_provider_db.get_telegram_chats_as_dict()
-
-        def broadcaster(node_provider_id: str,
-                      subject: str, message: str) -> None:
-            """Broadcasts a generic message to a subscriber through their
-            selected communication channel(s)."""
-            preferences = subscribers[node_provider_id]
-            dispatch = f"{subject}\n\n{message}"
-            if preferences['notify_email'] == True:
-                recipients = email_recipients.get(node_provider_id, [])
-                if recipients:
-                    self.email_bot.send_emails(recipients, subject, message)
-            if preferences['notify_slack'] == True:
-                if self.slack_bot:
-                    channels = slack_channels.get(node_provider_id, [])
-                    if channels:
-                        err1 = self.slack_bot.send_messages(channels, dispatch)
-            if preferences['notify_telegram'] == True:
-                if self.telegram_bot:
-                    chats = telegram_chats.get(node_provider_id, [])
-                    if chats:
-                        err2 = self.telegram_bot.send_messages(chats, dispatch)
+        if not self.compromised_nodes:
+            self.incidents = []
             return None
-        
-        return broadcaster
+        self.incidents = correlate_incidents(
+            self.snapshots[-1],
+            (node.node_id for node in self.compromised_nodes))
+        for incident in self.incidents:
+            logging.info(f"Outage detected in {incident.kind} {incident.key}: "
+                         f"{len(incident.node_ids)} of {incident.total} nodes")
+
+
+    def _broadcast(
+            self, outgoing: List[Tuple[Principal, str, str]],
+            node_provider_ids: Optional[Iterable[Principal]] = None,
+            key: str = "") -> None:
+        """Sends every (node_provider_id, subject, message) in `outgoing`
+        through the subscriber's selected channel(s), all concurrently.
+        If node_provider_ids is given, only the routes of those node
+        providers are fetched. Updates the deliveries attribute.
+
+        With an outbox, the messages are queued instead, under the
+        idempotency key `{key}:{node_provider_id}`, see drain_outbox().
+        """
+        if self.outbox is not None:
+            queued = self.outbox.put(
+                (f"{key}:{node_provider_id}", node_provider_id, subject, message)
+                for node_provider_id, subject, message in outgoing)
+            logging.info(f"Queued {queued} messages in the outbox.")
+            self._outbox_ready.set()
+            return None
+        routing_table = self.node_provider_db.get_routing_table(
+            node_provider_ids)
+        dispatcher = Dispatcher(
+            self.email_bot, self.slack_bot, self.telegram_bot)
+        self.deliveries = dispatcher.dispatch(routing_table, outgoing)
+        failed = [d for d in self.deliveries if not d.ok]
+        if failed:
+            logging.error(f"{len(failed)} of {len(self.deliveries)} "
+                          f"deliveries failed")
     
 
     def broadcast_alerts(self) -> None:
         """Broadcast relevant alerts to the appropriate channels."""
-        broadcaster = self._make_broadcaster()
+        if not self.actionables:
+            return None
         node_labels = self.node_provider_db.get_node_labels_as_dict()
+        outgoing = []
         for node_provider_id, nodes in self.actionables.items():
             logging.info(f"Broadcasting alert message to {node_provider_id}...")
-            subject, message = messages.nodes_compromised_message(nodes, node_labels)
-            broadcaster(node_provider_id, subject, message)
+            node_ids = {node.node_id for node in nodes}
+            incidents = [incident for incident in self.incidents
+                         if incident.node_ids & node_ids]
+            if incidents:
+                subject, message = messages.nodes_incident_message(
+                    incidents, nodes, node_labels)
+            else:
+                subject, message = messages.nodes_compromised_message(
+                    nodes, node_labels)
+            outgoing.append((node_provider_id, subject, message))
+        self._broadcast(outgoing, self.actionables.keys(),
+                        key=self._alert_key())
+
+
+    def _alert_key(self) -> str:
+        """The idempotency key of the current alerts, made from what they
+        are about rather than when the step ran, so that a step that is run
+        again after a crash can't queue the same alerts twice. A node is
+        identified along with the last time it was seen healthy, so a node
+        that goes down again later is alerted on again."""
+        compromised = sorted(
+            (node_provider_id, node.node_id,
+             self.node_states.last_healthy(node.node_id))
+            for node_provider_id, nodes in self.actionables.items()
+            for node in nodes)
+        digest = hashlib.sha256(json.dumps(compromised).encode()).hexdigest()
+        return f"alert:{digest[:16]}"
 
 
     def broadcast_status_report(self) -> None:
         """Broadcasts a Node Status Report to all Node Providers."""
-        broadcaster = self._make_broadcaster()
         subscribers = self.node_provider_db.get_subscribers_as_dict()
         node_labels = self.node_provider_db.get_node_labels_as_dict()
-        latest_snapshot_nodes = self.snapshots[-1].nodes
-        all_nodes_by_provider: Dict[Principal, List[ic_api.Node]] = \
-            groupby(lambda node: node.node_provider_id, latest_snapshot_nodes)
-        reportable_nodes = {k: v for k, v
-                            in all_nodes_by_provider.items()
-                            if k in subscribers.keys()}
-        for node_provider_id, nodes in reportable_nodes.items():
+        latest = self.snapshots[-1]
+        outgoing = []
+        for node_provider_id in subscribers.keys():
+            rows = latest.by_provider.get(node_provider_id)
+            if not rows:
+                continue
+            nodes = latest.nodes(rows)
             logging.info(f"Broadcasting status report {node_provider_id}...")
             subject, message = messages.nodes_status_message(nodes, node_labels)
-            broadcaster(node_provider_id, subject, message)
+            outgoing.append((node_provider_id, subject, message))
+        today = datetime.now(timezone.utc).date()
+        self._broadcast(outgoing, key=f"status_report:{today}")
     
 
+    def drain_outbox(self, limit: int = 100) -> int:
+        """Delivers the messages that are due in the outbox, concurrently,
+        and records which of them failed so that they are retried later.
+        A retry only goes to the destinations that failed. Only messages
+        queued by the same broadcast are combined, see Entry.batch.
+        Updates the deliveries attribute. Returns the number of messages."""
+        if self.outbox is None:
+            return 0
+        entries = self.outbox.claim(limit)
+        if not entries:
+            return 0
+        try:
+            routing_table = self.node_provider_db.get_routing_table(
+                {entry.node_provider_id for entry in entries})
+        except Exception as e:
+            # Back off like any failed delivery, rather than claim the
+            # same entries again as soon as their lease runs out
+            logging.error(f"NodeMonitor.drain_outbox() failed to get "
+                          f"the routing table: {e}")
+            for entry in entries:
+                self.outbox.retry(entry, (), f"routing table: {e}")
+            self.deliveries = []
+            return len(entries)
+        dispatcher = Dispatcher(
+            self.email_bot, self.slack_bot, self.telegram_bot)
+        results = dispatcher.dispatch_each(
+            routing_table,
+            [(e.node_provider_id, e.subject, e.message) for e in entries],
+            [e.delivered for e in entries],
+            [e.batch for e in entries])
+        for entry, deliveries in zip(entries, results):
+            failed = [d for d in deliveries if not d.ok]
+            if failed:
+                self.outbox.retry(
+                    entry, {(d.channel, d.destination)
+                            for d in deliveries if d.ok},
+                    "; ".join(f"{d.channel} {d.destination}: {d.error}"
+                              for d in failed))
+            else:
+                self.outbox.done(entry)
+        self.deliveries = [d for deliveries in results for d in deliveries]
+        return len(entries)
+
+
+    def _outbox_worker(self) -> None:
+        """Drains the outbox whenever messages are queued, and every
+        outbox_poll_interval seconds for retries. Deletes old messages
+        every outbox_purge_interval seconds, see Outbox.purge()."""
+        if self.outbox is None:
+            return None
+        purged_at: Optional[float] = None
+        while True:
+            if purged_at is None \
+                    or time.monotonic() - purged_at >= outbox_purge_interval:
+                purged_at = time.monotonic()
+                try:
+                    self.outbox.purge()
+                except Exception as e:
+                    logging.error(f"Outbox.purge() failed: {e}")
+            self._outbox_ready.wait(outbox_poll_interval)
+            self._outbox_ready.clear()
+            try:
+                while self.drain_outbox():
+                    pass
+            except Exception as e:
+                logging.error(f"NodeMonitor.drain_outbox() failed: {e}")
+
+
     def update_node_provider_lookup_if_new(
             self, 
             override_data: ic_api.NodeProviders | None = None) -> None:
@@ -176,8 +358,11 @@ class NodeMonitor:
             override_data: If provided, this arg will be used instead of 
                 live fetching Node Providers from the ic-api. Useful for testing.
         """
-        data = override_data if override_data else ic_api.get_node_providers()
-
+        # Not get_node_providers_if_modified(): the lookup table can fall
+        # behind an unchanged payload (a failed insert, rows removed out of
+        # band), and this runs once a day, so always compare the full list.
+        data = override_data if override_data \
+            else self.ic_api_client.get_node_providers()
         node_providers_api = {d.principal_id: d.display_name for d in data.node_providers}
         node_providers_db = self.node_provider_db.get_node_providers_as_dict()
         
@@ -193,6 +378,38 @@ class NodeMonitor:
 
 
 
+    def save_checkpoint(self) -> None:
+        """Writes the debounce window and node states to checkpoint_path."""
+        if self.checkpoint_path is None or self.last_update is None:
+            return
+        write_checkpoint(self.checkpoint_path, self.last_update,
+                         list(self.snapshots), self.node_states)
+
+
+    def load_checkpoint(self) -> bool:
+        """Resumes from checkpoint_path if it holds a recent checkpoint
+        for the same debounce window, so that we can alert on the very
+        first step instead of waiting for the window to fill up again.
+        Returns True if we resumed."""
+        if self.checkpoint_path is None:
+            return False
+        try:
+            checkpoint = read_checkpoint(self.checkpoint_path)
+        except Exception as e:
+            logging.error(f"NodeMonitor.load_checkpoint() failed: {e}")
+            return False
+        if checkpoint is None or not checkpoint.snapshots \
+                or time.time() - checkpoint.timestamp > checkpoint_max_age \
+                or checkpoint.node_states.window != self.node_states.window:
+            return False
+        self.snapshots.extend(checkpoint.snapshots)
+        self.node_states = checkpoint.node_states
+        self.last_update = checkpoint.timestamp
+        self.history.append(self.snapshots[-1], checkpoint.timestamp)
+        logging.info(f"Resumed from checkpoint at {checkpoint.timestamp}")
+        return True
+
+
     def step(self) -> None:
         """Iterate NodeMonitor one step."""
         try:
@@ -200,13 +417,18 @@ class NodeMonitor:
             # _resync fails, we don't want to analyze or broadcast_alerts.
             self._resync()
             self._analyze()
+            self._correlate()
             self.broadcast_alerts()
+            self.save_checkpoint()
         except Exception as e:
             logging.error(f"NodeMonitor.step() failed with error: {e}")
 
 
     def mainloop(self) -> None:
         """Iterate NodeMonitor in a loop. This is the main entrypoint."""
+        self.load_checkpoint()
+        if self.outbox is not None:
+            threading.Thread(target=self._outbox_worker, daemon=True).start()
         while True:
             self.step()
             schedule.run_pending()
@@ -0,0 +1,52 @@
+from typing import FrozenSet, Iterable, List, NamedTuple
+
+import node_monitor.ic_api as ic_api
+
+Principal = str
+
+# A data center or subnet is considered to be in an outage when at least
+# this many of its nodes, and at least this share of them, are compromised.
+min_incident_nodes = 3
+min_incident_ratio = 0.8
+
+
+class Incident(NamedTuple):
+    """A data center or subnet where (nearly) every node is compromised.
+
+    Attributes:
+        kind: 'dc' or 'subnet'
+        key: The dc_id or subnet_id
+        node_ids: The node_ids of all its compromised nodes, including
+            those that were already compromised before this poll
+        total: The number of nodes in the data center or subnet
+    """
+    kind: str
+    key: str
+    node_ids: FrozenSet[Principal]
+    total: int
+
+
+def correlate_incidents(snapshot: ic_api.Snapshot,
+                        node_ids: Iterable[Principal]) -> List[Incident]:
+    """Finds the data centers and subnets in an outage, out of those that
+    contain at least one of the given (newly compromised) nodes. Uses the
+    snapshot's cached indexes, so the cost depends on the size of the
+    affected data centers and subnets, not on the size of the fleet.
+    """
+    rows = [snapshot.index[node_id] for node_id in node_ids]
+    incidents = []
+    for kind, field in [('dc', 'dc_id'), ('subnet', 'subnet_id')]:
+        groups = snapshot.groups(field)
+        for key in snapshot.group(field, rows):
+            if key is None:
+                continue  # unassigned nodes don't share a subnet
+            members = groups[key]
+            compromised = [row for row in members
+                           if snapshot.status[row] in ic_api.COMPROMISED]
+            if len(compromised) >= min_incident_nodes and \
+                    len(compromised) >= min_incident_ratio * len(members):
+                incidents.append(Incident(
+                    kind, key,
+                    frozenset(snapshot.node_id(row) for row in compromised),
+                    len(members)))
+    return incidents
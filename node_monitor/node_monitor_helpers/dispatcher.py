@@ -0,0 +1,209 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Collection, Dict, Hashable, Iterable, \
+    List, NamedTuple, Optional, Sequence, Tuple
+
+from node_monitor.bot_email import EmailBot
+from node_monitor.bot_slack import SlackBot
+from node_monitor.bot_telegram import TelegramBot
+import node_monitor.node_monitor_helpers.messages as messages
+
+Principal = str
+Route = Dict[str, Any] # a row of NodeProviderDB.get_routing_table()
+
+# The channels, by their columns in the routing table
+route_columns = [
+    ('email', 'notify_email', 'email_addresses'),
+    ('slack', 'notify_slack', 'slack_channel_ids'),
+    ('telegram', 'notify_telegram', 'telegram_chat_ids'),
+]
+
+# The most sends in flight at once, per channel. Each channel gets its own
+# thread pool, so a slow SMTP login only ever holds up other emails. Size
+# the bots' connection pools to match, see TelegramBot(concurrent_calls=).
+channel_workers = {
+    'email': 4,     # every send is an SMTP session, servers throttle logins
+    'slack': 8,
+    'telegram': 8,
+}
+
+
+class Delivery(NamedTuple):
+    """The outcome of sending one message to one node provider, at one
+    destination of one channel.
+
+    Attributes:
+        node_provider_id: Who the message was for
+        channel: 'email', 'slack' or 'telegram'
+        destination: The email address, Slack channel or Telegram chat
+        error: The error the bot returned or raised, None if it was sent
+    """
+    node_provider_id: Principal
+    channel: str
+    destination: str
+    error: Optional[Any] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+
+class Dispatcher:
+    """Sends messages to node providers through every channel they
+    subscribed to, concurrently across providers and channels, and with
+    one message per destination, see _plan()."""
+
+    def __init__(self, email_bot: EmailBot,
+                 slack_bot: Optional[SlackBot] = None,
+                 telegram_bot: Optional[TelegramBot] = None,
+                 workers: Optional[Dict[str, int]] = None) -> None:
+        self.email_bot = email_bot
+        self.slack_bot = slack_bot
+        self.telegram_bot = telegram_bot
+        self.workers = dict(channel_workers, **(workers or {}))
+
+
+    def _send(self, channel: str, destinations: List[str],
+              subject: str, message: str) -> Callable[[], Dict[str, Any]]:
+        """A function that sends one message to `destinations`, with one
+        call to the channel's bot, and returns the error of each
+        destination, None if the message was sent."""
+        dispatch = f"{subject}\n\n{message}"
+        def send() -> Dict[str, Any]:
+            match channel:
+                case 'email':
+                    return self.email_bot.post_emails(
+                        destinations, subject, message)
+                case 'slack':
+                    assert self.slack_bot is not None
+                    return self.slack_bot.post_messages(destinations, dispatch)
+                case _:
+                    assert self.telegram_bot is not None
+                    return self.telegram_bot.post_messages(
+                        destinations, dispatch)
+        return send
+
+
+    def _plan(self, routing_table: Dict[Principal, Route],
+              outgoing: Sequence[Tuple[Principal, str, str]],
+              skip: Optional[Sequence[Collection[Tuple[str, str]]]] = None,
+              batches: Optional[Sequence[Hashable]] = None
+              ) -> List[Tuple[str, List[str], Tuple[int, ...]]]:
+        """Groups the destinations of every message, so that each
+        destination gets one message per dispatch and batch, however many
+        node providers it is subscribed for. Destinations that get the
+        exact same messages are sent to together. The (channel, destination)
+        in skip[i] are skipped for message i.
+        Returns the (channel, destinations, indexes into outgoing) to send.
+        """
+        bots = {'email': self.email_bot, 'slack': self.slack_bot,
+                'telegram': self.telegram_bot}
+        by_destination: Dict[Tuple[Hashable, str, str], List[int]] = {}
+        for i, (node_provider_id, _, _) in enumerate(outgoing):
+            route = routing_table.get(node_provider_id)
+            if route is None:
+                continue
+            batch = batches[i] if batches else None
+            for channel, notify, column in route_columns:
+                if route[notify] != True or not bots[channel]:
+                    continue
+                for destination in route[column]:
+                    if skip and (channel, destination) in skip[i]:
+                        continue
+                    indexes = by_destination.setdefault(
+                        (batch, channel, destination), [])
+                    if i not in indexes:
+                        indexes.append(i)
+        by_messages: Dict[Tuple[str, Tuple[int, ...]], List[str]] = {}
+        for (_, channel, destination), indexes in by_destination.items():
+            by_messages.setdefault((channel, tuple(indexes)), []) \
+                .append(destination)
+        order = [channel for channel, _, _ in route_columns]
+        return sorted(((channel, destinations, indexes) for
+                       (channel, indexes), destinations in by_messages.items()),
+                      key=lambda send: order.index(send[0]))
+
+
+    @staticmethod
+    def _deliver(channel: str, destinations: List[str],
+                 send: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Runs `send`, returns the error of each destination. If `send`
+        raises, that is the error of every destination."""
+        try:
+            errors = dict(send())
+        except Exception as e:
+            errors = dict.fromkeys(destinations, e)
+        for destination, error in errors.items():
+            if error is not None:
+                logging.warning(f"Failed to send {channel} message"
+                                f" to {destination}: {error}")
+        return errors
+
+
+    def dispatch(self, routing_table: Dict[Principal, Route],
+                 outgoing: Iterable[Tuple[Principal, str, str]]
+                 ) -> List[Delivery]:
+        """Sends every (node_provider_id, subject, message) in `outgoing`
+        through the channels in its route, and waits for all of them.
+        Returns the Delivery of every send, for every message, in order.
+        A failed send never stops the others.
+        """
+        return [delivery for deliveries
+                in self.dispatch_each(routing_table, list(outgoing))
+                for delivery in deliveries]
+
+
+    def dispatch_each(self, routing_table: Dict[Principal, Route],
+                      outgoing: Sequence[Tuple[Principal, str, str]],
+                      skip: Optional[Sequence[Collection[Tuple[str, str]]]]
+                          = None,
+                      batches: Optional[Sequence[Hashable]] = None
+                      ) -> List[List[Delivery]]:
+        """Like dispatch(), but returns the deliveries of each message in
+        `outgoing` separately. The (channel, destination) in skip[i] are
+        skipped for message i, e.g. because it was already delivered there.
+        Node providers without a route are skipped altogether.
+
+        A destination with messages for several node providers gets them
+        as one combined message, see _plan(). Each of those messages gets
+        a Delivery for the combined send. If `batches` is given, only
+        messages of the same batch (e.g. queued by the same step) are
+        combined.
+        Every message gets one Delivery per destination, so a retry can
+        skip the destinations it already reached.
+        """
+        plan = self._plan(routing_table, outgoing, skip, batches)
+        sends = []
+        for channel, destinations, indexes in plan:
+            subject, message = messages.combined_message([
+                (routing_table[outgoing[i][0]].get(
+                    'node_provider_name') or outgoing[i][0],
+                 outgoing[i][1], outgoing[i][2])
+                for i in indexes])
+            sends.append(self._send(channel, destinations, subject, message))
+        if len(sends) <= 1:
+            errors = [self._deliver(channel, destinations, send)
+                      for (channel, destinations, _), send in zip(plan, sends)]
+        else:
+            pools = {channel: ThreadPoolExecutor(
+                        max_workers, thread_name_prefix=f"dispatch-{channel}")
+                     for channel, max_workers in self.workers.items()}
+            try:
+                futures = [pools[channel].submit(
+                               self._deliver, channel, destinations, send)
+                           for (channel, destinations, _), send
+                           in zip(plan, sends)]
+                errors = [future.result() for future in futures]
+            finally:
+                for pool in pools.values():
+                    pool.shutdown(wait=False)
+        results: List[List[Delivery]] = [[] for _ in outgoing]
+        for (channel, destinations, indexes), by_destination \
+                in zip(plan, errors):
+            for i in indexes:
+                results[i].extend(
+                    Delivery(outgoing[i][0], channel, destination,
+                             by_destination.get(destination))
+                    for destination in destinations)
+        return results
@@ -1,63 +1,48 @@
-from typing import Deque, List
+from typing import Sequence, List
 import node_monitor.ic_api as ic_api
+from node_monitor.node_monitor_helpers.status_ring import window_of, \
+    compromised_mask
 
-def get_compromised_nodes(snapshots: Deque[ic_api.Nodes]) -> List[ic_api.Node]:
+def get_compromised_nodes(snapshots: Sequence[ic_api.Snapshot]) -> List[ic_api.Node]:
     """
     Function to check for compromised nodes in a deque of snapshots.
     It debounces these checks to filter out temporary blips
 
     Parameters
     ----------
-    snapshots : Deque[ic_api.Nodes]
-        A deque containing exactly three snapshots, where each snapshot is an
-        ic_api.Nodes object representing the nodes fetched from the 
-        ic-api at that time.
+    snapshots : Sequence[ic_api.Snapshot]
+        A deque (or any sequence) of at least two snapshots, oldest first,
+        where each snapshot is an ic_api.Snapshot object representing the
+        nodes fetched from the ic-api at that time. The number of snapshots
+        is the debounce window.
 
     Returns
     -------
     List[ic_api.Node]
-        A list of nodes that are found to be compromised based on the comparison
-        of status across the snapshots.
+        A list of nodes that were healthy in the first snapshot and
+        compromised in every snapshot after it.
 
     Raises:
     -------
     AssertionError
-        If the length of the snapshots deque is not 3.
+        If there are fewer than 2 snapshots.
     """
     
     # We used to use a diff here to monitor any type of changes, but we 
     # prefer this method of checking manually because it results in less code.
     # Original NodeMonitorDiff: commit d743197e4f5da80611ece61e63580b2a65c41491
+    # NodeMonitor itself uses NodeStateTracker, which applies the same
+    # predicate incrementally. This is kept as the reference implementation.
 
-    assert len(snapshots) == 3, \
-        "snapshots must be of length 3, not {}".format(len(snapshots))
-    
-    # destructure the nodes from the snapshots
-    a = snapshots[0].nodes
-    b = snapshots[1].nodes
-    c = snapshots[2].nodes 
-
-    # index the nodes by node_id
-    ai = {node.node_id: node for node in a}
-    bi = {node.node_id: node for node in b}
-    ci = {node.node_id: node for node in c}
+    assert len(snapshots) >= 2, \
+        "snapshots must be at least of length 2, not {}".format(len(snapshots))
 
-    # collect downed nodes
-    compromised_nodes = []
-    for node_id in ci.keys():
-        # if the node just came online in c, skip it to avoid IndexError
-        if node_id not in ai or node_id not in bi: continue
-        node_a = ai[node_id]
-        node_b = bi[node_id]
-        node_c = ci[node_id]
-        # debounce: eliminate false positives
-        # sometimes the nodes go down for a few minutes and come back up
-        node_c_is_compromised: bool = all([
-            node_a.status == 'UP' or node_a.status == 'UNASSIGNED',
-            node_b.status == 'DOWN' or node_b.status == 'DEGRADED',
-            node_c.status == 'DOWN' or node_c.status == 'DEGRADED',
-        ])
-        if node_c_is_compromised:
-            compromised_nodes.append(node_c)
+    # align the statuses of the latest nodes across the snapshots, as a
+    # nodes x snapshots matrix. Nodes that just came online are ABSENT in
+    # the earlier snapshots, which never matches.
+    window = window_of(snapshots)
 
-    return compromised_nodes
+    # debounce: eliminate false positives
+    # sometimes the nodes go down for a few minutes and come back up
+    rows = compromised_mask(window).nonzero()[0]
+    return snapshots[-1].nodes(int(row) for row in rows)
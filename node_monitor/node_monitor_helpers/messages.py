@@ -1,12 +1,18 @@
 from datetime import datetime
+from functools import lru_cache
 from typing import List, Dict, Tuple
 
 import node_monitor.ic_api as ic_api
 import node_monitor.load_config as c
+from node_monitor.node_monitor_helpers.correlate_incidents import Incident
 
 # Forgive me Lord Guido, for I have broken PEP8.
 Principal = str
 
+# The most node details kept rendered, see detailnode(). Enough for the
+# whole fleet, so that the daily report renders each node at most once.
+detailnode_cache_size = 2 ** 16
+
 def datetime_iso8601() -> str:
     """Returns the current time in ISO 8601 format, excluding milliseconds.
     Example: 2021-05-01T00:00:00.
@@ -22,12 +28,20 @@ def detailnode(node: ic_api.Node, label: str) -> str:
         Node ID:          <node_id>
         Live Node Status: <status_url>
     """
-    status_url = f"https://dashboard.internetcomputer.org/node/{node.node_id}"
+    return _detailnode(node.node_id, node.status, label, node.dc_id)
+
+
+@lru_cache(maxsize=detailnode_cache_size)
+def _detailnode(node_id: Principal, status: str, label: str,
+                dc_id: str) -> str:
+    """detailnode(), cached by everything that goes into it. A node is
+    rendered again only once its status or label changes."""
+    status_url = f"https://dashboard.internetcomputer.org/node/{node_id}"
     return (
-        f"Data Center: {node.dc_id.upper()}\n"
+        f"Data Center: {dc_id.upper()}\n"
         f"Node Label: {label}\n"
-        f"Node Status: {node.status}\n"
-        f"Node ID: {node.node_id}\n"
+        f"Node Status: {status}\n"
+        f"Node ID: {node_id}\n"
         f"Live Node Status: {status_url}\n")
 
 
@@ -85,18 +99,80 @@ def nodes_compromised_message(nodes: List[ic_api.Node],
 
 
 
+def detailincident(incident: Incident, nodes: List[ic_api.Node]) -> str:
+    """Returns:
+        Data Center:        <dc_id>
+        Nodes Compromised:  <n> of <total>, <m> of which are yours
+        Live Status:        <status_url>
+    """
+    match incident.kind:
+        case 'dc':
+            header = f"Data Center: {incident.key.upper()}\n"
+            status_url = f"https://dashboard.internetcomputer.org/center/{incident.key}"
+        case _:
+            header = f"Subnet: {incident.key}\n"
+            status_url = f"https://dashboard.internetcomputer.org/subnet/{incident.key}"
+    yours = len([node for node in nodes if node.node_id in incident.node_ids])
+    return (
+        f"{header}"
+        f"Nodes Compromised: {len(incident.node_ids)} of {incident.total}, "
+        f"{yours} of which are yours\n"
+        f"Live Status: {status_url}\n")
+
+
+
+def nodes_incident_message(incidents: List[Incident],
+                           nodes: List[ic_api.Node],
+                           labels: Dict[Principal, str]) -> Tuple[str, str]:
+    """Returns a condensed message for compromised nodes that are part of
+    a data center or subnet outage, in the format of an email or message for
+    a comprable communication channel. Nodes in an outage are summarized by
+    incident, any other compromised nodes are listed in full.
+    """
+    in_incident = set().union(*(incident.node_ids for incident in incidents))
+    others = [node for node in nodes if node.node_id not in in_incident]
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _make_subject() -> str:
+        places = [incident.key.upper() if incident.kind == 'dc'
+                  else f"Subnet {incident.key.split('-')[0]}"
+                  for incident in incidents]
+        return "🔴 Outage @ " + ', '.join(sorted(places))
+    def _make_others_message() -> str:
+        match len(others):
+            case 0: return ""
+            case _: return (f"Other Node(s) Compromised:\n"
+                            f"\n"
+                            f"{detailnodes(others, labels)}\n\n")
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    formatted_incidents = '\n'.join(
+        detailincident(incident, nodes) for incident in incidents)
+    subject = _make_subject()
+    message = (
+        f"Outage(s) Detected:\n"
+        f"\n"
+        f"{formatted_incidents}\n"
+        f"\n"
+        f"{_make_others_message()}"
+        f"Report Generated: {datetime_iso8601()} UTC\n")
+    return (subject, message)
+
+
+
 def nodes_status_message(nodes: List[ic_api.Node],
                          labels: Dict[Principal, str]) -> Tuple[str, str]:
     """Returns a message that describes the status of all nodes, in the
     format of an email or message for a comprable communication channel.
     """
-    nodes_up           = [node for node in nodes if node.status == 'UP']
-    nodes_down         = [node for node in nodes if node.status == 'DOWN']
-    nodes_unassigned   = [node for node in nodes if node.status == 'UNASSIGNED']
-    nodes_degraded     = [node for node in nodes if node.status == 'DEGRADED']
+    # One pass over the nodes, counting every status at once
+    counts = {'UP': 0, 'DOWN': 0, 'UNASSIGNED': 0, 'DEGRADED': 0}
+    nodes_compromised = []
+    for node in nodes:
+        status = node.status
+        if status in counts:
+            counts[status] += 1
+            if status == 'DOWN' or status == 'DEGRADED':
+                nodes_compromised.append(node)
     total_nodes        = len(nodes)
-    nodes_compromised = [node for node in nodes 
-                        if node.status == 'DOWN' or node.status == 'DEGRADED']
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     def _make_diagnostic_message() -> str:
         match len(nodes_compromised):
@@ -114,11 +190,40 @@ def nodes_status_message(nodes: List[ic_api.Node],
     message = (
         f"\nNode Provider: {nodes[0].node_provider_name}\n"
         f"Nodes Total: {total_nodes}\n"
-        f"Node Health: {len(nodes_degraded) + len(nodes_down)} Unhealthy, " 
-        f"{len(nodes_unassigned) + len(nodes_up)} Healthy\n"
-        f"Node Assignment:  {len(nodes_unassigned)} Unassigned, {len(nodes_up)} Assigned\n"
+        f"Node Health: {counts['DEGRADED'] + counts['DOWN']} Unhealthy, " 
+        f"{counts['UNASSIGNED'] + counts['UP']} Healthy\n"
+        f"Node Assignment:  {counts['UNASSIGNED']} Unassigned, {counts['UP']} Assigned\n"
         f"\n\n"
         f"{_make_diagnostic_message()}"
         f"Report generated: {datetime_iso8601()} UTC\n"
     )
     return (subject, message)
+
+
+
+def combined_message(
+        parts: List[Tuple[str, str, str]]) -> Tuple[str, str]:
+    """Returns one message made of several (node_provider_name, subject,
+    message), for a destination that gets messages for several node
+    providers, e.g. an operator that subscribed for all of them.
+    A single part is returned as is. Each part is headed with its node
+    provider, unless its message already names it, like the status report.
+    """
+    if len(parts) == 1:
+        _, subject, message = parts[0]
+        return (subject, message)
+    subjects = list(dict.fromkeys(subject for _, subject, _ in parts))
+    subject = subjects[0] if len(subjects) == 1 \
+        else f"{subjects[0]} (+{len(subjects) - 1} more)"
+    def _section(name: str, part_subject: str, part_message: str) -> str:
+        header = f"Node Provider: {name}\n"
+        if header in part_message:
+            return f"{part_subject}\n{part_message}"
+        return f"{header}{part_subject}\n\n{part_message}"
+    sections = [_section(*part) for part in parts]
+    separator = '-' * 40 + '\n'
+    message = (
+        f"Messages for {len(parts)} Node Providers:\n"
+        f"\n"
+        f"{separator.join(sections)}")
+    return (subject, message)
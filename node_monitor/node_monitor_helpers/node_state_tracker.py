@@ -0,0 +1,131 @@
+from collections import deque
+from typing import Deque, List, Optional
+import numpy as np
+
+import node_monitor.ic_api as ic_api
+from node_monitor.node_monitor_helpers.status_ring import Rows, \
+    StatusRing, compromised_mask, recovered_mask, healthy_lut, compromised_lut
+
+Principal = str
+Seconds = float
+
+
+class NodeStateTracker:
+
+    def __init__(self, window: int = 3) -> None:
+        """Detects compromised and recovered nodes from the change feed of
+        each resync (ic_api.SnapshotDelta).
+
+        The statuses of the last `window` polls are kept in a fleet-wide
+        StatusRing. Both predicates need a node's status to change between
+        the oldest poll of the window and the next one, so only the rows
+        that changed within the window are evaluated, with NumPy, and
+        recording a poll only touches those rows. An update costs O(changes
+        in the window), not O(fleet):
+            compromised: healthy (UP or UNASSIGNED) in the oldest poll of
+                the window, then DOWN or DEGRADED in every poll after it.
+                With the default window of 3 this gives the same result as
+                get_compromised_nodes.
+            recovered: the reverse, DOWN or DEGRADED in the oldest poll,
+                then healthy in every poll after it.
+
+        Args:
+            window: The number of polls in the debounce window
+
+        Attributes:
+            ring: The status codes of the last `window` polls
+            compromised: The node_ids found compromised at the last update
+            recovered: The node_ids found recovered at the last update
+            last_update: The timestamp of the last update
+        """
+        self.window = window
+        self.ring = StatusRing(window)
+        self.compromised: List[Principal] = []
+        self.recovered: List[Principal] = []
+        self.last_update: Optional[Seconds] = None
+        # When each node that isn't healthy now was last seen healthy,
+        # written when it stops being healthy
+        self._last_healthy = np.full(len(self.ring.node_ids), np.nan)
+        # The rows that changed at each of the last window - 1 polls
+        self._changed: Deque[Rows] = deque(maxlen=window - 1)
+
+
+    def _recently_changed(self) -> Rows:
+        """The rows that changed at any of the last window - 1 polls, in
+        row order."""
+        if not self._changed:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(self._changed))
+
+
+    def resume(self) -> None:
+        """Rebuilds what isn't saved along with the ring, after it was
+        restored from a checkpoint. We don't know when in the window a row
+        changed, so a row that changed at all counts for every poll."""
+        matrix = self.ring.matrix
+        changed = np.flatnonzero((matrix != matrix[:, :1]).any(axis=1))
+        self._changed.clear()
+        self._changed.extend([changed] * (self.window - 1))
+
+
+    def update(self, delta: ic_api.SnapshotDelta,
+               timestamp: Seconds) -> List[Principal]:
+        """Records the changes of one resync. Returns the node_ids that 
+        became compromised with this poll, also kept in `compromised`."""
+        ring = self.ring
+        ring.advance(self._recently_changed())
+        added = {delta.added.node_id(row): delta.added.status[row]
+                 for row in range(len(delta.added))}
+        for node_id in delta.removed:
+            # a node that changed dc/provider/etc. is removed and added 
+            # again by the delta, but it is still the same node to us
+            if node_id not in added:
+                ring.remove(node_id)
+        for node_id in added:
+            if node_id not in ring.rows:
+                row = ring.add(node_id)
+                if row >= len(self._last_healthy):
+                    grow = len(ring.node_ids) - len(self._last_healthy)
+                    self._last_healthy = np.concatenate(
+                        [self._last_healthy, np.full(grow, np.nan)])
+                self._last_healthy[row] = np.nan
+        changed = [*added, *delta.status_changed]
+        rows = np.fromiter((ring.rows[node_id] for node_id in changed),
+                           dtype=np.intp, count=len(changed))
+        before = ring.matrix[rows, ring.head]
+        ring.set(list(added), list(added.values()))
+        ring.set(list(delta.status_changed),
+                 [new for _, new in delta.status_changed.values()])
+        if self.last_update is not None:
+            unhealthy = healthy_lut[before] \
+                & ~healthy_lut[ring.matrix[rows, ring.head]]
+            self._last_healthy[rows[unhealthy]] = self.last_update
+        self.last_update = timestamp
+
+        self._changed.append(np.unique(rows))
+        candidates = self._recently_changed()
+        window = ring.ordered(candidates)
+        self.compromised = ring.select(compromised_mask(window), candidates)
+        self.recovered = ring.select(recovered_mask(window), candidates)
+        return self.compromised
+
+
+    def last_healthy(self, node_id: Principal) -> Optional[Seconds]:
+        """Returns the last time the node was seen healthy, or None if it
+        hasn't been since we started tracking it."""
+        row = self.ring.rows[node_id]
+        if healthy_lut[self.ring.matrix[row, self.ring.head]]:
+            return self.last_update
+        last_healthy = float(self._last_healthy[row])
+        return None if np.isnan(last_healthy) else last_healthy
+
+
+    def streak(self, node_id: Principal) -> int:
+        """Returns the number of consecutive polls, up to the window size,
+        that the node has been DOWN or DEGRADED, including the last one."""
+        streak = 0
+        for status in reversed(self.ring.history(node_id)):
+            if not compromised_lut[status]:
+                break
+            streak += 1
+        return streak
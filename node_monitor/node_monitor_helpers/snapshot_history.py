@@ -0,0 +1,72 @@
+from collections import deque
+from typing import Deque, Iterator, Optional, Tuple
+
+import node_monitor.ic_api as ic_api
+
+Seconds = float
+
+
+class SnapshotHistory:
+    """A delta-encoded history of snapshots.
+
+    Consecutive snapshots usually differ by a handful of node statuses, so
+    instead of keeping every snapshot in full we keep the oldest retained
+    snapshot (the base) and one ic_api.SnapshotDelta per poll after it.
+    Once more than `maxlen` deltas are held, the oldest delta is folded
+    into the base.
+
+    Attributes:
+        base: The oldest retained snapshot
+        base_time: The time at which the base snapshot was taken
+        deltas: (timestamp, delta) for every poll after the base
+        latest: The most recent snapshot
+    """
+
+    def __init__(self, maxlen: int) -> None:
+        self.maxlen = maxlen
+        self.base: Optional[ic_api.Snapshot] = None
+        self.base_time: Seconds = 0
+        self.deltas: Deque[Tuple[Seconds, ic_api.SnapshotDelta]] = deque()
+        self.latest: Optional[ic_api.Snapshot] = None
+
+
+    def append(self, snapshot: ic_api.Snapshot,
+               timestamp: Seconds) -> ic_api.SnapshotDelta:
+        """Records a snapshot and returns its delta to the previous one.
+        For the first snapshot every node is reported as added."""
+        delta = ic_api.SnapshotDelta.between(self.latest, snapshot)
+        self.latest = snapshot
+        if self.base is None:
+            self.base, self.base_time = snapshot, timestamp
+            return delta
+        self.deltas.append((timestamp, delta))
+        if len(self.deltas) > self.maxlen:
+            self.base_time, oldest = self.deltas.popleft()
+            self.base = oldest.apply(self.base)
+        return delta
+
+
+    def __len__(self) -> int:
+        return 0 if self.base is None else len(self.deltas) + 1
+
+
+    def __iter__(self) -> Iterator[Tuple[Seconds, ic_api.Snapshot]]:
+        """Rebuilds every retained snapshot, oldest first."""
+        if self.base is None:
+            return
+        snapshot = self.base
+        yield self.base_time, snapshot
+        for timestamp, delta in self.deltas:
+            snapshot = delta.apply(snapshot)
+            yield timestamp, snapshot
+
+
+    def at(self, timestamp: Seconds) -> Optional[ic_api.Snapshot]:
+        """Returns the snapshot that was current at `timestamp`, or None if
+        it is older than the retained history."""
+        found = None
+        for t, snapshot in self:
+            if t > timestamp:
+                break
+            found = snapshot
+        return found
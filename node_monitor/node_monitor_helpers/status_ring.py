@@ -0,0 +1,165 @@
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import numpy.typing as npt
+
+import node_monitor.ic_api as ic_api
+
+Principal = str
+StatusMatrix = npt.NDArray[np.uint8]
+Mask = npt.NDArray[np.bool_]
+Rows = npt.NDArray[np.intp]
+
+# Status code for a node that wasn't there at that poll. It is neither
+# healthy nor compromised, so a node has to be present for the whole
+# window to match either predicate.
+ABSENT = 255
+
+# Lookup tables from status code to predicate, so that a whole matrix of
+# status codes can be classified at once with fancy indexing.
+healthy_lut = np.zeros(256, dtype=np.bool_)
+healthy_lut[list(ic_api.HEALTHY)] = True
+compromised_lut = np.zeros(256, dtype=np.bool_)
+compromised_lut[list(ic_api.COMPROMISED)] = True
+
+
+def compromised_mask(window: StatusMatrix) -> Mask:
+    """Nodes that were healthy in the oldest poll of the window and DOWN
+    or DEGRADED in every poll after it.
+    `window` is a nodes x K matrix of status codes, oldest poll first."""
+    return healthy_lut[window[:, 0]] & \
+        compromised_lut[window[:, 1:]].all(axis=1)
+
+
+def recovered_mask(window: StatusMatrix) -> Mask:
+    """Nodes that were DOWN or DEGRADED in the oldest poll of the window
+    and healthy in every poll after it.
+    `window` is a nodes x K matrix of status codes, oldest poll first."""
+    return compromised_lut[window[:, 0]] & \
+        healthy_lut[window[:, 1:]].all(axis=1)
+
+
+def window_of(snapshots: Sequence[ic_api.Snapshot]) -> StatusMatrix:
+    """Aligns the statuses of the last snapshot's nodes across all the
+    snapshots, as a nodes x K matrix, oldest poll first."""
+    latest = snapshots[-1]
+    window = np.full((len(latest), len(snapshots)), ABSENT, dtype=np.uint8)
+    latest_ids = latest.columns['node_id']
+    for k, snapshot in enumerate(snapshots):
+        status = np.frombuffer(snapshot.status, dtype=np.uint8)
+        if snapshot.columns['node_id'] is latest_ids \
+                or snapshot.columns['node_id'] == latest_ids:
+            window[:, k] = status
+            continue
+        index = snapshot.index
+        rows = np.array([index.get(latest.node_id(row), -1)
+                         for row in range(len(latest))], dtype=np.intp)
+        present = rows >= 0
+        window[present, k] = status[rows[present]]
+    return window
+
+
+class StatusRing:
+
+    def __init__(self, window: int, capacity: int = 1024) -> None:
+        """A fleet-wide ring buffer of the status codes of the last `window`
+        polls, stored as a nodes x window matrix. Each node keeps its row
+        for as long as it is present, so recording a poll only has to
+        touch the rows that changed.
+
+        Args:
+            window: The number of polls to keep
+            capacity: The initial number of rows, grown as needed
+
+        Attributes:
+            matrix: The nodes x window matrix of status codes
+            head: The column of the most recent poll
+            rows: The row of every node, by node_id
+            node_ids: The node_id of every row, or None for free rows
+        """
+        assert window >= 2, "window must be at least 2, not {}".format(window)
+        self.window = window
+        self.matrix: StatusMatrix = \
+            np.full((capacity, window), ABSENT, dtype=np.uint8)
+        self.head = 0
+        self.rows: Dict[Principal, int] = {}
+        self.node_ids: List[Principal | None] = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+    def _grow(self) -> None:
+        capacity = len(self.node_ids)
+        extra = np.full((capacity, self.window), ABSENT, dtype=np.uint8)
+        self.matrix = np.concatenate([self.matrix, extra])
+        self.node_ids.extend([None] * capacity)
+        self._free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+
+    def add(self, node_id: Principal) -> int:
+        """Allocates a row for a new node, with no history."""
+        if not self._free:
+            self._grow()
+        row = self._free.pop()
+        self.matrix[row] = ABSENT
+        self.rows[node_id] = row
+        self.node_ids[row] = node_id
+        return row
+
+
+    def remove(self, node_id: Principal) -> None:
+        row = self.rows.pop(node_id)
+        self.matrix[row] = ABSENT
+        self.node_ids[row] = None
+        self._free.append(row)
+
+
+    def advance(self, rows: Optional[Rows] = None) -> None:
+        """Starts a new poll, which begins as a copy of the previous one.
+        The new poll's column still holds the oldest poll, so only the rows
+        that changed since then have to be copied. Pass them as `rows` if
+        they are known, else every row is copied."""
+        previous = self.head
+        self.head = (self.head + 1) % self.window
+        if rows is None:
+            self.matrix[:, self.head] = self.matrix[:, previous]
+        else:
+            self.matrix[rows, self.head] = self.matrix[rows, previous]
+
+
+    def set(self, node_ids: Sequence[Principal], codes: Sequence[int]) -> None:
+        """Sets the status codes of the current poll for the given nodes."""
+        if node_ids:
+            rows = np.fromiter((self.rows[n] for n in node_ids),
+                               dtype=np.intp, count=len(node_ids))
+            self.matrix[rows, self.head] = codes
+
+
+    def current(self) -> StatusMatrix:
+        """The status codes of the current poll, by row."""
+        return self.matrix[:, self.head]
+
+
+    def ordered(self, rows: Optional[Rows] = None) -> StatusMatrix:
+        """The matrix with its columns in poll order, oldest first. Only
+        the given rows, if any."""
+        order = [(self.head + 1 + k) % self.window for k in range(self.window)]
+        if rows is None:
+            return self.matrix[:, order]
+        return self.matrix[rows][:, order]
+
+
+    def history(self, node_id: Principal) -> StatusMatrix:
+        """The status codes of a single node, oldest poll first."""
+        return np.roll(self.matrix[self.rows[node_id]], -(self.head + 1))
+
+
+    def select(self, mask: Mask,
+               rows: Optional[Rows] = None) -> List[Principal]:
+        """The node_ids of the rows selected by a mask, over the given rows
+        if any, else over every row."""
+        selected = np.flatnonzero(mask) if rows is None else rows[mask]
+        node_ids = [self.node_ids[row] for row in selected]
+        return [node_id for node_id in node_ids if node_id is not None]
@@ -1,9 +1,15 @@
-from typing import List, Dict, Any, Optional, Tuple
-import psycopg2, psycopg2.extensions, psycopg2.pool
-from psycopg2.extras import DictCursor, RealDictCursor
-from toolz import groupby # type: ignore
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterable, Iterator, Optional, \
+    Sequence, Set, Tuple
+import psycopg2, psycopg2.errors, psycopg2.extensions, psycopg2.pool
+from psycopg2.extras import DictCursor, RealDictCursor, execute_values
 
-Principal = str
+from node_monitor.node_provider_db_base import BaseNodeProviderDB, Principal
+
+Connection = psycopg2.extensions.connection
 
 ## This class is a rewrite of our previous NodeProviderDB class.
 ## The previous class represented a slightly different database schema.
@@ -23,10 +29,30 @@ Principal = str
 ## but we will probably never need to call it:
 ## https://stackoverflow.com/questions/47018695/psycopg2-close-connection-pool
 ##
+## Pooling:
+## The monitor thread and the Flask handlers share one ThreadedConnectionPool.
+## Connections are only ever borrowed through `_connection()`, which always
+## returns them, commits or rolls back, and drops connections that broke.
+## Callers wait up to `pool_timeout` for a free connection rather than
+## failing straight away when the pool is exhausted. Every connection has
+## a statement_timeout, so a stuck query can't hold a connection forever.
+## The fixed lookup queries are server-side prepared statements, prepared
+## once per connection.
+##
+## Caching:
+## See node_provider_db_base.py. A statement-level trigger on every table
+## (see migration 3) sends a NOTIFY with the table name when it changes,
+## which we LISTEN to on a dedicated connection and use to drop the stale
+## entry. Checking for notifications is a non-blocking read on that
+## connection's socket. If we can't LISTEN, e.g. while Postgres restarts,
+## we cache with the TTL alone and try again once per TTL.
+## https://www.postgresql.org/docs/current/sql-notify.html
+## https://www.psycopg.org/docs/advanced.html#asynchronous-notifications
+##
 
 
-class NodeProviderDB:
-    """A class to interact with the node_provider database."""
+class NodeProviderDB(BaseNodeProviderDB):
+    """A class to interact with the node_provider database in Postgres."""
 
     # Postgres has no efficiency gain for using a VARCHAR instead of TEXT
     # Here we use TEXT because it was inherited from the previous schema.
@@ -39,7 +65,7 @@ class NodeProviderDB:
             notify_email BOOLEAN,
             notify_slack BOOLEAN,
             notify_telegram BOOLEAN,
-            node_provider_name TEXT,
+            node_provider_name TEXT
         )
         """
     schema_table_subscribers = {
@@ -117,15 +143,361 @@ class NodeProviderDB:
         'node_provider_name': 'text'
     }
 
+    # cache invalidation: NOTIFY on every change to a table
+    notify_channel = 'node_provider_db_changed'
+    create_function_notify_changed = f"""
+        CREATE OR REPLACE FUNCTION notify_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{notify_channel}', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """
+
+    # Migrations, applied in order by migrate(). Version N is migrations[N-1].
+    # Never edit or reorder a migration that has shipped, append a new one.
+    # They need owner privileges, so they are run by `python3 -m
+    # node_monitor.migrate` rather than on every start, see migrate.py.
+    migrations_lock = 0x6e6d6462 # any constant, unique to this app
+    create_table_schema_migrations = """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """
+    migrations = [
+        # 1: the tables, which may already exist
+        ";".join([create_table_subscribers,
+                  create_table_email_lookup,
+                  create_table_slack_channel_lookup,
+                  create_table_telegram_chat_lookup,
+                  create_table_node_label_lookup,
+                  create_table_node_provider_lookup]),
+        # 2: index the one-to-many lookups by node provider
+        """
+        CREATE INDEX IF NOT EXISTS email_lookup_node_provider_id_idx
+            ON email_lookup (node_provider_id);
+        CREATE INDEX IF NOT EXISTS slack_channel_lookup_node_provider_id_idx
+            ON slack_channel_lookup (node_provider_id);
+        CREATE INDEX IF NOT EXISTS telegram_chat_lookup_node_provider_id_idx
+            ON telegram_chat_lookup (node_provider_id)
+        """,
+        # 3: NOTIFY on every change to a cached table, see Caching above.
+        # Earlier versions installed these on every start, hence the DROP.
+        create_function_notify_changed + """;
+        DROP TRIGGER IF EXISTS notify_changed ON subscribers;
+        CREATE TRIGGER notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON subscribers
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_changed();
+        DROP TRIGGER IF EXISTS notify_changed ON email_lookup;
+        CREATE TRIGGER notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON email_lookup
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_changed();
+        DROP TRIGGER IF EXISTS notify_changed ON slack_channel_lookup;
+        CREATE TRIGGER notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON slack_channel_lookup
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_changed();
+        DROP TRIGGER IF EXISTS notify_changed ON telegram_chat_lookup;
+        CREATE TRIGGER notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON telegram_chat_lookup
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_changed();
+        DROP TRIGGER IF EXISTS notify_changed ON node_label_lookup;
+        CREATE TRIGGER notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON node_label_lookup
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_changed();
+        DROP TRIGGER IF EXISTS notify_changed ON node_provider_lookup;
+        CREATE TRIGGER notify_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON node_provider_lookup
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_changed()
+        """,
+    ]
+
+    # Opt-in, see add_foreign_keys(): a node provider's destinations go away
+    # with its subscription. Added NOT VALID, so that they apply to new rows
+    # without failing on (or scanning) the rows that are already there.
+    # Postgres has no ADD CONSTRAINT IF NOT EXISTS, hence the checks.
+    create_foreign_keys = """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                    WHERE conname = 'email_lookup_node_provider_id_fkey') THEN
+                ALTER TABLE email_lookup
+                    ADD CONSTRAINT email_lookup_node_provider_id_fkey
+                    FOREIGN KEY (node_provider_id) REFERENCES subscribers
+                    ON DELETE CASCADE NOT VALID;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                    WHERE conname = 'slack_channel_lookup_node_provider_id_fkey') THEN
+                ALTER TABLE slack_channel_lookup
+                    ADD CONSTRAINT slack_channel_lookup_node_provider_id_fkey
+                    FOREIGN KEY (node_provider_id) REFERENCES subscribers
+                    ON DELETE CASCADE NOT VALID;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                    WHERE conname = 'telegram_chat_lookup_node_provider_id_fkey') THEN
+                ALTER TABLE telegram_chat_lookup
+                    ADD CONSTRAINT telegram_chat_lookup_node_provider_id_fkey
+                    FOREIGN KEY (node_provider_id) REFERENCES subscribers
+                    ON DELETE CASCADE NOT VALID;
+            END IF;
+        END
+        $$
+    """
+
+    # Fixed lookup queries, run as server-side prepared statements.
+    # The destinations of each subscriber are aggregated in a LATERAL
+    # subquery, so that the three one-to-many lookups don't multiply into
+    # each other, and so that for a few subscribers each lookup is an index
+    # scan on node_provider_id rather than a full scan.
+    prepared_statements = {
+        'select_subscribers': "SELECT * FROM subscribers",
+        'select_email_lookup': "SELECT * FROM email_lookup",
+        'select_slack_channel_lookup': "SELECT * FROM slack_channel_lookup",
+        'select_telegram_chat_lookup': "SELECT * FROM telegram_chat_lookup",
+        'select_node_label_lookup': "SELECT * FROM node_label_lookup",
+        'select_node_provider_lookup': "SELECT * FROM node_provider_lookup",
+        'select_routing_table': """
+            SELECT s.*,
+                COALESCE(e.destinations, '{}') AS email_addresses,
+                COALESCE(sc.destinations, '{}') AS slack_channel_ids,
+                COALESCE(t.destinations, '{}') AS telegram_chat_ids
+            FROM subscribers s
+            LEFT JOIN LATERAL (
+                SELECT array_agg(email_address ORDER BY id) AS destinations
+                FROM email_lookup WHERE node_provider_id = s.node_provider_id
+            ) e ON true
+            LEFT JOIN LATERAL (
+                SELECT array_agg(slack_channel_id ORDER BY id) AS destinations
+                FROM slack_channel_lookup
+                WHERE node_provider_id = s.node_provider_id
+            ) sc ON true
+            LEFT JOIN LATERAL (
+                SELECT array_agg(telegram_chat_id ORDER BY id) AS destinations
+                FROM telegram_chat_lookup
+                WHERE node_provider_id = s.node_provider_id
+            ) t ON true
+            WHERE $1::text[] IS NULL OR s.node_provider_id = ANY($1::text[])
+        """,
+    }
+
+    # The statements of BaseNodeProviderDB's public API
+    insert_node_providers_query = """
+        INSERT INTO node_provider_lookup (
+            node_provider_id,
+            node_provider_name
+        ) VALUES %s
+        ON CONFLICT (node_provider_id) DO NOTHING
+    """
+    delete_node_provider_query = """
+        DELETE FROM node_provider_lookup
+        WHERE node_provider_id = %s
+    """
+
 
     ## Methods
     def __init__(self, host: str, db: str, port: str,
-                 username: str,password: str) -> None:
-        self.pool = psycopg2.pool.SimpleConnectionPool(
-            1, 3, host=host, database=db, port=port,
-            user=username, password=password)
-    
-    
+                 username: str,password: str,
+                 cache_ttl: float = 15 * 60, listen: bool = True,
+                 pool_min: int = 1, pool_max: int = 5,
+                 pool_timeout: float = 30,
+                 statement_timeout: float = 10,
+                 health_check_interval: float = 60,
+                 migrate: bool = False,
+                 slow_query: Optional[float] = 1.0) -> None:
+        """
+        Parameters
+        ----------
+        cache_ttl : float
+            Seconds before a cached lookup is read again, see Caching above.
+        listen : bool
+            LISTEN for changes to invalidate the cache, see Caching above.
+        pool_min, pool_max : int
+            The number of connections kept open, and the most we open.
+        pool_timeout : float
+            Seconds to wait for a free connection before raising PoolError.
+        statement_timeout : float
+            Seconds before Postgres cancels a statement.
+        health_check_interval : float
+            A connection idle for longer than this is checked with a
+            `SELECT 1` before it is handed out.
+        migrate : bool
+            Bring the schema up to date, see migrate(). Off by default,
+            since it needs owner privileges, see migrate.py.
+        slow_query : Optional[float]
+            Statements slower than this many seconds are logged.
+        """
+        super().__init__(cache_ttl, slow_query)
+        self._dsn: Dict[str, Any] = dict(
+            host=host, database=db, port=port,
+            user=username, password=password,
+            options=f"-c statement_timeout={int(statement_timeout * 1000)}")
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            pool_min, pool_max, **self._dsn)
+        self.pool_timeout = pool_timeout
+        self.health_check_interval = health_check_interval
+        self._slots = threading.BoundedSemaphore(pool_max)
+        self._last_used: Dict[Connection, float] = {}
+        self._prepared: Dict[Connection, Set[str]] = {}
+        self._generation = 0
+        self._listener: Optional[Connection] = None
+        self._listener_lock = threading.Lock()
+        self._listen_retry_at: Optional[float] = None # None: not listening
+        if migrate:
+            self.migrate()
+        if listen:
+            self._listen()
+
+
+    def migrate(self) -> List[int]:
+        """Applies the migrations that haven't been applied yet, each in
+        its own transaction along with its entry in schema_migrations.
+        An advisory lock makes concurrent instances wait for each other
+        rather than apply the same migration twice.
+
+        Returns
+        -------
+        List[int]
+            The versions that were applied, if any.
+        """
+        self._execute(self.create_table_schema_migrations, ())
+        applied = []
+        for version, migration in enumerate(self.migrations, start=1):
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_xact_lock(%s)",
+                                (self.migrations_lock,))
+                    cur.execute("SELECT 1 FROM schema_migrations "
+                                "WHERE version = %s", (version,))
+                    if cur.fetchone() is not None:
+                        continue
+                    cur.execute(migration)
+                    cur.execute("INSERT INTO schema_migrations (version) "
+                                "VALUES (%s)", (version,))
+            logging.info(f"NodeProviderDB: applied migration {version}")
+            applied.append(version)
+        if applied:
+            self.invalidate()
+        return applied
+
+
+    def add_foreign_keys(self) -> None:
+        """Makes deleting a subscriber delete its destinations too, with
+        cascading foreign keys. Opt-in, since without them the destinations
+        are kept. Does nothing if they already exist."""
+        self._execute(self.create_foreign_keys, ())
+
+
+    def _listen(self) -> None:
+        """Opens the listening connection. The triggers that NOTIFY are
+        installed by migration 3. On failure we log it, rely on the TTL
+        alone, and try again after `cache_ttl` seconds."""
+        try:
+            listener = psycopg2.connect(**self._dsn)
+            listener.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with listener.cursor() as cur:
+                cur.execute(f"LISTEN {self.notify_channel}")
+            self._listener = listener
+        except Exception as e:
+            logging.warning(f"NodeProviderDB: LISTEN failed, caching with "
+                            f"a TTL only until we retry: {e}")
+            self._listener = None
+            self._listen_retry_at = time.monotonic() + self.cache_ttl
+
+
+    def _drain_notifications(self) -> None:
+        """Drops the cache entries of tables that changed, as announced by
+        NOTIFY. If the listening connection broke, drops everything (we
+        can't know what we missed) and reconnects. If reconnecting failed,
+        tries again once it is due, see _listen()."""
+        if self._listener is None:
+            if self._listen_retry_at is None \
+                    or time.monotonic() < self._listen_retry_at:
+                return
+            with self._listener_lock:
+                if self._listener is None:
+                    self._listen()
+                    if self._listener is not None:
+                        logging.info("NodeProviderDB: listening again")
+                        self.invalidate()
+            return
+        with self._listener_lock:
+            try:
+                self._listener.poll()
+            except Exception as e:
+                logging.warning(
+                    f"NodeProviderDB: lost the LISTEN connection: {e}")
+                self.invalidate()
+                self._listen()
+                return
+            while self._listener.notifies:
+                notify = self._listener.notifies.pop()
+                self.invalidate(notify.payload)
+
+
+    def _is_healthy(self, conn: Connection) -> bool:
+        """Checks a connection with a round-trip to the database."""
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+    def _checkout(self) -> Connection:
+        """Takes a connection from the pool, replacing it if it is broken."""
+        conn: Connection = self.pool.getconn()
+        last_used = self._last_used.get(conn)
+        idle = 0 if last_used is None else time.monotonic() - last_used
+        if conn.closed or \
+                (idle > self.health_check_interval and not self._is_healthy(conn)):
+            self._checkin(conn, broken=True)
+            conn = self.pool.getconn()
+        return conn
+
+
+    def _checkin(self, conn: Connection, broken: bool) -> None:
+        """Returns a connection to the pool. Broken ones are closed."""
+        if broken:
+            self._last_used.pop(conn, None)
+            self._prepared.pop(conn, None)
+        else:
+            self._last_used[conn] = time.monotonic()
+        self.pool.putconn(conn, close=broken)
+
+
+    @contextmanager
+    def _connection(self) -> Iterator[Connection]:
+        """Borrows a connection from the pool. The transaction is committed
+        if the block succeeds and rolled back if it raises. Either way the
+        connection goes back to the pool, or is closed if it broke.
+        Waits up to `pool_timeout` seconds for a free connection."""
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            raise psycopg2.pool.PoolError(
+                f"no free connection after {self.pool_timeout}s")
+        try:
+            conn = self._checkout()
+            broken = False
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                broken = bool(conn.closed) or isinstance(
+                    e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+                if not broken:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        broken = True
+                raise
+            finally:
+                self._checkin(conn, broken)
+        finally:
+            self._slots.release()
+
+
     def _execute(self, sql: str,
                  params: Tuple[Any, ...]) -> List[Dict[str, Any]]:
         """Execute a SQL statement with a connection from the pool. All
@@ -152,19 +524,20 @@ class NodeProviderDB:
         # 1. conn.commit() is necessary for queries that write to the database,
         #    and adds insignificant overhead for read-only queries. This allows 
         #    us to use the same method for both read and write queries.
+        #    _connection() commits for us.
         # 2. We convert `result` from type List[RealDictCursor] to List[dict].
         # 3. Only `SELECT` statements return results, so we must check if the 
         #    query returned results before we call cur.fetchall(), otherwise
         #    we get an error. We do this by checking if cur.description is None.
-        conn = self.pool.getconn()
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql, params)
-            if cur.description is not None:
-                result = [dict(r) for r in cur.fetchall()]
-            else:
-                result = []
-        conn.commit()
-        self.pool.putconn(conn)
+        with self.stats.measure(sql) as sample, self._connection() as conn:
+            sample.checked_out()
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql, params)
+                if cur.description is not None:
+                    result = [dict(r) for r in cur.fetchall()]
+                else:
+                    result = []
+            sample.rows = len(result)
         return result
     
 
@@ -175,15 +548,78 @@ class NodeProviderDB:
         Returns a list of tuples, as is standard.
         Prefer _execute() instead.
         """
-        conn = self.pool.getconn()
-        with conn.cursor() as cur:
-            cur.execute(sql, params)
-            result: List[Tuple[Any, ...]] = cur.fetchall()
-        conn.commit()
-        self.pool.putconn(conn)
+        with self.stats.measure(sql) as sample, self._connection() as conn:
+            sample.checked_out()
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                result: List[Tuple[Any, ...]] = cur.fetchall()
+            sample.rows = len(result)
+        return result
+
+
+    def _execute_prepared(self, name: str,
+                          params: Tuple[Any, ...] = ()) -> List[Dict[str, Any]]:
+        """Like _execute(), for one of `prepared_statements`. The statement
+        is prepared the first time it runs on a connection, after which
+        Postgres skips parsing and planning it.
+        """
+        # A prepared `SELECT *` fails once its table gains a column. Then we
+        # prepare the statements again under new names (the old ones are
+        # dropped along with their connections).
+        try:
+            return self._run_prepared(name, params)
+        except psycopg2.errors.FeatureNotSupported:
+            self._generation += 1
+            return self._run_prepared(name, params)
+
+
+    def _run_prepared(self, name: str,
+                      params: Tuple[Any, ...]) -> List[Dict[str, Any]]:
+        prepared_name = f"{name}_{self._generation}"
+        args = f"({', '.join(['%s'] * len(params))})" if params else ""
+        sql = self.prepared_statements[name]
+        with self.stats.measure(sql) as sample, self._connection() as conn:
+            sample.checked_out()
+            prepared = self._prepared.setdefault(conn, set())
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                if prepared_name not in prepared:
+                    cur.execute(f"PREPARE {prepared_name} AS {sql}")
+                    prepared.add(prepared_name)
+                cur.execute(f"EXECUTE {prepared_name}{args}", params)
+                result = [dict(r) for r in cur.fetchall()]
+            sample.rows = len(result)
         return result
 
 
+    def _execute_values(self, sql: str,
+                        rows: Sequence[Tuple[Any, ...]]) -> int:
+        """Execute a bulk INSERT with a connection from the pool, sending
+        all rows in one statement and one transaction.
+
+        Parameters
+        ----------
+        sql : str
+            An INSERT statement with a single `VALUES %s` placeholder.
+        rows : Sequence[Tuple[Any, ...]]
+            The rows to insert, one tuple per row.
+
+        Returns
+        -------
+        int
+            The number of rows written. With `ON CONFLICT DO NOTHING`, rows
+            that already existed are not counted.
+        """
+        if not rows:
+            return 0
+        with self.stats.measure(sql) as sample, self._connection() as conn:
+            sample.checked_out()
+            with conn.cursor() as cur:
+                execute_values(cur, sql, rows, page_size=len(rows))
+                count: int = cur.rowcount
+            sample.rows = count
+        return count
+
+
     def _get_schema(self, table_name: str) -> Dict[str, str]:
         """Returns the schema for a table.
         Ex. [{'id': 'integer', 'node_provider_id': 'text'}]
@@ -192,91 +628,54 @@ class NodeProviderDB:
         # Note: we could use pg_dump or generate_ddl to test this instead,
         # but this is significantly easier.
         # Get the column names, data types
-        query = f"""
+        query = """
             SELECT column_name, data_type
             FROM information_schema.columns
-            WHERE table_name = '{table_name}'
+            WHERE table_name = %s
         """
-        result = self._execute(query, ())
+        result = self._execute(query, (table_name,))
         schema = {row['column_name']: row['data_type'] for row in result}
         return schema
 
 
-    def get_subscribers_as_dict(self) -> Dict[Principal, Dict[str, Any]]:
-        """Returns the table of all subscribers as a dictionary.
-        One to one relationship."""
-        result = self._execute("SELECT * FROM subscribers", ())
-        as_dict = {row['node_provider_id']: row for row in result}
-        return as_dict
-    
-
-    def get_emails_as_dict(self) -> Dict[Principal, List[str]]:
-        """Returns the table of all emails as a dictionary
-        One to many relationship."""
-        result = self._execute("SELECT * FROM email_lookup", ())
-        grouped = groupby(lambda d: d['node_provider_id'], result)
-        lookupd = {k: [row['email_address'] for row in v] 
-                   for k, v in grouped.items()}
-        return lookupd
-    
-
-    def get_slack_channels_as_dict(self) -> Dict[Principal, List[str]]:
-        """Returns the table of all slack channels as a dictionary.
-        One to many relationship."""
-        result = self._execute("SELECT * FROM slack_channel_lookup", ())
-        grouped = groupby(lambda d: d['node_provider_id'], result)
-        lookupd = {k: [row['slack_channel_id'] for row in v] 
-                   for k, v in grouped.items()}
-        return lookupd
-    
-
-    def get_telegram_chats_as_dict(self) -> Dict[Principal, List[str]]:
-        """Returns the table of all telegram chats as a dictionary.
-        One to many relationship."""
-        result = self._execute("SELECT * FROM telegram_chat_lookup", ())
-        grouped = groupby(lambda d: d['node_provider_id'], result)
-        lookupd = {k: [row['telegram_chat_id'] for row in v] 
-                   for k, v in grouped.items()}
-        return lookupd
-    
-
-    def get_node_labels_as_dict(self) -> Dict[Principal, str]:
-        """Returns the table of all node labels as a dictionary.
-        One to one relationship."""
-        rows = self._execute("SELECT * FROM node_label_lookup", ())
-        lookupd = {row['node_id']: row['node_label'] for row in rows}
-        return lookupd
-    
-
-    def get_node_providers_as_dict(self) -> Dict[Principal, str]:
-        """Returns the table of all node providers as a dictionary.
-        One to one relationship."""
-        rows = self._execute("SELECT * FROM node_provider_lookup", ())
-        lookupd = {row['node_provider_id']: row['node_provider_name'] for row in rows}
-        return lookupd
-    
-    
-    def insert_node_providers(self, node_providers: Dict[Principal, str]) -> None:
-        """Inserts a NodeProvider object into node_provider_lookup"""
-        query = """
-            INSERT INTO node_provider_lookup (
-                node_provider_id,
-                node_provider_name
-            ) VALUES (%s, %s)
-        """
-        for node_provider_principal in node_providers.keys():
-            params = (node_provider_principal, node_providers[node_provider_principal])
-            self._execute(query, params)
+    def get_routing_table(
+            self, node_provider_ids: Optional[Iterable[Principal]] = None
+            ) -> Dict[Principal, Dict[str, Any]]:
+        """Returns every subscriber's preferences along with all of its
+        destinations, in one round-trip. The destinations are aggregated
+        by the database, not grouped in Python.
 
+        Parameters
+        ----------
+        node_provider_ids : Optional[Iterable[Principal]]
+            Only return these subscribers. All subscribers if None.
 
-    def delete_node_provider(self, node_provider_id: Principal) -> None:
-        """Deletes a record in node_proivder_lookup by node_provider_id"""
-        query = """
-            DELETE FROM node_provider_lookup
-            WHERE node_provider_id = %s
+        Returns
+        -------
+        Dict[Principal, Dict[str, Any]]
+            A row of the subscribers table, plus the lists `email_addresses`,
+            `slack_channel_ids` and `telegram_chat_ids`, by node_provider_id.
+            Ex. {'node_provider_id': {'notify_email': True, ...,
+                 'email_addresses': ['a@b.com'], ...}, ...}
         """
-        self._execute(query, (node_provider_id,))
+        # The full table is cached, filtering it costs no round-trip.
+        routing_table: Optional[Dict[Principal, Dict[str, Any]]] = \
+            self._peek('routing_table')
+        if routing_table is not None:
+            if node_provider_ids is None:
+                return routing_table
+            return {k: routing_table[k] for k in node_provider_ids
+                    if k in routing_table}
+        ids = None if node_provider_ids is None else list(node_provider_ids)
+        generation = self._cache_generation
+        rows = self._execute_prepared('select_routing_table', (ids,))
+        result = {row['node_provider_id']: row for row in rows}
+        if ids is None:
+            self._store('routing_table', result, generation)
+        return result
 
 
     def close(self) -> None:
+        if self._listener is not None:
+            self._listener.close()
         self.pool.closeall()
@@ -0,0 +1,281 @@
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Callable, Iterable, Optional, \
+    Sequence, Tuple, TypeVar
+from toolz import groupby # type: ignore
+
+from node_monitor.query_stats import QueryStats
+
+Principal = str
+T = TypeVar('T')
+
+## The part of NodeProviderDB that doesn't depend on the database: the
+## public API, the cache behind it, and the statement statistics.
+## The backends are siblings that subclass it:
+##   NodeProviderDB         node_provider_db.py, Postgres
+##   SQLiteNodeProviderDB   node_provider_db_sqlite.py, an embedded file
+## Each backend brings its own connection handling, its own migrations,
+## and the SQL of every statement in its own dialect, by implementing the
+## abstract methods below. A backend that misses one can't be created.
+##
+## Caching:
+## The tables are tiny and rarely change, but we read them on every step.
+## So every get_*_as_dict() is cached in memory, and a normal step costs
+## no round-trips to the database. Each backend has its own way to learn
+## that a table changed, see _drain_notifications(), and drops the stale
+## entries with invalidate(). A result that was being loaded when its entry
+## was dropped is not cached, since it may predate the change. Entries also
+## expire after `cache_ttl` seconds, in case we miss a change.
+##
+## Instrumentation:
+## Every statement is timed in `stats`, grouped by normalized query, with
+## the time spent waiting for a connection, the rows returned and the
+## errors, see query_stats.py and query_stats().
+
+
+class BaseNodeProviderDB(ABC):
+    """The public API and cache shared by the NodeProviderDB backends."""
+
+    # Cached results that are built from several tables, by table
+    derived_caches = {
+        'subscribers': ['routing_table'],
+        'email_lookup': ['routing_table'],
+        'slack_channel_lookup': ['routing_table'],
+        'telegram_chat_lookup': ['routing_table'],
+    }
+
+    # Statements used by the public API, in the backend's dialect.
+    # The lookups are run by name with _execute_prepared(): select_subscribers,
+    # select_email_lookup, select_slack_channel_lookup,
+    # select_telegram_chat_lookup, select_node_label_lookup and
+    # select_node_provider_lookup.
+    insert_node_providers_query: str
+    delete_node_provider_query: str
+
+
+    def __init__(self, cache_ttl: float = 15 * 60,
+                 slow_query: Optional[float] = 1.0) -> None:
+        self.stats = QueryStats(slow_query)
+        self.cache_ttl = cache_ttl
+        self._cache: Dict[str, Tuple[float, Any]] = {}
+        self._cache_generation = 0 # bumped by every invalidate()
+        self._cache_lock = threading.Lock()
+
+
+    ## Implemented by each backend
+
+    @abstractmethod
+    def migrate(self) -> List[int]:
+        """Applies the migrations that haven't been applied yet.
+        Returns the versions that were applied, if any."""
+
+
+    @abstractmethod
+    def _drain_notifications(self) -> None:
+        """Invalidates the cache entries of tables that changed since the
+        last call. Called before every cache lookup, so it must be cheap."""
+
+
+    @abstractmethod
+    def _execute(self, sql: str,
+                 params: Tuple[Any, ...]) -> List[Dict[str, Any]]:
+        """Executes a SQL statement in its own transaction, and returns
+        the rows as dicts, or an empty list if it returns no rows."""
+
+
+    @abstractmethod
+    def _execute1(self, sql: str, params: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+        """Like _execute(), returning the rows as tuples."""
+
+
+    @abstractmethod
+    def _execute_prepared(self, name: str,
+                          params: Tuple[Any, ...] = ()) -> List[Dict[str, Any]]:
+        """Like _execute(), for one of the backend's named statements."""
+
+
+    @abstractmethod
+    def _execute_values(self, sql: str,
+                        rows: Sequence[Tuple[Any, ...]]) -> int:
+        """Executes a bulk INSERT of `rows` in one transaction. Returns
+        the number of rows written."""
+
+
+    @abstractmethod
+    def _get_schema(self, table_name: str) -> Dict[str, str]:
+        """Returns the schema for a table, with Postgres' type names.
+        Ex. [{'id': 'integer', 'node_provider_id': 'text'}]
+        This method is useful for testing.
+        """
+
+
+    @abstractmethod
+    def close(self) -> None:
+        """Closes the connections to the database."""
+
+
+    ## Cache
+
+    def _cached(self, table: str, load: Callable[[], T]) -> T:
+        """Returns load(), cached until `table` changes or the TTL expires.
+        The result is shared between callers, so don't mutate it."""
+        entry = self._peek(table)
+        if entry is not None:
+            value: T = entry
+            return value
+        generation = self._cache_generation
+        value = load()
+        self._store(table, value, generation)
+        return value
+
+
+    def _store(self, key: str, value: Any, generation: int) -> None:
+        """Caches `value`, loaded when the cache was at `generation`. If
+        the cache was invalidated since, `value` may predate the change,
+        so we don't cache it and the next caller loads it again."""
+        self._drain_notifications()
+        with self._cache_lock:
+            if generation == self._cache_generation:
+                self._cache[key] = (time.monotonic(), value)
+
+
+    def _peek(self, table: str) -> Any:
+        """Returns the cached value for `table` if it is fresh, else None."""
+        self._drain_notifications()
+        entry = self._cache.get(table)
+        if entry is not None and time.monotonic() - entry[0] < self.cache_ttl:
+            return entry[1]
+        return None
+
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        """Drops the cache for one table and whatever is derived from it,
+        or for all tables."""
+        with self._cache_lock:
+            self._cache_generation += 1
+            if table is None:
+                self._cache.clear()
+                return
+            self._cache.pop(table, None)
+            for derived in self.derived_caches.get(table, []):
+                self._cache.pop(derived, None)
+
+
+    def query_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the statistics of every statement run so far, by
+        normalized query, see QueryStats.snapshot()."""
+        return self.stats.snapshot()
+
+
+    ## Public API
+
+    def get_subscribers_as_dict(self) -> Dict[Principal, Dict[str, Any]]:
+        """Returns the table of all subscribers as a dictionary.
+        One to one relationship."""
+        def load() -> Dict[Principal, Dict[str, Any]]:
+            result = self._execute_prepared('select_subscribers')
+            return {row['node_provider_id']: row for row in result}
+        return self._cached('subscribers', load)
+
+
+    def get_emails_as_dict(self) -> Dict[Principal, List[str]]:
+        """Returns the table of all emails as a dictionary
+        One to many relationship."""
+        def load() -> Dict[Principal, List[str]]:
+            result = self._execute_prepared('select_email_lookup')
+            grouped = groupby(lambda d: d['node_provider_id'], result)
+            return {k: [row['email_address'] for row in v]
+                    for k, v in grouped.items()}
+        return self._cached('email_lookup', load)
+
+
+    def get_slack_channels_as_dict(self) -> Dict[Principal, List[str]]:
+        """Returns the table of all slack channels as a dictionary.
+        One to many relationship."""
+        def load() -> Dict[Principal, List[str]]:
+            result = self._execute_prepared('select_slack_channel_lookup')
+            grouped = groupby(lambda d: d['node_provider_id'], result)
+            return {k: [row['slack_channel_id'] for row in v]
+                    for k, v in grouped.items()}
+        return self._cached('slack_channel_lookup', load)
+
+
+    def get_telegram_chats_as_dict(self) -> Dict[Principal, List[str]]:
+        """Returns the table of all telegram chats as a dictionary.
+        One to many relationship."""
+        def load() -> Dict[Principal, List[str]]:
+            result = self._execute_prepared('select_telegram_chat_lookup')
+            grouped = groupby(lambda d: d['node_provider_id'], result)
+            return {k: [row['telegram_chat_id'] for row in v]
+                    for k, v in grouped.items()}
+        return self._cached('telegram_chat_lookup', load)
+
+
+    def get_node_labels_as_dict(self) -> Dict[Principal, str]:
+        """Returns the table of all node labels as a dictionary.
+        One to one relationship."""
+        def load() -> Dict[Principal, str]:
+            rows = self._execute_prepared('select_node_label_lookup')
+            return {row['node_id']: row['node_label'] for row in rows}
+        return self._cached('node_label_lookup', load)
+
+
+    def get_node_providers_as_dict(self) -> Dict[Principal, str]:
+        """Returns the table of all node providers as a dictionary.
+        One to one relationship."""
+        def load() -> Dict[Principal, str]:
+            rows = self._execute_prepared('select_node_provider_lookup')
+            return {row['node_provider_id']: row['node_provider_name']
+                    for row in rows}
+        return self._cached('node_provider_lookup', load)
+
+
+    def get_routing_table(
+            self, node_provider_ids: Optional[Iterable[Principal]] = None
+            ) -> Dict[Principal, Dict[str, Any]]:
+        """Returns every subscriber's preferences along with all of its
+        destinations. Built from the cached lookups, a backend may
+        override this to build it in the database instead.
+
+        Parameters
+        ----------
+        node_provider_ids : Optional[Iterable[Principal]]
+            Only return these subscribers. All subscribers if None.
+
+        Returns
+        -------
+        Dict[Principal, Dict[str, Any]]
+            A row of the subscribers table, plus the lists `email_addresses`,
+            `slack_channel_ids` and `telegram_chat_ids`, by node_provider_id.
+            Ex. {'node_provider_id': {'notify_email': True, ...,
+                 'email_addresses': ['a@b.com'], ...}, ...}
+        """
+        subscribers = self.get_subscribers_as_dict()
+        emails = self.get_emails_as_dict()
+        slack_channels = self.get_slack_channels_as_dict()
+        telegram_chats = self.get_telegram_chats_as_dict()
+        ids = subscribers.keys() if node_provider_ids is None \
+            else [k for k in node_provider_ids if k in subscribers]
+        return {k: dict(subscribers[k],
+                        email_addresses=emails.get(k, []),
+                        slack_channel_ids=slack_channels.get(k, []),
+                        telegram_chat_ids=telegram_chats.get(k, []))
+                for k in ids}
+
+
+    def insert_node_providers(self, node_providers: Dict[Principal, str]) -> int:
+        """Inserts node providers into node_provider_lookup, in one
+        statement. Node providers that already exist are left untouched,
+        so this is safe to call with the full list from the ic-api.
+        Returns the number of node providers inserted."""
+        inserted = self._execute_values(self.insert_node_providers_query,
+                                        list(node_providers.items()))
+        self.invalidate('node_provider_lookup')
+        return inserted
+
+
+    def delete_node_provider(self, node_provider_id: Principal) -> None:
+        """Deletes a record in node_proivder_lookup by node_provider_id"""
+        self._execute(self.delete_node_provider_query, (node_provider_id,))
+        self.invalidate('node_provider_lookup')
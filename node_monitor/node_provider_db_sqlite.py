@@ -0,0 +1,255 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Tuple
+
+from node_monitor.node_provider_db_base import BaseNodeProviderDB
+
+## An embedded NodeProviderDB backend, for single-node deployments and
+## for tests. The tables hold a few hundred rows, so there is no need for
+## a database server, and every query stays in-process.
+##
+## The public API and its cache are the same as the Postgres backend's,
+## see node_provider_db_base.py. The differences are all below it:
+## - One connection in WAL mode, shared by all threads behind a lock.
+##   Readers in other processes don't block our writes, and vice versa.
+##   In `stats`, the time waiting for a connection is the time waiting for
+##   that lock.
+## - Statements are written for SQLite, with `?` placeholders.
+## - There is no LISTEN/NOTIFY. Instead we watch `PRAGMA data_version`,
+##   which changes whenever another connection commits to the file, and
+##   drop the whole cache when it does. This is a local read, not I/O.
+## - The routing table is built from the cached lookups, which are
+##   in-process anyway.
+## - The schema has its own migrations. SQLite can't add a foreign key to
+##   an existing table, so they are declared with the tables instead.
+##
+## References:
+## https://www.sqlite.org/wal.html
+## https://www.sqlite.org/pragma.html#pragma_data_version
+
+sqlite3.register_converter("BOOLEAN", lambda b: bool(int(b)))
+
+
+class SQLiteNodeProviderDB(BaseNodeProviderDB):
+    """A NodeProviderDB stored in a local SQLite file."""
+
+    create_table_schema_migrations = """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    migrations = [
+        # 1: the tables
+        """
+        CREATE TABLE IF NOT EXISTS subscribers (
+            node_provider_id TEXT PRIMARY KEY,
+            notify_on_status_change BOOLEAN,
+            notify_email BOOLEAN,
+            notify_slack BOOLEAN,
+            notify_telegram BOOLEAN,
+            node_provider_name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS email_lookup (
+            id INTEGER PRIMARY KEY,
+            node_provider_id TEXT
+                REFERENCES subscribers ON DELETE CASCADE,
+            email_address TEXT
+        );
+        CREATE TABLE IF NOT EXISTS slack_channel_lookup (
+            id INTEGER PRIMARY KEY,
+            node_provider_id TEXT
+                REFERENCES subscribers ON DELETE CASCADE,
+            slack_channel_id TEXT
+        );
+        CREATE TABLE IF NOT EXISTS telegram_chat_lookup (
+            id INTEGER PRIMARY KEY,
+            node_provider_id TEXT
+                REFERENCES subscribers ON DELETE CASCADE,
+            telegram_chat_id TEXT
+        );
+        CREATE TABLE IF NOT EXISTS node_label_lookup (
+            node_id TEXT PRIMARY KEY,
+            node_label TEXT
+        );
+        CREATE TABLE IF NOT EXISTS node_provider_lookup (
+            node_provider_id TEXT PRIMARY KEY,
+            node_provider_name TEXT
+        )
+        """,
+        # 2: index the one-to-many lookups by node provider
+        """
+        CREATE INDEX IF NOT EXISTS email_lookup_node_provider_id_idx
+            ON email_lookup (node_provider_id);
+        CREATE INDEX IF NOT EXISTS slack_channel_lookup_node_provider_id_idx
+            ON slack_channel_lookup (node_provider_id);
+        CREATE INDEX IF NOT EXISTS telegram_chat_lookup_node_provider_id_idx
+            ON telegram_chat_lookup (node_provider_id)
+        """,
+    ]
+
+    # Named statements, see _execute_prepared()
+    statements = {
+        'select_subscribers': "SELECT * FROM subscribers",
+        'select_email_lookup': "SELECT * FROM email_lookup",
+        'select_slack_channel_lookup': "SELECT * FROM slack_channel_lookup",
+        'select_telegram_chat_lookup': "SELECT * FROM telegram_chat_lookup",
+        'select_node_label_lookup': "SELECT * FROM node_label_lookup",
+        'select_node_provider_lookup': "SELECT * FROM node_provider_lookup",
+    }
+
+    # The statements of BaseNodeProviderDB's public API
+    insert_node_providers_query = """
+        INSERT INTO node_provider_lookup (
+            node_provider_id,
+            node_provider_name
+        ) VALUES (?, ?)
+        ON CONFLICT (node_provider_id) DO NOTHING
+    """
+    delete_node_provider_query = """
+        DELETE FROM node_provider_lookup
+        WHERE node_provider_id = ?
+    """
+
+
+    def __init__(self, path: str, cache_ttl: float = 15 * 60,
+                 busy_timeout: float = 10, migrate: bool = True,
+                 slow_query: Optional[float] = 1.0) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            The database file, created if missing. ":memory:" for tests.
+        cache_ttl : float
+            Seconds before a cached lookup is read again.
+        busy_timeout : float
+            Seconds to wait for another process to finish writing.
+        migrate : bool
+            Bring the schema up to date, see migrate().
+        slow_query : Optional[float]
+            Statements slower than this many seconds are logged.
+        """
+        super().__init__(cache_ttl, slow_query)
+        self.path = path
+        self._conn = sqlite3.connect(
+            path, timeout=busy_timeout, isolation_level=None,
+            check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._lock = threading.RLock()
+        self._data_version: Optional[int] = None
+        if migrate:
+            self.migrate()
+
+
+    def migrate(self) -> List[int]:
+        """Applies the migrations that haven't been applied yet, each in
+        its own transaction along with its entry in schema_migrations.
+        BEGIN IMMEDIATE makes other processes wait for us."""
+        applied = []
+        with self._lock:
+            self._conn.execute(self.create_table_schema_migrations)
+            for version, migration in enumerate(self.migrations, start=1):
+                done = self._conn.execute(
+                    "SELECT 1 FROM schema_migrations WHERE version = ?",
+                    (version,)).fetchone()
+                if done is not None:
+                    continue
+                try:
+                    self._conn.executescript(
+                        f"BEGIN IMMEDIATE; {migration};"
+                        f"INSERT INTO schema_migrations (version)"
+                        f" VALUES ({version}); COMMIT;")
+                except sqlite3.Error:
+                    if self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+                    raise
+                applied.append(version)
+        if applied:
+            self.invalidate()
+        return applied
+
+
+    def _drain_notifications(self) -> None:
+        """Drops the cache if another connection wrote to the database."""
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            if self._data_version is not None:
+                self.invalidate()
+            self._data_version = version
+
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Runs a block in a transaction, committed if it succeeds and
+        rolled back if it raises."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+
+    def _execute(self, sql: str,
+                 params: Tuple[Any, ...]) -> List[Dict[str, Any]]:
+        """Execute a SQL statement, with `?` placeholders, in its own
+        transaction. See BaseNodeProviderDB._execute()."""
+        with self.stats.measure(sql) as sample, self._transaction() as conn:
+            sample.checked_out()
+            cur = conn.execute(sql, params)
+            result = [] if cur.description is None \
+                else [dict(r) for r in cur.fetchall()]
+            sample.rows = len(result)
+        return result
+
+
+    def _execute1(self, sql: str, params: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+        """Like _execute(), returning the rows as tuples."""
+        with self.stats.measure(sql) as sample, self._transaction() as conn:
+            sample.checked_out()
+            cur = conn.execute(sql, params)
+            result = [tuple(r) for r in cur.fetchall()]
+            sample.rows = len(result)
+        return result
+
+
+    def _execute_prepared(self, name: str,
+                          params: Tuple[Any, ...] = ()) -> List[Dict[str, Any]]:
+        """Runs one of `statements`. sqlite3 keeps its own cache of
+        compiled statements, so this is a plain _execute()."""
+        return self._execute(self.statements[name], params)
+
+
+    def _execute_values(self, sql: str,
+                        rows: Sequence[Tuple[Any, ...]]) -> int:
+        """Execute a bulk INSERT in one transaction. `sql` inserts one row,
+        with a `?` per column, and is run for every row. Returns the number
+        of rows written."""
+        if not rows:
+            return 0
+        with self.stats.measure(sql) as sample, self._transaction() as conn:
+            sample.checked_out()
+            cur = conn.executemany(sql, rows)
+            sample.rows = cur.rowcount
+        return sample.rows
+
+
+    def _get_schema(self, table_name: str) -> Dict[str, str]:
+        """Returns the schema for a table, with the declared types in the
+        same lowercase form as Postgres' information_schema.
+        Ex. [{'id': 'integer', 'node_provider_id': 'text'}]
+        """
+        rows = self._execute("SELECT name, type FROM pragma_table_info(?)",
+                             (table_name,))
+        return {row['name']: row['type'].lower() for row in rows}
+
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,204 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Collection, FrozenSet, Iterable, Iterator, List, \
+    NamedTuple, Tuple
+
+## A durable queue of rendered messages, between NodeMonitor and the bots.
+##
+## NodeMonitor.broadcast_alerts() and broadcast_status_report() only `put`
+## their messages here, so a step never waits on SMTP, Slack or Telegram.
+## A worker thread `claim`s the due messages and delivers them. A message
+## that fails is retried with exponential backoff, up to `max_attempts`,
+## then given up on with an error in the log.
+##
+## Messages are kept in a local SQLite file, so nothing is lost across a
+## crash or a restart:
+## - Every message has an idempotency key. Putting a key that is already
+##   queued does nothing, so a step that is run again can't queue the same
+##   alert twice.
+## - A claimed message is leased for `lease` seconds. If we crash before it
+##   is delivered, the lease runs out and the message is claimed again.
+## - The destinations a message was delivered to are recorded, by channel,
+##   so a retry only goes to the destinations that failed.
+## - Statements that fail are rolled back, so one failure (e.g. the disk
+##   is full) never leaves the connection stuck inside a transaction.
+
+Principal = str
+
+
+class Entry(NamedTuple):
+    """A queued message.
+
+    Attributes:
+        id: Its row id
+        key: Its idempotency key
+        node_provider_id: Who it is for
+        subject: The subject
+        message: The body
+        attempts: How many times delivering it failed
+        delivered: The (channel, destination) it was already delivered to
+    """
+    id: int
+    key: str
+    node_provider_id: Principal
+    subject: str
+    message: str
+    attempts: int
+    delivered: FrozenSet[Tuple[str, str]]
+
+    @property
+    def batch(self) -> str:
+        """Its key without the node provider, i.e. what queued it.
+        Ex. 'alert:5f1c2a9b8e7d6c4f' for 'alert:5f1c2a9b8e7d6c4f:principal'
+        """
+        return self.key.removesuffix(f":{self.node_provider_id}")
+
+
+
+class Outbox:
+
+    create_table_outbox = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            node_provider_id TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            next_attempt REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            delivered TEXT NOT NULL DEFAULT '[]',
+            status TEXT NOT NULL DEFAULT 'pending',
+            last_error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS outbox_due_idx
+            ON outbox (status, next_attempt)
+    """
+
+
+    def __init__(self, path: str, lease: float = 60,
+                 max_attempts: int = 10, retry_base: float = 30,
+                 retry_max: float = 60 * 60) -> None:
+        """
+        Args:
+            path: The SQLite file, created if missing. ":memory:" for tests.
+            lease: Seconds a claimed message is hidden from other claims.
+            max_attempts: Failed deliveries before a message is given up on.
+            retry_base: Seconds before the first retry, doubled every time
+                after that, up to retry_max.
+        """
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._conn = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.executescript(self.create_table_outbox)
+        self._lock = threading.Lock()
+
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Runs a block in a write transaction, committed if it succeeds
+        and rolled back if it (or the commit) raises."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+
+
+    def put(self, messages: Iterable[Tuple[str, Principal, str, str]]) -> int:
+        """Queues every (key, node_provider_id, subject, message), skipping
+        keys that were already queued. Returns the number queued."""
+        now = time.time()
+        rows = [(key, node_provider_id, subject, message, now, now)
+                for key, node_provider_id, subject, message in messages]
+        with self._transaction() as conn:
+            cur = conn.executemany("""
+                INSERT OR IGNORE INTO outbox (key, node_provider_id,
+                    subject, message, created_at, next_attempt)
+                VALUES (?, ?, ?, ?, ?, ?)""", rows)
+        return cur.rowcount
+
+
+    def claim(self, limit: int = 100) -> List[Entry]:
+        """Takes up to `limit` due messages, oldest first, and leases them."""
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute("""
+                SELECT id, key, node_provider_id, subject, message,
+                       attempts, delivered
+                FROM outbox
+                WHERE status = 'pending' AND next_attempt <= ?
+                ORDER BY id LIMIT ?""", (now, limit)).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET next_attempt = ? WHERE id = ?",
+                [(now + self.lease, row[0]) for row in rows])
+        return [Entry(id, key, node_provider_id, subject, message, attempts,
+                      frozenset((channel, destination) for channel, destination
+                                in json.loads(delivered)))
+                for id, key, node_provider_id, subject, message, attempts,
+                    delivered in rows]
+
+
+    def done(self, entry: Entry) -> None:
+        """Marks a message as delivered."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'sent' WHERE id = ?", (entry.id,))
+
+
+    def retry(self, entry: Entry, delivered: Collection[Tuple[str, str]],
+              error: str) -> None:
+        """Records a failed delivery, and the (channel, destination) that
+        did get the message. Schedules the next attempt, or gives up on the
+        message."""
+        attempts = entry.attempts + 1
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        status = 'failed' if attempts >= self.max_attempts else 'pending'
+        with self._lock:
+            self._conn.execute("""
+                UPDATE outbox SET attempts = ?, next_attempt = ?,
+                    delivered = ?, status = ?, last_error = ?
+                WHERE id = ?""",
+                (attempts, time.time() + delay,
+                 json.dumps(sorted(entry.delivered | set(delivered))),
+                 status, error, entry.id))
+        if status == 'failed':
+            logging.error(f"Outbox: gave up on {entry.key} after {attempts} "
+                          f"attempts: {error}")
+
+
+    def pending(self) -> int:
+        """The number of messages not delivered yet."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT count(*) FROM outbox WHERE status = 'pending'"
+            ).fetchone()
+        count: int = row[0]
+        return count
+
+
+    def purge(self, max_age: float = 7 * 24 * 60 * 60) -> int:
+        """Deletes delivered and given up messages older than `max_age`
+        seconds. Returns the number deleted."""
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM outbox WHERE status != 'pending' "
+                "AND created_at < ?", (time.time() - max_age,))
+        return cur.rowcount
+
+
+    def close(self) -> None:
+        self._conn.close()
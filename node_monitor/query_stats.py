@@ -0,0 +1,186 @@
+import re
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+## In-process statistics for the statements NodeProviderDB runs.
+##
+## Statements are grouped by their normalized text: whitespace collapsed,
+## literals and placeholders replaced with `?`. For each group we keep:
+##   - calls and errors
+##   - a histogram of the total time per call
+##   - a histogram of the time spent waiting for a connection
+##   - a histogram of the rows returned (or written)
+## Histograms have fixed, log-spaced buckets, so recording a sample is a
+## bisect and an increment, and memory doesn't grow with the number of
+## calls. Quantiles are read from the buckets, so they are upper bounds.
+##
+## Statements slower than `slow_query` seconds are also logged, so a slow
+## step can be traced back to the statement that made it slow.
+
+latency_buckets = [
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+row_buckets = [0, 1, 10, 100, 1_000, 10_000, 100_000]
+
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+
+@lru_cache(maxsize=1024)
+def normalize(sql: str) -> str:
+    """Returns `sql` with literals and placeholders replaced with `?` and
+    its whitespace collapsed, so that the same statement with different
+    parameters is grouped together.
+    Ex. "SELECT * FROM t  WHERE id = 3" -> "SELECT * FROM t WHERE id = ?"
+    """
+    return ' '.join(_literals.sub('?', sql).split())
+
+
+
+class Histogram:
+    """Counts of samples per bucket. A sample goes into the first bucket
+    whose upper bound it doesn't exceed, or into the overflow bucket."""
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def record(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+    def quantile(self, q: float) -> float:
+        """The upper bound of the bucket holding the q-th quantile.
+        Samples in the overflow bucket are reported as the max."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+            'buckets': dict(zip([*map(str, self.bounds), 'inf'], self.counts)),
+        }
+
+
+
+class Sample:
+    """One statement being measured, see QueryStats.measure()."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.wait = 0.0
+        self.rows = 0
+
+
+    def checked_out(self) -> None:
+        """Marks the end of the wait for a connection."""
+        self.wait = time.perf_counter() - self.start
+
+
+
+class QueryStat:
+    """The statistics of one normalized statement."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(latency_buckets)
+        self.wait = Histogram(latency_buckets)
+        self.rows = Histogram(row_buckets)
+
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'latency': self.latency.as_dict(),
+            'wait': self.wait.as_dict(),
+            'rows': self.rows.as_dict(),
+        }
+
+
+
+class QueryStats:
+    """Thread-safe statistics for every statement, by normalized query."""
+
+    def __init__(self, slow_query: Optional[float] = 1.0) -> None:
+        self.slow_query = slow_query
+        self._stats: Dict[str, QueryStat] = {}
+        self._lock = threading.Lock()
+
+
+    @contextmanager
+    def measure(self, sql: str) -> Iterator[Sample]:
+        """Measures the statement run in the block. Call checked_out() on
+        the sample once a connection is in hand, and set its `rows`.
+        The statement counts as an error if the block raises."""
+        sample = Sample()
+        error = False
+        try:
+            yield sample
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(sql, time.perf_counter() - sample.start,
+                        sample.wait, sample.rows, error)
+
+
+    def record(self, sql: str, seconds: float, wait: float = 0.0,
+               rows: int = 0, error: bool = False) -> None:
+        key = normalize(sql)
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = QueryStat()
+            stat.calls += 1
+            stat.latency.record(seconds)
+            stat.wait.record(wait)
+            if error:
+                stat.errors += 1
+            else:
+                stat.rows.record(rows)
+        if self.slow_query is not None and seconds > self.slow_query:
+            logging.warning(f"NodeProviderDB: slow statement ({seconds:.3f}s,"
+                            f" {wait:.3f}s waiting): {key}")
+
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """The statistics so far, by normalized query, slowest total first.
+        Ex. {'SELECT * FROM subscribers': {'calls': 3, 'errors': 0,
+             'latency': {'count': 3, 'mean': 0.002, 'p50': 0.0025, ...},
+             'wait': {...}, 'rows': {...}}, ...}
+        """
+        with self._lock:
+            stats = sorted(self._stats.items(),
+                           key=lambda kv: kv[1].latency.total, reverse=True)
+            return {key: stat.as_dict() for key, stat in stats}
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
@@ -0,0 +1,86 @@
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Hashable, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+
+## Token buckets, to stay under the rate limits of the chat APIs rather
+## than run into them and be told to back off.
+## A bucket holds up to `capacity` tokens and refills at `rate` tokens per
+## second. Each request takes a token, waiting for one if the bucket is
+## empty, so requests can burst up to `capacity` and then settle at `rate`.
+## https://en.wikipedia.org/wiki/Token_bucket
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float = 1,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+
+    def _reserve(self) -> float:
+        """Takes a token, possibly one that hasn't been refilled yet.
+        Returns how long to wait until it has been."""
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+
+    def acquire(self) -> None:
+        """Takes a token, waiting until one is available. Waiters are
+        served in order, each one token apart."""
+        wait = self._reserve()
+        if wait > 0:
+            self._sleep(wait)
+
+
+    def pause(self, seconds: float) -> None:
+        """Empties the bucket for `seconds`, e.g. after the server told us
+        to retry later."""
+        with self._lock:
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+            self._updated = self._clock()
+
+
+
+class TokenBuckets(Generic[K]):
+    """One TokenBucket per key (e.g. per chat), created on first use."""
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: Dict[K, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+
+    def __getitem__(self, key: K) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = \
+                    TokenBucket(self.rate, self.capacity)
+            return bucket
+
+
+
+def parse_retry_after(value: Any, default: float = 1.0) -> float:
+    """The seconds in a Retry-After header, or `default` if it is missing
+    or malformed (e.g. an HTTP date, which the chat APIs don't send)."""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return default
+    return seconds if 0 <= seconds < math.inf else default
@@ -1,5 +1,5 @@
 from flask import Flask
-from typing import Dict, Callable
+from typing import Any, Dict, Callable
 from node_monitor.node_monitor import NodeMonitor
 
 
@@ -22,5 +22,26 @@ def create_server(
         }
         return d
     # - - - - - -
+    @app.route('/nodes')
+    def nodes() -> Dict[str, Any]:
+        """Summary of the latest snapshot, read from its cached indexes."""
+        if not nm.snapshots:
+            return {"nodes": 0}
+        latest = nm.snapshots[-1]
+        d = {
+            "nodes": len(latest),
+            "status": {str(k): len(v) for k, v in latest.by_status.items()},
+            "node_providers": len(latest.by_provider),
+            "node_operators": len(latest.by_operator),
+            "data_centers": len(latest.by_dc),
+            "subnets": len([k for k in latest.by_subnet if k is not None]),
+        }
+        return d
+    # - - - - - -
+    @app.route('/db')
+    def db() -> Dict[str, Any]:
+        """Latency, wait, rows and errors of every database statement."""
+        return nm.node_provider_db.query_stats()
+    # - - - - - -
 
     return app
@@ -0,0 +1,35 @@
+import argparse
+import logging
+
+from simulator.fleet import Fleet, scenarios
+from simulator.server import Simulator, make_server
+
+## Usage:
+##   python -m simulator --nodes 100000 --scenario dc_outage --tick 240
+## then point Node Monitor at it:
+##   IC_API_URL=http://127.0.0.1:8000 python -m node_monitor
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s:%(levelname)s:%(message)s',
+                    datefmt='%Y-%m-%d %H:%M:%S')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=10_000)
+    parser.add_argument('--providers', type=int, default=None,
+                        help="default: one per 100 nodes")
+    parser.add_argument('--scenario', choices=scenarios, default='calm')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tick', type=float, default=None,
+                        help="seconds per poll, default: POST /advance")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    logging.info(f"Generating {args.nodes} nodes ({args.scenario})")
+    fleet = scenarios[args.scenario](
+        Fleet(args.nodes, args.providers, args.seed))
+    server = make_server(Simulator(fleet, args.tick), args.host, args.port)
+    logging.info(f"Serving the ic-api on http://{args.host}:{args.port}")
+    server.serve_forever()
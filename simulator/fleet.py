@@ -0,0 +1,275 @@
+import json
+import random
+import base64
+import zlib
+from typing import Any, Dict, List, NamedTuple, Optional
+
+## A synthetic fleet of nodes, shaped like the real one:
+##   - node providers own nodes in a handful of data centers
+##   - each (provider, data center) pair has its own node operator
+##   - nodes are grouped into subnets of 13, the rest are UNASSIGNED
+##   - provider sizes are skewed, a few providers own most of the nodes
+##
+## A fleet also holds a script of events (outages, flapping, new nodes),
+## so that every poll `t` has a deterministic list of nodes and statuses.
+## Everything is generated from `seed`, so the same arguments always give
+## the same fleet.
+
+Poll = int
+subnet_size = 13
+assigned_ratio = 0.75
+
+cities = [
+    ("an", "Antwerp", "Europe,BE,Flanders"),
+    ("bs", "Brussels", "Europe,BE,Brussels Capital"),
+    ("zh", "Zurich", "Europe,CH,Zurich"),
+    ("ge", "Geneva", "Europe,CH,Geneva"),
+    ("fr", "Frankfurt", "Europe,DE,Hesse"),
+    ("mu", "Munich", "Europe,DE,Bavaria"),
+    ("st", "Stockholm", "Europe,SE,Stockholm"),
+    ("lj", "Ljubljana", "Europe,SI,Ljubljana"),
+    ("wa", "Warsaw", "Europe,PL,Masovia"),
+    ("bu", "Bucharest", "Europe,RO,Bucharest"),
+    ("fm", "Fremont", "North America,US,California"),
+    ("lv", "Las Vegas", "North America,US,Nevada"),
+    ("ch", "Chicago", "North America,US,Illinois"),
+    ("at", "Atlanta", "North America,US,Georgia"),
+    ("or", "Orlando", "North America,US,Florida"),
+    ("to", "Toronto", "North America,CA,Ontario"),
+    ("sg", "Singapore", "Asia,SG,Singapore"),
+    ("ty", "Tokyo", "Asia,JP,Tokyo"),
+    ("se", "Seoul", "Asia,KR,Seoul"),
+    ("sy", "Sydney", "Oceania,AU,New South Wales"),
+    ("jb", "Johannesburg", "Africa,ZA,Gauteng"),
+    ("sp", "Sao Paulo", "South America,BR,Sao Paulo"),
+]
+
+
+def principal(rng: random.Random, length: int = 29) -> str:
+    """Returns a random principal in its textual form, e.g.
+    'rbn2y-6vfsb-gv35j-4cyvy-pzbdu-e5aum-jzjg6-5b4n5-vuguf-ycubq-zae'."""
+    data = rng.getrandbits(8 * length).to_bytes(length, 'big')
+    checksum = zlib.crc32(data).to_bytes(4, 'big')
+    text = base64.b32encode(checksum + data).decode().rstrip('=').lower()
+    return '-'.join(text[i:i + 5] for i in range(0, len(text), 5))
+
+
+
+class Event(NamedTuple):
+    """Sets `status` on `nodes` (indexes into Fleet.nodes) for the polls
+    in [start, end). With a `period`, the nodes alternate between `status`
+    and their normal status every `period` polls instead."""
+    kind: str
+    nodes: List[int]
+    status: str
+    start: Poll
+    end: Poll
+    period: int = 0
+
+    def active(self, t: Poll) -> bool:
+        if not self.start <= t < self.end:
+            return False
+        return not self.period or (t - self.start) // self.period % 2 == 0
+
+
+
+class Fleet:
+
+    def __init__(self, n_nodes: int, n_providers: Optional[int] = None,
+                 seed: int = 0) -> None:
+        """Generates a fleet of `n_nodes` nodes, owned by `n_providers`
+        node providers (default: one per 100 nodes).
+
+        Attributes:
+            nodes: Every node, as a dict matching ic_api.Node, including
+                the nodes that only join later. `status` is the normal
+                status of the node, when no event is affecting it.
+            node_providers: Every node provider, matching ic_api.NodeProvider
+            joined: The poll at which each node first shows up
+            events: The scripted events, see the methods below
+        """
+        self.rng = random.Random(seed)
+        n_providers = n_providers or max(1, n_nodes // 100)
+        self.node_providers: List[Dict[str, str]] = [
+            {'principal_id': principal(self.rng),
+             'display_name': f"Node Provider {i}"}
+            for i in range(n_providers)]
+        self.data_centers: List[Dict[str, str]] = []
+        self.nodes: List[Dict[str, Any]] = []
+        self.joined: List[Poll] = []
+        self.events: List[Event] = []
+        self._operators: Dict[tuple[str, str], str] = {}
+        self._subnet: Optional[str] = None
+        self._subnet_fill = subnet_size
+        self._provider_dcs: Dict[int, List[Dict[str, str]]] = {}
+        self._encoded: List[tuple[str, str]] = []
+
+        # Pareto-distributed provider sizes, so that a few providers own
+        # a large share of the fleet, like on mainnet
+        weights = [self.rng.paretovariate(1.2) for _ in range(n_providers)]
+        owners = self.rng.choices(range(n_providers), weights, k=n_nodes)
+        for owner in owners:
+            self._add_node(self.node_providers[owner], joined=0)
+
+
+    def _data_center(self, provider_index: int) -> Dict[str, str]:
+        """Picks a data center for a provider. Providers stick to up to 3
+        data centers, which are shared with other providers."""
+        if not self.data_centers:
+            for i in range(max(1, len(self.node_providers) // 3)):
+                code, city, region = cities[i % len(cities)]
+                n = i // len(cities) + 1
+                self.data_centers.append({
+                    'dc_id': f"{code}{n}",
+                    'dc_name': city,
+                    'owner': f"{city} Datacenter {n}",
+                    'region': region})
+        dcs = self._provider_dcs.get(provider_index)
+        if dcs is None:
+            k = min(len(self.data_centers), self.rng.randint(1, 3))
+            dcs = self._provider_dcs[provider_index] = \
+                self.rng.sample(self.data_centers, k)
+        return dcs[self.rng.randrange(len(dcs))]
+
+
+    def _add_node(self, provider: Dict[str, str], joined: Poll) -> int:
+        provider_index = int(provider['display_name'].rsplit(' ', 1)[1])
+        dc = self._data_center(provider_index)
+        operator_key = (provider['principal_id'], dc['dc_id'])
+        if operator_key not in self._operators:
+            self._operators[operator_key] = principal(self.rng)
+        subnet_id = None
+        if self.rng.random() < assigned_ratio:
+            if self._subnet_fill == subnet_size:
+                self._subnet, self._subnet_fill = principal(self.rng), 0
+            subnet_id, self._subnet_fill = self._subnet, self._subnet_fill + 1
+        self.nodes.append({
+            'dc_id': dc['dc_id'],
+            'dc_name': dc['dc_name'],
+            'node_id': principal(self.rng),
+            'node_operator_id': self._operators[operator_key],
+            'node_provider_id': provider['principal_id'],
+            'node_provider_name': provider['display_name'],
+            'owner': dc['owner'],
+            'region': dc['region'],
+            'status': 'UP' if subnet_id else 'UNASSIGNED',
+            'subnet_id': subnet_id,
+        })
+        self.joined.append(joined)
+        return len(self.nodes) - 1
+
+
+    ## - - - - - - Scripting
+
+    def dc_outage(self, start: Poll, duration: Poll,
+                  dc_id: Optional[str] = None) -> 'Fleet':
+        """Takes every node of a data center DOWN for `duration` polls."""
+        dc_id = dc_id or self.rng.choice(self.data_centers)['dc_id']
+        nodes = [i for i, node in enumerate(self.nodes)
+                 if node['dc_id'] == dc_id]
+        self.events.append(Event('dc_outage', nodes, 'DOWN',
+                                 start, start + duration))
+        return self
+
+
+    def nodes_down(self, count: int, start: Poll, duration: Poll,
+                   status: str = 'DOWN') -> 'Fleet':
+        """Takes `count` random nodes DOWN (or DEGRADED) for `duration`."""
+        nodes = self.rng.sample(range(len(self.nodes)), count)
+        self.events.append(Event('nodes_down', nodes, status,
+                                 start, start + duration))
+        return self
+
+
+    def flapping(self, count: int, start: Poll, duration: Poll,
+                 period: int = 1) -> 'Fleet':
+        """Makes `count` random nodes go DOWN and back UP every `period`
+        polls, for `duration` polls."""
+        nodes = self.rng.sample(range(len(self.nodes)), count)
+        self.events.append(Event('flapping', nodes, 'DOWN',
+                                 start, start + duration, period))
+        return self
+
+
+    def new_nodes(self, count: int, at: Poll) -> 'Fleet':
+        """Adds `count` nodes to random providers, showing up at poll `at`."""
+        for _ in range(count):
+            self._add_node(self.rng.choice(self.node_providers), joined=at)
+        return self
+
+
+    ## - - - - - - Polls
+
+    def statuses(self, t: Poll) -> List[Optional[str]]:
+        """The status of every node at poll `t`, None if not joined yet."""
+        statuses: List[Optional[str]] = [
+            node['status'] if joined <= t else None
+            for node, joined in zip(self.nodes, self.joined)]
+        for event in self.events:
+            if event.active(t):
+                for i in event.nodes:
+                    if statuses[i] is not None:
+                        statuses[i] = event.status
+        return statuses
+
+
+    def nodes_at(self, t: Poll,
+                 provider_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The nodes as the /api/v3/nodes endpoint returns them at poll `t`."""
+        return [dict(node, status=status)
+                for node, status in zip(self.nodes, self.statuses(t))
+                if status is not None and
+                (provider_id is None or node['node_provider_id'] == provider_id)]
+
+
+    def nodes_payload(self, t: Poll) -> bytes:
+        """The raw json body of /api/v3/nodes at poll `t`.
+        Every node is encoded once, around its status, so that encoding a
+        poll is a string join rather than a json.dumps of the whole fleet."""
+        if len(self._encoded) < len(self.nodes):
+            for node in self.nodes[len(self._encoded):]:
+                head, _, tail = json.dumps(dict(node, status='\0')) \
+                    .partition('"\\u0000"')
+                self._encoded.append((head, tail))
+        parts = [head + f'"{status}"' + tail
+                 for (head, tail), status
+                 in zip(self._encoded, self.statuses(t))
+                 if status is not None]
+        return ('{"nodes": [' + ', '.join(parts) + ']}').encode()
+
+
+    def node_providers_payload(self) -> bytes:
+        """The raw json body of /api/v3/node-providers."""
+        return json.dumps({'node_providers': self.node_providers}).encode()
+
+
+
+## Scripted timelines, by name. Each takes a fleet and scripts it.
+def _calm(fleet: Fleet) -> Fleet:
+    return fleet
+
+def _dc_outage(fleet: Fleet) -> Fleet:
+    return fleet.dc_outage(start=3, duration=6)
+
+def _flapping(fleet: Fleet) -> Fleet:
+    return fleet.flapping(max(1, len(fleet.nodes) // 200), start=1, duration=20)
+
+def _growth(fleet: Fleet) -> Fleet:
+    return fleet.new_nodes(max(1, len(fleet.nodes) // 20), at=3)
+
+def _mixed(fleet: Fleet) -> Fleet:
+    n = len(fleet.nodes)
+    return fleet \
+        .dc_outage(start=4, duration=5) \
+        .flapping(max(1, n // 500), start=1, duration=20) \
+        .nodes_down(max(1, n // 1000), start=2, duration=10) \
+        .nodes_down(max(1, n // 1000), start=6, duration=3, status='DEGRADED') \
+        .new_nodes(max(1, n // 100), at=8)
+
+scenarios = {
+    'calm': _calm,
+    'dc_outage': _dc_outage,
+    'flapping': _flapping,
+    'growth': _growth,
+    'mixed': _mixed,
+}
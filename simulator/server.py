@@ -0,0 +1,131 @@
+import json
+import time
+import hashlib
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from simulator.fleet import Fleet, Poll
+
+## A stand-in for the ic-api, serving a synthetic Fleet:
+##   GET  /api/v3/nodes            the nodes at the current poll
+##        ?node_provider_id=...    only the nodes of one node provider
+##   GET  /api/v3/node-providers   all node providers
+##   POST /advance                 moves to the next poll (manual clock)
+##
+## With `tick` set, the clock advances on its own every `tick` seconds,
+## like the real fleet. Without it, the clock only moves on POST /advance,
+## which is what benchmarks and tests use to step through a timeline.
+##
+## Responses carry an ETag and a Last-Modified, and honor If-None-Match,
+## so ICAPIClient's conditional requests behave like they do in production.
+
+
+class Simulator:
+
+    def __init__(self, fleet: Fleet, tick: Optional[float] = None) -> None:
+        self.fleet = fleet
+        self.tick = tick
+        self.started = time.time()
+        self.manual: Poll = 0
+        self._lock = threading.Lock()
+        self._cache: Optional[Tuple[Poll, bytes, str, str]] = None
+        self._node_providers = fleet.node_providers_payload()
+
+
+    @property
+    def poll(self) -> Poll:
+        if self.tick:
+            return int((time.time() - self.started) // self.tick)
+        return self.manual
+
+
+    def advance(self) -> Poll:
+        with self._lock:
+            self.manual += 1
+            return self.manual
+
+
+    def nodes(self) -> Tuple[bytes, str, str]:
+        """The body, ETag and Last-Modified of /api/v3/nodes, encoded once
+        per poll no matter how many clients ask for it."""
+        with self._lock:
+            poll = self.poll
+            if self._cache is None or self._cache[0] != poll:
+                body = self.fleet.nodes_payload(poll)
+                etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+                if self._cache is not None and self._cache[2] == etag:
+                    last_modified = self._cache[3]
+                else:
+                    last_modified = formatdate(usegmt=True)
+                self._cache = (poll, body, etag, last_modified)
+            _, body, etag, last_modified = self._cache
+            return body, etag, last_modified
+
+
+
+def make_handler(simulator: Simulator) -> type[BaseHTTPRequestHandler]:
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive, like the real ic-api
+
+        def _send(self, status: int, body: bytes = b"",
+                  etag: Optional[str] = None,
+                  last_modified: Optional[str] = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if etag:
+                self.send_header("ETag", etag)
+            if last_modified:
+                self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            if url.path == "/api/v3/nodes":
+                provider_id = parse_qs(url.query).get("node_provider_id")
+                if provider_id:
+                    nodes = simulator.fleet.nodes_at(
+                        simulator.poll, provider_id[0])
+                    self._send(200, json.dumps({"nodes": nodes}).encode())
+                    return
+                body, etag, last_modified = simulator.nodes()
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, etag=etag, last_modified=last_modified)
+                else:
+                    self._send(200, body, etag, last_modified)
+            elif url.path == "/api/v3/node-providers":
+                self._send(200, simulator._node_providers)
+            else:
+                self._send(404, b'{"error": "not found"}')
+
+        def do_POST(self) -> None:
+            if urlparse(self.path).path == "/advance":
+                self._send(200, f'{{"poll": {simulator.advance()}}}'.encode())
+            else:
+                self._send(404, b'{"error": "not found"}')
+
+        def log_message(self, format: str, *args: object) -> None:
+            pass # one line per request drowns everything else at scale
+
+    return Handler
+
+
+def make_server(simulator: Simulator, host: str = "127.0.0.1",
+                port: int = 0) -> ThreadingHTTPServer:
+    """Returns a server for `simulator`. Port 0 picks a free port, see
+    server.server_address. Run it with server.serve_forever()."""
+    return ThreadingHTTPServer((host, port), make_handler(simulator))
+
+
+def serve_in_thread(simulator: Simulator, host: str = "127.0.0.1",
+                    port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Starts a server in a daemon thread. Returns it and its base url,
+    which can be passed to ic_api.ICAPIClient. Stop it with shutdown()."""
+    server = make_server(simulator, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -6,7 +6,8 @@ import node_monitor.ic_api as ic_api
 ##   -s is to print to stdout
 ##   --send_emails is a custom flag to send live emails
 ##   --send_slack is a custom flag to send live slack messages
-##   --db is a custom flag to test CRUD operations on the database
+##   --db is a custom flag to test CRUD operations on the Postgres database,
+##        without it the database tests run on an in-memory SQLite database
 ## example: pytest -s --send_emails tests/test_bot_email.py
 ## example: pytest -s --send_slack tests/test_bot_slack.py
 ## example: pytest -s --send_telegram tests/test_bot_telegram.py
@@ -34,7 +35,7 @@ def pytest_addoption(parser):
         "--db",
         action="store_true",
         default=False,
-        help="test CRUD operations on the database")
+        help="test CRUD operations on the Postgres database, not SQLite")
 
 def pytest_configure(config):
     config.addinivalue_line(
@@ -45,16 +46,18 @@ def pytest_configure(config):
         "markers", "live_telegram: test sends a live telegram message over the network")
     config.addinivalue_line(
         "markers", "db: test CRUD operations on the database")
+    config.addinivalue_line(
+        "markers", "postgres: test features only the Postgres database has")
 
 
 def pytest_collection_modifyitems(config, items):
-    # if the --db flag is not given in cli: skip db tests
+    # if the --db flag is not given in cli: skip postgres tests
     # if the --send_emails flag is not given in cli: skip live_email tests
     # if the --send_slack flag is not given in cli: skip live_slack tests
     if not config.getoption("--db"):
         skip_db = pytest.mark.skip(reason="need --db option to run")
         for item in items:
-            if "db" in item.keywords:
+            if "postgres" in item.keywords:
                 item.add_marker(skip_db)
     if not config.getoption("--send_emails"):
         skip_live_email = pytest.mark.skip(reason="need --send_emails option to run")
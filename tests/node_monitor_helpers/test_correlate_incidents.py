@@ -0,0 +1,33 @@
+import pytest
+
+import node_monitor.ic_api as ic_api
+from node_monitor.node_monitor_helpers.correlate_incidents import \
+    correlate_incidents
+
+from tests.conftest import cached
+
+
+def outage(nodes, dc_id):
+    """Returns a copy of nodes where every node in dc_id is DOWN."""
+    return ic_api.Nodes(nodes=[
+        node.model_copy(update={'status': 'DOWN'}) if node.dc_id == dc_id
+        else node for node in nodes.nodes])
+
+
+def test_dc_outage():
+    snapshot = ic_api.Snapshot.from_nodes(outage(cached["control"], "br2"))
+    down = [node_id for node_id, row in snapshot.index.items()
+            if snapshot.get('dc_id', row) == 'br2']
+    incidents = correlate_incidents(snapshot, down[:1])
+    dc_incidents = [i for i in incidents if i.kind == 'dc']
+    assert len(dc_incidents) == 1
+    assert dc_incidents[0].key == 'br2'
+    assert dc_incidents[0].node_ids == frozenset(down)
+    assert dc_incidents[0].total == len(down)
+
+
+def test_no_outage():
+    # two nodes down in a data center of 25 is not an outage
+    snapshot = ic_api.Snapshot.from_nodes(cached["two_nodes_down"])
+    down = list(snapshot.by_status['DOWN'])
+    assert correlate_incidents(snapshot, map(snapshot.node_id, down)) == []
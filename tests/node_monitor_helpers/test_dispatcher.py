@@ -0,0 +1,133 @@
+import time
+import threading
+import pytest
+from unittest.mock import Mock
+
+from node_monitor.bot_email import EmailBot
+from node_monitor.bot_slack import SlackBot
+from node_monitor.bot_telegram import TelegramBot
+from node_monitor.node_monitor_helpers.dispatcher import Dispatcher
+
+
+def route(name, email=True, slack=True, telegram=True):
+    return {'node_provider_name': f"Node Provider {name}",
+            'notify_email': email, 'notify_slack': slack,
+            'notify_telegram': telegram,
+            'email_addresses': [f'{name}@example.com'],
+            'slack_channel_ids': [f'#alerts-{name}'],
+            'telegram_chat_ids': [f'chat-{name}']}
+
+
+def sent(destinations, text):
+    """A bot's post_messages() that sends everything."""
+    return dict.fromkeys(destinations)
+
+
+def test_dispatch_results():
+    email_bot = Mock(spec=EmailBot)
+    email_bot.post_emails.side_effect = [
+        {'a@example.com': None}, OSError("login failed")]
+    slack_bot = Mock(spec=SlackBot)
+    slack_bot.post_messages.side_effect = sent
+    telegram_bot = Mock(spec=TelegramBot)
+    telegram_bot.post_messages.return_value = {'chat-b': "chat not found"}
+    routing_table = {'a': route('a', telegram=False),
+                     'b': route('b', slack=False)}
+    deliveries = Dispatcher(email_bot, slack_bot, telegram_bot).dispatch(
+        routing_table, [('a', "subject", "message"), ('b', "subject", "message")])
+    assert [(d.node_provider_id, d.channel, d.ok) for d in deliveries] == [
+        ('a', 'email', True), ('a', 'slack', True),
+        ('b', 'email', False), ('b', 'telegram', False)]
+    assert isinstance(deliveries[2].error, OSError)
+    assert deliveries[3].error == "chat not found"
+    assert deliveries[3].destination == 'chat-b'
+    slack_bot.post_messages.assert_called_once_with(
+        ['#alerts-a'], "subject\n\nmessage")
+
+
+def test_dispatch_is_concurrent_per_channel():
+    """Slow emails run 4 at a time and don't hold up Slack."""
+    in_flight, most = 0, 0
+    lock = threading.Lock()
+    def slow_email(*args):
+        nonlocal in_flight, most
+        with lock:
+            in_flight += 1
+            most = max(most, in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight -= 1
+        return dict.fromkeys(args[0])
+    email_bot = Mock(spec=EmailBot)
+    email_bot.post_emails.side_effect = slow_email
+    slack_bot = Mock(spec=SlackBot)
+    slack_done = []
+    def slack(destinations, text):
+        slack_done.append(time.monotonic())
+        return sent(destinations, text)
+    slack_bot.post_messages.side_effect = slack
+    routing_table = {str(i): route(str(i), telegram=False)
+                     for i in range(16)}
+
+    start = time.monotonic()
+    deliveries = Dispatcher(email_bot, slack_bot).dispatch(
+        routing_table, [(k, "s", "m") for k in routing_table])
+    elapsed = time.monotonic() - start
+    assert len(deliveries) == 32 and all(d.ok for d in deliveries)
+    assert most == 4
+    assert elapsed < 16 * 0.05
+    assert max(slack_done) - start < 0.05
+
+
+def test_dispatch_coalesces_destinations():
+    """An operator subscribed for several node providers gets one message
+    per destination, and destinations with the same messages share a send."""
+    email_bot = Mock(spec=EmailBot)
+    slack_bot = Mock(spec=SlackBot)
+    slack_bot.post_messages.side_effect = sent
+    routing_table = {'a': route('a', telegram=False),
+                     'b': route('b', telegram=False),
+                     'c': route('c', telegram=False)}
+    for k in 'ab':
+        routing_table[k]['email_addresses'] = ['ops@example.com', 'cto@example.com']
+        routing_table[k]['slack_channel_ids'] = ['#ops']
+    routing_table['c']['slack_channel_ids'] = ['#ops', '#alerts-c']
+    deliveries = Dispatcher(email_bot, slack_bot).dispatch_each(
+        routing_table, [('a', "Down @ FR1", "A's nodes"),
+                        ('b', "Down @ ZH2", "B's nodes"),
+                        ('c', "Down @ ZH2", "C's nodes")])
+
+    assert email_bot.post_emails.call_count == 2
+    recipients, subject, message = email_bot.post_emails.call_args_list[0].args
+    assert recipients == ['ops@example.com', 'cto@example.com']
+    assert subject == "Down @ FR1 (+1 more)"
+    assert "Node Provider: Node Provider a" in message
+    assert "A's nodes" in message and "B's nodes" in message
+    assert email_bot.post_emails.call_args_list[1].args[0] == ['c@example.com']
+
+    channels, text = slack_bot.post_messages.call_args_list[0].args
+    assert channels == ['#ops']
+    assert "A's nodes" in text and "C's nodes" in text
+    assert slack_bot.post_messages.call_count == 2
+
+    assert [d.channel for d in deliveries[0]] == ['email', 'email', 'slack']
+    assert [d.destination for d in deliveries[2]] == \
+        ['c@example.com', '#ops', '#alerts-c']
+
+
+def test_dispatch_results_per_destination():
+    """One bad destination fails only its own Delivery."""
+    slack_bot = Mock(spec=SlackBot)
+    slack_bot.post_messages.return_value = {
+        '#ops': None, '#gone': "channel_not_found"}
+    telegram_bot = Mock(spec=TelegramBot)
+    telegram_bot.post_messages.side_effect = sent
+    routing_table = {'a': route('a', email=False)}
+    routing_table['a']['slack_channel_ids'] = ['#ops', '#gone']
+    routing_table['a']['telegram_chat_ids'] = ['chat-1', 'chat-2']
+    deliveries = Dispatcher(Mock(spec=EmailBot), slack_bot, telegram_bot) \
+        .dispatch(routing_table, [('a', "subject", "message")])
+    assert [(d.destination, d.ok) for d in deliveries] == [
+        ('#ops', True), ('#gone', False), ('chat-1', True), ('chat-2', True)]
+    slack_bot.post_messages.assert_called_once_with(
+        ['#ops', '#gone'], "subject\n\nmessage")
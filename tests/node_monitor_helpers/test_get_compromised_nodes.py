@@ -8,61 +8,79 @@ from node_monitor.node_monitor_helpers.get_compromised_nodes import \
 
 from tests.conftest import cached
 
+snap = ic_api.Snapshot.from_nodes
+
 
 def test_get_compromised_nodes():
     #
     # --->  [ 0 0 0 ]   # no nodes down
-    dq: Deque[ic_api.Nodes] = deque(maxlen=3)
-    dq.append(cached["control"])
-    dq.append(cached["control"])
-    dq.append(cached["control"])
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=3)
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["control"]))
     assert len(get_compromised_nodes(dq)) == 0
     # 
     # --->  [ 0 X 0 ]  # 1 node down (bounce)
-    dq: Deque[ic_api.Nodes] = deque(maxlen=3)
-    dq.append(cached["control"])
-    dq.append(cached["one_node_down"])
-    dq.append(cached["control"])
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=3)
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["one_node_down"]))
+    dq.append(snap(cached["control"]))
     assert len(get_compromised_nodes(dq)) == 0
     #
     # --->  [ 0 X X ]  # 1 node down for 2 snapshots
-    dq: Deque[ic_api.Nodes] = deque(maxlen=3)
-    dq.append(cached["control"])
-    dq.append(cached["one_node_down"])
-    dq.append(cached["one_node_down"])
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=3)
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["one_node_down"]))
+    dq.append(snap(cached["one_node_down"]))
     assert len(get_compromised_nodes(dq)) == 1
     #
     # --->  [ 0 X2 X2 ]  # 2 nodes down for 2 snapshots
-    dq: Deque[ic_api.Nodes] = deque(maxlen=3)
-    dq.append(cached["control"])
-    dq.append(cached["two_nodes_down"])
-    dq.append(cached["two_nodes_down"])
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=3)
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["two_nodes_down"]))
+    dq.append(snap(cached["two_nodes_down"]))
     assert len(get_compromised_nodes(dq)) == 2
     #
     # --->   [ 0 C C ]   # 1 node change subnet for 2 snapshots
-    dq: Deque[ic_api.Nodes] = deque(maxlen=3)
-    dq.append(cached["control"])
-    dq.append(cached["one_node_change_subnet"])
-    dq.append(cached["one_node_change_subnet"])
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=3)
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["one_node_change_subnet"]))
+    dq.append(snap(cached["one_node_change_subnet"]))
     assert len(get_compromised_nodes(dq)) == 0
     #
     # --->   [ 0 R 0 ]   # 1 node removed for 1 snapshot (bounce)
-    dq: Deque[ic_api.Nodes] = deque(maxlen=3)
-    dq.append(cached["control"])
-    dq.append(cached["one_node_removed"])
-    dq.append(cached["one_node_removed"])
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=3)
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["one_node_removed"]))
+    dq.append(snap(cached["one_node_removed"]))
     assert len(get_compromised_nodes(dq)) == 0
     #
     # --->   [ 0 R R ]   # 1 node removed for 2 snapshots
-    dq: Deque[ic_api.Nodes] = deque(maxlen=3)
-    dq.append(cached["control"])
-    dq.append(cached["one_node_removed"])
-    dq.append(cached["one_node_removed"])
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=3)
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["one_node_removed"]))
+    dq.append(snap(cached["one_node_removed"]))
     assert len(get_compromised_nodes(dq)) == 0
     #
     # --->   [ 0 A A ]   # 1 node added for 2 snapshots
-    dq: Deque[ic_api.Nodes] = deque(maxlen=3)
-    dq.append(cached["one_node_removed"])
-    dq.append(cached["control"])
-    dq.append(cached["control"])
-    
\ No newline at end of file
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=3)
+    dq.append(snap(cached["one_node_removed"]))
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["control"]))
+    
+
+def test_get_compromised_nodes_window():
+    # --->  [ 0 X X X ]  # window of 4: 1 node down for 3 snapshots
+    dq: Deque[ic_api.Snapshot] = deque(maxlen=4)
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["one_node_down"]))
+    dq.append(snap(cached["one_node_down"]))
+    dq.append(snap(cached["one_node_down"]))
+    assert len(get_compromised_nodes(dq)) == 1
+    #
+    # --->  [ 0 0 X X ]  # window of 4: 1 node down for 2 snapshots
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["control"]))
+    dq.append(snap(cached["one_node_down"]))
+    dq.append(snap(cached["one_node_down"]))
+    assert len(get_compromised_nodes(dq)) == 0
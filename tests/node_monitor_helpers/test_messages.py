@@ -27,3 +27,66 @@ def test_detailnodes():
     result = messages.detailnodes([fakenode], fakelabel)
     assert len(result) > 20 # greater than 20 characters
     assert result.startswith("Data Center: FAKE_DC_ID")
+
+
+def test_nodes_incident_message():
+    from node_monitor.node_monitor_helpers.correlate_incidents import Incident
+    othernode = fakenode.model_copy(update={'node_id': 'other_node_id'})
+    incident = Incident('dc', 'fake_dc_id', frozenset({'fake_node_id', 'x'}), 4)
+    subject, message = messages.nodes_incident_message(
+        [incident], [fakenode, othernode], fakelabel)
+    assert subject == "🔴 Outage @ FAKE_DC_ID"
+    assert "Nodes Compromised: 2 of 4, 1 of which are yours" in message
+    # only the node outside of the incident is listed in full
+    assert "Node ID: fake_node_id" not in message
+    assert "Node ID: other_node_id" in message
+
+
+def test_combined_message():
+    part = ('fake_node_provider_name', 'fake_subject', 'fake_message')
+    assert messages.combined_message([part]) == ('fake_subject', 'fake_message')
+    other = ('other_node_provider_name', 'other_subject', 'other_message')
+    subject, message = messages.combined_message([part, other, part])
+    assert subject == 'fake_subject (+1 more)'
+    assert message.startswith("Messages for 3 Node Providers:")
+    assert "Node Provider: other_node_provider_name\nother_subject" in message
+    assert message.count("fake_message") == 2
+
+
+def test_combined_status_message():
+    """Status reports already name their node provider, so the combined
+    message names each one once."""
+    other = fakenode.model_copy(update={
+        'node_provider_name': 'other_node_provider_name'})
+    parts = [(node.node_provider_name,
+              *messages.nodes_status_message([node], {}))
+             for node in [fakenode, other]]
+    subject, message = messages.combined_message(parts)
+    assert subject == "🟢 All Systems Healthy"
+    assert message.count("Node Provider: ") == 2
+    assert message.count("Node Provider: other_node_provider_name\n") == 1
+    assert "🟢 All Systems Healthy\n\nNode Provider: " in message
+
+
+def test_detailnode_cache():
+    messages._detailnode.cache_clear()
+    first = messages.detailnode(fakenode, 'fake_label')
+    assert messages.detailnode(fakenode, 'fake_label') is first
+    assert messages._detailnode.cache_info().hits == 1
+    # A new status or label renders the node again
+    down = fakenode.model_copy(update={'status': 'DOWN'})
+    assert "Node Status: DOWN" in messages.detailnode(down, 'fake_label')
+    assert "Node Label: new_label" in messages.detailnode(fakenode, 'new_label')
+    assert messages._detailnode.cache_info().misses == 3
+
+
+def test_nodes_status_message():
+    nodes = [fakenode.model_copy(update={'node_id': f'node_{status}',
+                                         'status': status})
+             for status in ['UP', 'UP', 'UNASSIGNED', 'DOWN', 'DEGRADED']]
+    subject, message = messages.nodes_status_message(nodes, {})
+    assert subject == "🟡 Action Required @ FAKE_DC_ID"
+    assert "Nodes Total: 5\n" in message
+    assert "Node Health: 2 Unhealthy, 3 Healthy\n" in message
+    assert "Node Assignment:  1 Unassigned, 2 Assigned\n" in message
+    assert message.index("node_DOWN") < message.index("node_DEGRADED")
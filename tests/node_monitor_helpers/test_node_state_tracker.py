@@ -0,0 +1,140 @@
+import pytest
+import copy
+import itertools
+import random
+from collections import deque
+
+import node_monitor.ic_api as ic_api
+from node_monitor.node_monitor_helpers.get_compromised_nodes import \
+    get_compromised_nodes
+from node_monitor.node_monitor_helpers.node_state_tracker import \
+    NodeStateTracker
+from node_monitor.node_monitor_helpers.status_ring import StatusRing, ABSENT
+
+
+fixtures = [ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file(f"data/t{i}.json"))
+            for i in range(6)]
+
+
+def track(sequence, window=3):
+    """Feeds a sequence of snapshots to a new tracker, yielding the node_ids
+    it finds compromised after each poll."""
+    tracker = NodeStateTracker(window)
+    previous = None
+    for t, snapshot in enumerate(sequence):
+        delta = ic_api.SnapshotDelta.between(previous, snapshot)
+        yield sorted(tracker.update(delta, t))
+        previous = snapshot
+
+
+def expected(window):
+    return sorted(node.node_id for node in get_compromised_nodes(deque(window)))
+
+
+@pytest.mark.parametrize("sequence", list(itertools.product(fixtures, repeat=3)))
+def test_same_alerts_as_get_compromised_nodes(sequence):
+    *_, found = track(sequence)
+    assert found == expected(sequence)
+
+
+@pytest.mark.parametrize("window", [2, 3, 5])
+def test_same_alerts_as_get_compromised_nodes_sliding(window):
+    rng = random.Random(window)
+    # weight towards repeats, so that streaks actually build up
+    sequence = []
+    while len(sequence) < 300:
+        sequence += [rng.choice(fixtures)] * rng.randint(1, window)
+    alerts = 0
+    for i, found in enumerate(track(sequence, window)):
+        if i >= window - 1:
+            assert found == expected(sequence[i - window + 1:i + 1])
+            alerts += len(found)
+    assert alerts > 0
+
+
+def test_alerts_once_per_incident():
+    control, one_node_down = fixtures[0], fixtures[1]
+    alerts = list(track([control, one_node_down, one_node_down,
+                         one_node_down, one_node_down]))
+    assert [len(found) for found in alerts] == [0, 0, 1, 0, 0]
+
+
+def test_last_healthy():
+    control, one_node_down = fixtures[1], fixtures[2]
+    tracker = NodeStateTracker()
+    tracker.update(ic_api.SnapshotDelta.between(None, control), 10)
+    tracker.update(ic_api.SnapshotDelta.between(control, one_node_down), 20)
+    delta = ic_api.SnapshotDelta.between(control, one_node_down)
+    [down] = delta.status_changed.keys()
+    assert tracker.last_healthy(down) == 10
+    assert tracker.streak(down) == 1
+    up = control.node_id(0)
+    assert up != down and tracker.last_healthy(up) == 20
+
+
+def test_recovered():
+    control, one_node_down = fixtures[1], fixtures[2]
+    tracker = NodeStateTracker(window=3)
+    previous = None
+    recovered = []
+    for t, snapshot in enumerate([control, one_node_down, control, control]):
+        tracker.update(ic_api.SnapshotDelta.between(previous, snapshot), t)
+        recovered.append(tracker.recovered)
+        previous = snapshot
+    delta = ic_api.SnapshotDelta.between(control, one_node_down)
+    assert recovered == [[], [], [], list(delta.status_changed)]
+
+
+def test_status_ring_grows():
+    ring = StatusRing(window=3, capacity=4)
+    for i in range(10):
+        ring.add(f"node-{i}")
+    ring.remove("node-3")
+    assert len(ring) == 9
+    assert ring.matrix.shape == (16, 3)
+    ring.advance()
+    ring.set(["node-9"], [ic_api.DOWN])
+    assert list(ring.history("node-9")) == [ABSENT, ABSENT, ic_api.DOWN]
+
+
+def test_update_only_evaluates_changes():
+    """The predicates are only evaluated for the rows that changed within
+    the window, not for the whole fleet."""
+    control, one_node_down = fixtures[1], fixtures[2]
+    tracker = NodeStateTracker(window=3)
+    tracker.update(ic_api.SnapshotDelta.between(None, control), -1)
+    tracker.update(ic_api.SnapshotDelta.between(control, control), 0)
+    evaluated = []
+    ordered = tracker.ring.ordered
+    tracker.ring.ordered = lambda rows: evaluated.append(len(rows)) \
+        or ordered(rows)
+    previous = control
+    for t, snapshot in enumerate([one_node_down] * 3 + [control], start=1):
+        tracker.update(ic_api.SnapshotDelta.between(previous, snapshot), t)
+        previous = snapshot
+    # of the whole fleet, only the node that changed, and only while the
+    # window of 3 remembers the change (2 polls)
+    assert len(control) > 1
+    assert evaluated == [1, 1, 0, 1]
+
+
+def test_resume():
+    """A tracker restored mid-streak, with only its ring, finds the same
+    nodes as one that kept running."""
+    rng = random.Random(0)
+    sequence = [rng.choice(fixtures) for _ in range(40)]
+    running = NodeStateTracker(window=3)
+    previous = None
+    for t, snapshot in enumerate(sequence):
+        delta = ic_api.SnapshotDelta.between(previous, snapshot)
+        found = running.update(delta, t)
+        if t == 20:
+            restored = NodeStateTracker(window=3)
+            restored.ring = copy.deepcopy(running.ring)
+            restored._last_healthy = running._last_healthy.copy()
+            restored.last_update = running.last_update
+            restored.resume()
+        elif t > 20:
+            assert restored.update(delta, t) == found
+            assert restored.recovered == running.recovered
+        previous = snapshot
@@ -0,0 +1,40 @@
+import pytest
+
+import node_monitor.ic_api as ic_api
+from node_monitor.node_monitor_helpers.snapshot_history import SnapshotHistory
+
+from tests.conftest import cached
+
+snap = ic_api.Snapshot.from_nodes
+
+
+def _sorted_nodes(snapshot):
+    return sorted(snapshot.nodes(), key=lambda node: node.node_id)
+
+
+def test_snapshot_history():
+    sequence = ["control", "one_node_down", "two_nodes_down",
+                "one_node_change_subnet", "one_node_removed", "control"]
+    history = SnapshotHistory(maxlen=3)
+    for t, key in enumerate(sequence):
+        delta = history.append(snap(cached[key]), t)
+    assert len(history) == 4
+    assert len(history.deltas) == 3
+    assert history.base_time == 2
+    # the last delta re-adds the nodes missing from one_node_removed
+    assert len(delta.added) == 2
+    # every retained snapshot is rebuilt exactly, oldest first
+    rebuilt = list(history)
+    assert [t for t, _ in rebuilt] == [2, 3, 4, 5]
+    for (_, snapshot), key in zip(rebuilt, sequence[2:]):
+        assert _sorted_nodes(snapshot) == _sorted_nodes(snap(cached[key]))
+    assert history.at(1) is None
+    assert _sorted_nodes(history.at(4.5)) == \
+        _sorted_nodes(snap(cached["one_node_removed"]))
+
+
+def test_snapshot_history_first_delta():
+    history = SnapshotHistory(maxlen=3)
+    delta = history.append(snap(cached["control"]), 0)
+    assert len(delta.added) == len(cached["control"].nodes)
+    assert len(history) == 1
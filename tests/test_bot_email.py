@@ -1,5 +1,6 @@
 import pytest
 import time
+import smtplib
 from unittest.mock import patch
 import requests
 import re
@@ -20,7 +21,7 @@ from tests.conftest import fake_data
 @patch('smtplib.SMTP')
 def test_send_emails_mock(mock_smtp):
     """Mock sending emails and check that the correct calls were made."""
-    mock_instance = mock_smtp.return_value.__enter__.return_value
+    mock_instance = mock_smtp.return_value
 
     recipients = ['test1@example.com', 'test2@example.com']
     subject = 'Test Subject'
@@ -36,6 +37,65 @@ def test_send_emails_mock(mock_smtp):
     mock_instance.login.assert_called_once_with('username', 'password')
 
 
+@patch('smtplib.SMTP')
+def test_send_emails_reuses_session(mock_smtp):
+    """The session stays logged in across calls, and is checked with a
+    NOOP once it has been idle for a while."""
+    mock_instance = mock_smtp.return_value
+    mock_instance.noop.return_value = (250, b'OK')
+    bot = EmailBot('username', 'password', health_check_interval=0)
+    bot.send_emails(['test1@example.com'], 'Subject', 'Body')
+    bot.send_emails(['test2@example.com'], 'Subject', 'Body')
+    assert mock_smtp.call_count == 1
+    assert mock_instance.login.call_count == 1
+    assert mock_instance.noop.call_count == 1
+    assert mock_instance.send_message.call_count == 2
+    bot.close()
+    assert mock_instance.quit.call_count == 1
+
+
+@patch('smtplib.SMTP')
+def test_send_emails_reconnects(mock_smtp):
+    """A session the server dropped is replaced, and the emails that were
+    not sent yet are sent over the new one."""
+    mock_instance = mock_smtp.return_value
+    mock_instance.noop.side_effect = smtplib.SMTPServerDisconnected()
+    bot = EmailBot('username', 'password', health_check_interval=0)
+    bot.send_emails(['test1@example.com'], 'Subject', 'Body')
+    bot.send_emails(['test2@example.com'], 'Subject', 'Body')
+    assert mock_smtp.call_count == 2
+
+    sent_to = []
+    def send_message(email_message):
+        sent_to.append(email_message['To'])
+        if len(sent_to) == 2:
+            raise smtplib.SMTPServerDisconnected()
+    mock_instance.send_message.side_effect = send_message
+    bot = EmailBot('username', 'password')
+    bot.send_emails(['a@example.com', 'b@example.com'], 'Subject', 'Body')
+    assert sent_to == ['a@example.com', 'b@example.com', 'b@example.com']
+    assert mock_smtp.call_count == 4
+
+
+@patch('smtplib.SMTP')
+def test_post_emails_per_recipient(mock_smtp):
+    """A recipient the server refuses doesn't stop the others, and its
+    error is returned rather than raised."""
+    refused = smtplib.SMTPRecipientsRefused({'b@example.com': (550, b'No')})
+    def send_message(email_message):
+        if email_message['To'] == 'b@example.com':
+            raise refused
+    mock_smtp.return_value.send_message.side_effect = send_message
+    bot = EmailBot('username', 'password')
+    recipients = ['a@example.com', 'b@example.com', 'c@example.com']
+    errors = bot.post_emails(recipients, 'Subject', 'Body')
+    assert errors == {'a@example.com': None, 'b@example.com': refused,
+                      'c@example.com': None}
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        bot.send_emails(recipients, 'Subject', 'Body')
+    assert mock_smtp.call_count == 1
+
+
 
 @pytest.mark.live_email
 def test_send_emails_network(fake_data):
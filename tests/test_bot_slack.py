@@ -1,5 +1,6 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import patch, Mock
+from slack_sdk.errors import SlackApiError
 
 from node_monitor.bot_slack import SlackBot
 import node_monitor.node_monitor_helpers.messages as messages
@@ -24,6 +25,72 @@ def test_send_message(mock_web_client):
         text=f"{expected_subject}\n\n{expected_message}")
 
 
+def slack_error(error, headers=None):
+    response = Mock(headers=headers or {})
+    response.__getitem__ = lambda self, key: {"ok": False, "error": error}[key]
+    return SlackApiError(error, response)
+
+
+@patch("slack_sdk.WebClient")
+def test_send_message_ratelimited(mock_web_client):
+    """A ratelimited post is retried after Retry-After instead of lost."""
+    mock_client = mock_web_client.return_value
+    mock_client.chat_postMessage.side_effect = [
+        slack_error("ratelimited", {"Retry-After": "3"}), None]
+    slack_bot = SlackBot(c.TOKEN_SLACK)
+    slept = []
+    slack_bot.channel_buckets["#node-monitor"]._sleep = slept.append
+    assert slack_bot.send_message("#node-monitor", "Hello, Slack!") is None
+    assert mock_client.chat_postMessage.call_count == 2
+    assert slept == [pytest.approx(3, abs=0.1)]
+
+
+@patch("slack_sdk.WebClient")
+def test_send_message_malformed_retry_after(mock_web_client):
+    """A Retry-After we can't parse falls back to 1s instead of raising."""
+    mock_client = mock_web_client.return_value
+    mock_client.chat_postMessage.side_effect = [
+        slack_error("ratelimited", {"Retry-After": "soon"}), None]
+    slack_bot = SlackBot(c.TOKEN_SLACK)
+    slept = []
+    slack_bot.channel_buckets["#node-monitor"]._sleep = slept.append
+    assert slack_bot.send_message("#node-monitor", "Hello, Slack!") is None
+    assert slept == [pytest.approx(1, abs=0.1)]
+
+
+@patch("slack_sdk.WebClient")
+def test_post_messages_per_channel(mock_web_client):
+    mock_client = mock_web_client.return_value
+    def post(channel, text):
+        if channel == "#missing":
+            raise slack_error("channel_not_found")
+    mock_client.chat_postMessage.side_effect = post
+    slack_bot = SlackBot(c.TOKEN_SLACK)
+    channels = ["#a", "#missing", "#b"]
+    errors = slack_bot.post_messages(channels, "Hello, Slack!")
+    assert list(errors) == channels
+    assert errors["#a"] is None and errors["#b"] is None
+    assert errors["#missing"].response["error"] == "channel_not_found"
+    slack_bot = SlackBot(c.TOKEN_SLACK)
+    assert slack_bot.send_messages(channels, "Hello, Slack!") \
+        .response["error"] == "channel_not_found"
+
+
+@patch("slack_sdk.WebClient")
+def test_post_messages_connection_error(mock_web_client):
+    """An error that isn't a SlackApiError only fails its own channel."""
+    mock_client = mock_web_client.return_value
+    timeout = TimeoutError("The read operation timed out")
+    def post(channel, text):
+        if channel == "#slow":
+            raise timeout
+    mock_client.chat_postMessage.side_effect = post
+    slack_bot = SlackBot(c.TOKEN_SLACK)
+    errors = slack_bot.post_messages(["#a", "#slow", "#b"], "Hello, Slack!")
+    assert errors == {"#a": None, "#slow": timeout, "#b": None}
+    assert slack_bot.send_message("#slow", "Hello, Slack!") is timeout
+
+
 @pytest.mark.live_slack
 def test_send_message_slack(fake_data):
     """Send a real test message to a Slack workspace"""
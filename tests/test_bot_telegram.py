@@ -1,13 +1,15 @@
 import pytest
-from unittest.mock import patch
+import requests
+from unittest.mock import patch, Mock
 
 import node_monitor.load_config as c
 import node_monitor.node_monitor_helpers.messages as messages
 from node_monitor.bot_telegram import TelegramBot
+from node_monitor.node_monitor_helpers.dispatcher import channel_workers
 from tests.conftest import fake_data
 
 
-@patch("requests.post")
+@patch("requests.Session.post")
 def test_send_message(mock_post):
     telegram_bot = TelegramBot(c.TOKEN_TELEGRAM)
     chat_id = "1234567890"
@@ -19,17 +21,99 @@ def test_send_message(mock_post):
         "text": f"{subject}\n\n{message}"
     }
     mock_response = mock_post.return_value
+    mock_response.status_code = 200
     mock_response.raise_for_status.return_value = None
 
     telegram_bot.send_message(chat_id, dispatch)
 
     mock_post.assert_called_once_with(
         f"https://api.telegram.org/bot{telegram_bot.telegram_token}/sendMessage",
-        data=payload
+        data=payload, timeout=telegram_bot.timeout
     )
     mock_response.raise_for_status.assert_called_once()
 
 
+@patch("requests.Session.post")
+def test_send_message_retry_after(mock_post):
+    """A 429 is retried after `retry_after` seconds instead of dropped."""
+    rate_limited = Mock(status_code=429)
+    rate_limited.json.return_value = {
+        "ok": False, "error_code": 429, "parameters": {"retry_after": 7}}
+    ok = Mock(status_code=200)
+    mock_post.side_effect = [rate_limited, ok]
+    telegram_bot = TelegramBot(c.TOKEN_TELEGRAM)
+    slept = []
+    telegram_bot.chat_buckets["1234567890"]._sleep = slept.append
+    telegram_bot.global_bucket._sleep = lambda seconds: None
+    assert telegram_bot.send_message("1234567890", "message") is None
+    assert mock_post.call_count == 2
+    assert slept == [pytest.approx(7, abs=0.1)]
+    ok.raise_for_status.assert_called_once()
+
+
+@patch("requests.Session.post")
+def test_send_messages_returns_last_error(mock_post):
+    failed = Mock(status_code=400)
+    failed.raise_for_status.side_effect = requests.exceptions.HTTPError("400")
+    mock_post.side_effect = lambda url, data, timeout: \
+        failed if data["chat_id"] == "2" else Mock(status_code=200)
+    telegram_bot = TelegramBot(c.TOKEN_TELEGRAM)
+    err = telegram_bot.send_messages(["1", "2", "3"], "message")
+    assert isinstance(err, requests.exceptions.HTTPError)
+    assert mock_post.call_count == 3
+
+
+@patch("requests.Session.post")
+def test_send_message_retry_after_pauses_every_chat(mock_post):
+    rate_limited = Mock(status_code=429)
+    rate_limited.json.return_value = {"parameters": {"retry_after": 7}}
+    mock_post.side_effect = [rate_limited, Mock(status_code=200),
+                             Mock(status_code=200)]
+    telegram_bot = TelegramBot(c.TOKEN_TELEGRAM)
+    slept = []
+    telegram_bot.chat_buckets["1"]._sleep = lambda seconds: None
+    telegram_bot.global_bucket._sleep = slept.append
+    telegram_bot.send_message("1", "message")
+    # Another chat has to wait for the flood limit too
+    telegram_bot.send_message("2", "message")
+    assert slept and slept[-1] > 6
+
+
+@patch("requests.Session.post")
+def test_post_messages_per_chat(mock_post):
+    failed = Mock(status_code=400)
+    failed.raise_for_status.side_effect = requests.exceptions.HTTPError("400")
+    mock_post.side_effect = lambda url, data, timeout: \
+        failed if data["chat_id"] == "2" else Mock(status_code=200)
+    telegram_bot = TelegramBot(c.TOKEN_TELEGRAM)
+    errors = telegram_bot.post_messages(["1", "2", "3"], "message")
+    assert list(errors) == ["1", "2", "3"]
+    assert errors["1"] is None and errors["3"] is None
+    assert isinstance(errors["2"], requests.exceptions.HTTPError)
+
+
+@patch("requests.Session.post")
+def test_send_messages_survives_connection_errors(mock_post):
+    def post(url, data, timeout):
+        if data["chat_id"] == "1":
+            raise requests.exceptions.ConnectionError("reset")
+        if data["chat_id"] == "2":
+            raise requests.exceptions.Timeout("timed out")
+        return Mock(status_code=200)
+    mock_post.side_effect = post
+    telegram_bot = TelegramBot(c.TOKEN_TELEGRAM)
+    err = telegram_bot.send_messages(["1", "2", "3"], "message")
+    assert isinstance(err, requests.exceptions.RequestException)
+    assert mock_post.call_count == 3
+
+
+def test_session_pool_fits_dispatcher():
+    telegram_bot = TelegramBot(c.TOKEN_TELEGRAM, max_workers=2,
+                               concurrent_calls=channel_workers['telegram'])
+    adapter = telegram_bot.session.get_adapter("https://api.telegram.org")
+    assert adapter._pool_maxsize == 2 * channel_workers['telegram']
+
+
 
 @pytest.mark.live_telegram
 def test_send_live_message(fake_data):
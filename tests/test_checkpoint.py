@@ -0,0 +1,70 @@
+import numpy as np
+
+import node_monitor.ic_api as ic_api
+from node_monitor.checkpoint import write_checkpoint, read_checkpoint
+from node_monitor.node_monitor_helpers.node_state_tracker import \
+    NodeStateTracker
+
+from tests.conftest import cached
+
+
+def tracked(*nodes_list):
+    snapshots, tracker, previous = [], NodeStateTracker(), None
+    for t, nodes in enumerate(nodes_list):
+        snapshot = ic_api.Snapshot.from_nodes(nodes, previous)
+        tracker.update(ic_api.SnapshotDelta.between(previous, snapshot), t)
+        snapshots.append(snapshot)
+        previous = snapshot
+    return snapshots, tracker
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    snapshots, tracker = tracked(cached['control'],
+                                 cached['two_nodes_down'],
+                                 cached['two_nodes_down'])
+    write_checkpoint(path, 2, snapshots, tracker)
+    checkpoint = read_checkpoint(path)
+    assert checkpoint is not None
+    assert checkpoint.timestamp == 2
+    assert [s.nodes() for s in checkpoint.snapshots] \
+        == [s.nodes() for s in snapshots]
+    restored = checkpoint.node_states
+    assert restored.compromised == tracker.compromised
+    assert len(restored.compromised) == 2
+    assert np.array_equal(restored.ring.ordered(), tracker.ring.ordered())
+    assert restored.ring.rows == tracker.ring.rows
+    node_id = restored.compromised[0]
+    assert restored.last_healthy(node_id) == tracker.last_healthy(node_id)
+    assert restored.streak(node_id) == tracker.streak(node_id)
+
+
+def test_checkpoint_remaps_string_codes(tmp_path, monkeypatch):
+    path = str(tmp_path / "checkpoint")
+    snapshots, tracker = tracked(cached['control'])
+    write_checkpoint(path, 0, snapshots, tracker)
+    # A process that has already interned other strings
+    monkeypatch.setattr(ic_api, 'strings', ic_api.StringTable(['a', 'b']))
+    checkpoint = read_checkpoint(path)
+    assert checkpoint is not None
+    assert checkpoint.snapshots[0].nodes() == cached['control'].nodes
+
+
+def test_checkpoint_saves_only_referenced_strings(tmp_path, monkeypatch):
+    path = str(tmp_path / "checkpoint")
+    # Strings interned for nodes that are long gone
+    monkeypatch.setattr(ic_api, 'strings',
+                        ic_api.StringTable(f"gone-{i}" for i in range(1000)))
+    snapshots, tracker = tracked(cached['control'])
+    write_checkpoint(path, 0, snapshots, tracker)
+    monkeypatch.setattr(ic_api, 'strings', ic_api.StringTable())
+    checkpoint = read_checkpoint(path)
+    assert checkpoint is not None
+    assert checkpoint.snapshots[0].nodes() == cached['control'].nodes
+    assert not any(s.startswith("gone-") for s in ic_api.strings.strings)
+
+
+def test_checkpoint_missing(tmp_path):
+    assert read_checkpoint(str(tmp_path / "missing")) is None
+    (tmp_path / "garbage").write_bytes(b"\0" * 64)
+    assert read_checkpoint(str(tmp_path / "garbage")) is None
@@ -1,4 +1,7 @@
+import json
 import pytest
+import pydantic
+from unittest.mock import Mock
 import node_monitor.ic_api as ic_api
 
 
@@ -19,4 +22,168 @@ def test_get_node_providers():
 
 def test_get_node_providers_from_file():
     node_providers = ic_api.get_node_providers_from_file("data/np_t0.json")
-    assert len(node_providers.node_providers) > 0
\ No newline at end of file
+    assert len(node_providers.node_providers) > 0
+
+## ICAPIClient conditional fetching
+## These use a mocked requests.Session, so they don't need the network.
+
+def _mock_response(status_code, content=b'', headers=None):
+    response = Mock()
+    response.status_code = status_code
+    response.content = content
+    response.headers = headers or {}
+    return response
+
+def test_client_get_nodes_if_modified_304():
+    with open("data/t0.json", "rb") as f:
+        raw = f.read()
+    session = Mock()
+    session.get.side_effect = [
+        _mock_response(200, raw, {'ETag': '"abc"', 'Last-Modified': 'yesterday'}),
+        _mock_response(304),
+    ]
+    client = ic_api.ICAPIClient(session=session)
+    assert len(client.get_nodes_if_modified().nodes) > 0
+    assert client.get_nodes_if_modified() is None
+    # second request must carry the validators from the first response
+    headers = session.get.call_args_list[1].kwargs['headers']
+    assert headers == {'If-None-Match': '"abc"', 'If-Modified-Since': 'yesterday'}
+
+def test_client_get_nodes_if_modified_same_body():
+    # Servers that ignore conditional headers still return 200, so we
+    # fall back on comparing the hash of the body.
+    with open("data/t0.json", "rb") as f:
+        raw0 = f.read()
+    with open("data/t1.json", "rb") as f:
+        raw1 = f.read()
+    session = Mock()
+    session.get.side_effect = [
+        _mock_response(200, raw0),
+        _mock_response(200, raw0),
+        _mock_response(200, raw1),
+    ]
+    client = ic_api.ICAPIClient(session=session)
+    assert client.get_nodes_if_modified() is not None
+    assert client.get_nodes_if_modified() is None
+    assert client.get_nodes_if_modified() is not None
+    assert session.get.call_args_list[1].kwargs['headers'] == {}
+
+def test_client_forgets_unparseable_body():
+    session = Mock()
+    session.get.side_effect = [
+        _mock_response(200, b'{"nodes": [{"bad": "node"}]}'),
+        _mock_response(200, b'{"nodes": [{"bad": "node"}]}'),
+    ]
+    client = ic_api.ICAPIClient(session=session)
+    with pytest.raises(pydantic.ValidationError):
+        client.get_nodes_if_modified()
+    # not reported as unchanged, the payload is still broken
+    with pytest.raises(pydantic.ValidationError):
+        client.get_nodes_if_modified()
+
+
+## Parsing
+
+def test_parse_nodes():
+    with open("data/t0.json", "rb") as f:
+        raw = f.read()
+    assert ic_api.parse_nodes(raw) == ic_api.Nodes(**json.loads(raw))
+
+
+## Snapshots
+
+def test_snapshot_roundtrip():
+    nodes = ic_api.get_nodes_from_file("data/t3.json")
+    snapshot = ic_api.Snapshot.from_nodes(nodes)
+    assert len(snapshot) == len(nodes.nodes)
+    assert snapshot.nodes() == nodes.nodes
+    node = nodes.nodes[5]
+    assert snapshot.node(snapshot.index[node.node_id]) == node
+
+def test_snapshot_shares_unchanged_columns():
+    # t1 and t2 list the same nodes in the same order
+    one_node_down = ic_api.Snapshot.from_nodes(
+        ic_api.get_nodes_from_file("data/t1.json"))
+    two_nodes_down = ic_api.Snapshot.from_nodes(
+        ic_api.get_nodes_from_file("data/t2.json"), previous=one_node_down)
+    assert two_nodes_down.columns['node_id'] is one_node_down.columns['node_id']
+    assert two_nodes_down.columns['dc_id'] is one_node_down.columns['dc_id']
+    assert two_nodes_down.index is one_node_down.index
+    assert two_nodes_down.status != one_node_down.status
+
+def test_parse_snapshot():
+    with open("data/t2.json", "rb") as f:
+        raw = f.read()
+    assert ic_api.parse_snapshot(raw).nodes() == ic_api.parse_nodes(raw).nodes
+
+def test_snapshot_null_subnet():
+    node = ic_api.Node(
+        dc_id='dc', dc_name='dc', node_id='node', node_operator_id='op',
+        node_provider_id='np', node_provider_name='np', owner='owner',
+        region='region', status='UNASSIGNED', subnet_id=None)
+    snapshot = ic_api.Snapshot.from_nodes(ic_api.Nodes(nodes=[node]))
+    assert snapshot.get('subnet_id', 0) is None
+    assert snapshot.status[0] == ic_api.UNASSIGNED
+    assert snapshot.node(0) == node
+
+
+## Snapshot deltas
+
+def _sorted_nodes(snapshot):
+    return sorted(snapshot.nodes(), key=lambda node: node.node_id)
+
+@pytest.mark.parametrize("a, b", [
+    ("t0", "t1"), ("t1", "t2"), ("t1", "t3"), ("t4", "t0"), ("t0", "t4"),
+    ("t5", "t0"), ("t2", "t2")])
+def test_snapshot_delta_apply(a, b):
+    old = ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file(f"data/{a}.json"))
+    new = ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file(f"data/{b}.json"))
+    delta = ic_api.SnapshotDelta.between(old, new)
+    assert _sorted_nodes(delta.apply(old)) == _sorted_nodes(new)
+
+def test_snapshot_delta_contents():
+    # t1 -> t2: one more node goes down
+    one_node_down = ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file("data/t1.json"))
+    two_nodes_down = ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file("data/t2.json"))
+    delta = ic_api.SnapshotDelta.between(one_node_down, two_nodes_down)
+    assert len(delta.added) == 0 and delta.removed == []
+    assert len(delta.status_changed) == 1
+    assert list(delta.status_changed.values()) == [(ic_api.UP, ic_api.DOWN)]
+    # t1 -> t3: one node changes subnet
+    one_node_change_subnet = ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file("data/t3.json"))
+    delta = ic_api.SnapshotDelta.between(one_node_down, one_node_change_subnet)
+    assert len(delta.subnet_changed) == 1
+    # t0 -> t4: one node removed
+    control = ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file("data/t0.json"))
+    one_node_removed = ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file("data/t4.json"))
+    delta = ic_api.SnapshotDelta.between(control, one_node_removed)
+    assert len(delta.removed) == 2 and len(delta.added) == 0
+    assert not delta.status_changed and not delta.subnet_changed
+    # no changes, and no previous snapshot
+    assert not ic_api.SnapshotDelta.between(control, control)
+    assert len(ic_api.SnapshotDelta.between(None, control).added) == len(control)
+
+
+## Snapshot indexes
+
+def test_snapshot_groups():
+    nodes = ic_api.get_nodes_from_file("data/t2.json")
+    snapshot = ic_api.Snapshot.from_nodes(nodes)
+    by_dc = snapshot.by_dc
+    assert sum(len(rows) for rows in by_dc.values()) == len(nodes.nodes)
+    for dc_id, rows in by_dc.items():
+        assert {nodes.nodes[row].dc_id for row in rows} == {dc_id}
+    assert len(snapshot.by_status['DOWN']) == 2
+    assert snapshot.by_status is snapshot.by_status  # cached
+    assert None in snapshot.by_subnet  # unassigned nodes
+    down = snapshot.by_status['DOWN']
+    assert snapshot.group('status', down) == {'DOWN': list(down)}
+
+def test_snapshot_groups_shared():
+    one_node_down = ic_api.Snapshot.from_nodes(ic_api.get_nodes_from_file("data/t1.json"))
+    by_provider = one_node_down.by_provider
+    one_node_down.by_status
+    two_nodes_down = ic_api.Snapshot.from_nodes(
+        ic_api.get_nodes_from_file("data/t2.json"), previous=one_node_down)
+    assert two_nodes_down.by_provider is by_provider
+    assert len(two_nodes_down.by_status['DOWN']) == 2
@@ -1,3 +1,4 @@
+import time
 import pytest
 from devtools import debug
 from unittest.mock import patch, Mock
@@ -7,6 +8,9 @@ from node_monitor.bot_email import EmailBot
 from node_monitor.bot_slack import SlackBot
 from node_monitor.bot_telegram import TelegramBot
 from node_monitor.node_provider_db import NodeProviderDB
+from node_monitor.outbox import Outbox
+from node_monitor.checkpoint import write_checkpoint
+import node_monitor.ic_api as ic_api
 
 from tests.conftest import cached
 
@@ -50,6 +54,17 @@ mock_node_provider_db.get_slack_channels_as_dict.return_value = \
 mock_node_provider_db.get_telegram_chats_as_dict.return_value = \
     {'rbn2y-6vfsb-gv35j-4cyvy-pzbdu-e5aum-jzjg6-5b4n5-vuguf-ycubq-zae':
         ['5734534558']}
+mock_node_provider_db.get_routing_table.return_value = {
+    node_provider_id: dict(
+        subscriber,
+        email_addresses=mock_node_provider_db.get_emails_as_dict
+            .return_value.get(node_provider_id, []),
+        slack_channel_ids=mock_node_provider_db.get_slack_channels_as_dict
+            .return_value.get(node_provider_id, []),
+        telegram_chat_ids=mock_node_provider_db.get_telegram_chats_as_dict
+            .return_value.get(node_provider_id, []))
+    for node_provider_id, subscriber
+    in mock_node_provider_db.get_subscribers_as_dict.return_value.items()}
 mock_node_provider_db.get_node_providers_as_dict.return_value = \
     {'7k7b7-4pzhf-aivy6-y654t-uqyup-2auiz-ew2cm-4qkl4-nsl4v-bul5k-5qe': '1G',
     'sqhxa-h6ili-qkwup-ohzwn-yofnm-vvnp5-kxdhg-saabw-rvua3-xp325-zqe': '43rd Big Idea Films'}
@@ -104,9 +119,9 @@ def test_control():
 
     # test broadcast_alerts()
     nm.broadcast_alerts()
-    assert mock_email_bot.send_emails.call_count == 0
-    assert mock_slack_bot.send_messages.call_count == 0
-    assert mock_telegram_bot.send_messages.call_count == 0
+    assert mock_email_bot.post_emails.call_count == 0
+    assert mock_slack_bot.post_messages.call_count == 0
+    assert mock_telegram_bot.post_messages.call_count == 0
     mock_node_provider_db.reset_mock()
     mock_email_bot.reset_mock()
     mock_slack_bot.reset_mock()
@@ -114,9 +129,10 @@ def test_control():
 
     # test broadcast_status_report()
     nm.broadcast_status_report()
-    assert mock_email_bot.send_emails.call_count == 1
-    assert mock_slack_bot.send_messages.call_count == 1
-    assert mock_telegram_bot.send_messages.call_count == 1
+    assert mock_email_bot.post_emails.call_count == 1
+    assert mock_slack_bot.post_messages.call_count == 1
+    assert mock_telegram_bot.post_messages.call_count == 1
+    assert [d.channel for d in nm.deliveries] == ['email', 'slack', 'telegram']
     mock_node_provider_db.reset_mock()
     mock_email_bot.reset_mock()
     mock_slack_bot.reset_mock()
@@ -146,9 +162,9 @@ def test_one_node_bounce():
 
     # test broadcast_alerts()
     nm.broadcast_alerts()
-    assert mock_email_bot.send_emails.call_count == 0
-    assert mock_slack_bot.send_messages.call_count == 0
-    assert mock_telegram_bot.send_messages.call_count == 0
+    assert mock_email_bot.post_emails.call_count == 0
+    assert mock_slack_bot.post_messages.call_count == 0
+    assert mock_telegram_bot.post_messages.call_count == 0
     mock_node_provider_db.reset_mock()
     mock_email_bot.reset_mock()
     mock_slack_bot.reset_mock()
@@ -175,9 +191,9 @@ def test_two_nodes_down():
 
     # test broadcast_alerts()
     nm.broadcast_alerts()
-    assert mock_email_bot.send_emails.call_count == 1
-    assert mock_slack_bot.send_messages.call_count == 1
-    assert mock_telegram_bot.send_messages.call_count == 1
+    assert mock_email_bot.post_emails.call_count == 1
+    assert mock_slack_bot.post_messages.call_count == 1
+    assert mock_telegram_bot.post_messages.call_count == 1
     mock_node_provider_db.reset_mock()
     mock_email_bot.reset_mock()
     mock_slack_bot.reset_mock()
@@ -204,7 +220,7 @@ def test_one_new_node_online():
 
     # test broadcast_alerts()
     nm.broadcast_alerts()
-    assert mock_email_bot.send_emails.call_count == 0
+    assert mock_email_bot.post_emails.call_count == 0
     assert mock_slack_bot.send_message.call_count == 0
     assert mock_telegram_bot.send_message.call_count == 0
     mock_node_provider_db.reset_mock()
@@ -235,4 +251,299 @@ def test_one_new_node_provider():
     
     nm.update_node_provider_lookup_if_new(cached['new_node_providers'])
     assert mock_node_provider_db.insert_node_providers.call_count == 1
-    
\ No newline at end of file
+
+
+
+def test_node_provider_lookup_resyncs_unchanged_payload():
+    """Test that a provider missing from the db is inserted even if the
+    ic-api payload hasn't changed since the last (failed) sync."""
+    mock_ic_api_client = Mock(spec=ic_api.ICAPIClient)
+    mock_ic_api_client.get_node_providers.return_value = \
+        cached['new_node_providers']
+    mock_db = Mock(spec=NodeProviderDB)
+    mock_db.get_node_providers_as_dict.return_value = {}
+    mock_db.insert_node_providers.side_effect = [Exception("db down"), None]
+    nm = NodeMonitor(mock_db, Mock(spec=EmailBot),
+                     ic_api_client=mock_ic_api_client)
+
+    with pytest.raises(Exception):
+        nm.update_node_provider_lookup_if_new()
+    nm.update_node_provider_lookup_if_new()
+    assert mock_db.insert_node_providers.call_count == 2
+    
+
+
+def test_resync_not_modified():
+    """Test that an unchanged ic-api payload is not re-parsed or analyzed."""
+    mock_email_bot = Mock(spec=EmailBot)
+    mock_ic_api_client = Mock(spec=ic_api.ICAPIClient)
+    mock_ic_api_client.get_snapshot.return_value = \
+        ic_api.Snapshot.from_nodes(cached['control'])
+    mock_ic_api_client.get_snapshot_if_modified.return_value = None
+    nm = NodeMonitor(mock_node_provider_db, mock_email_bot,
+                     ic_api_client=mock_ic_api_client)
+    nm._resync()
+    nm._resync()
+    nm._resync()
+    assert mock_ic_api_client.get_snapshot.call_count == 1
+    assert mock_ic_api_client.get_snapshot_if_modified.call_count == 2
+    assert len(nm.snapshots) == 3
+    assert all(s is nm.snapshots[0] for s in nm.snapshots)
+
+    mock_node_provider_db.reset_mock()
+    nm._analyze()
+    assert len(nm.actionables) == 0
+    assert mock_node_provider_db.get_subscribers_as_dict.call_count == 0
+
+
+
+def test_resync_delta():
+    """Test that each resync exposes its changes as last_delta."""
+    mock_email_bot = Mock(spec=EmailBot)
+    nm = NodeMonitor(mock_node_provider_db, mock_email_bot)
+    nm._resync(cached['one_node_change_subnet'])
+    assert len(nm.last_delta.added) == len(cached['one_node_change_subnet'].nodes)
+    nm._resync(cached['one_node_down'])
+    assert len(nm.last_delta.status_changed) == 1
+    assert len(nm.last_delta.subnet_changed) == 1
+    nm._resync(cached['one_node_down'])
+    assert not nm.last_delta
+    assert len(nm.history) == 3
+
+
+
+def test_debounce_window():
+    """Test that a longer debounce window needs more polls to alert."""
+    mock_email_bot = Mock(spec=EmailBot)
+    nm = NodeMonitor(mock_node_provider_db, mock_email_bot, debounce_window=4)
+    nm._resync(cached['control'])
+    nm._resync(cached['two_nodes_down'])
+    nm._resync(cached['two_nodes_down'])
+    nm._analyze()
+    assert len(nm.compromised_nodes) == 0
+    nm._resync(cached['two_nodes_down'])
+    nm._analyze()
+    assert len(nm.compromised_nodes) == 2
+    assert len(nm.snapshots) == 4
+
+
+
+def test_dc_outage():
+    """Test that a data center outage sends one condensed message."""
+    from tests.node_monitor_helpers.test_correlate_incidents import outage
+    mock_email_bot = Mock(spec=EmailBot)
+    nm = NodeMonitor(mock_node_provider_db, mock_email_bot)
+    nm._resync(cached['control'])
+    nm._resync(outage(cached['control'], 'br2'))
+    nm._resync(outage(cached['control'], 'br2'))
+    nm._analyze()
+    nm._correlate()
+    assert len(nm.compromised_nodes) == 10
+    assert [(i.kind, i.key) for i in nm.incidents] == [('dc', 'br2')]
+
+    nm.broadcast_alerts()
+    assert mock_email_bot.post_emails.call_count == 1
+    _, subject, message = mock_email_bot.post_emails.call_args.args
+    assert subject == "🔴 Outage @ BR2"
+    assert "Node ID:" not in message
+
+
+
+def test_warm_restart(tmp_path):
+    """Test that a restarted NodeMonitor resumes alerting right away."""
+    path = str(tmp_path / "node_monitor.checkpoint")
+    nm = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                     checkpoint_path=path)
+    nm._resync(cached['control'])
+    nm._resync(cached['two_nodes_down'])
+    nm.save_checkpoint()
+
+    # One poll after the restart is enough to fill the window
+    restarted = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                            checkpoint_path=path)
+    assert restarted.load_checkpoint()
+    assert len(restarted.snapshots) == 2
+    restarted._resync(cached['two_nodes_down'])
+    restarted._analyze()
+    assert len(restarted.compromised_nodes) == 2
+
+    # A checkpoint for another window size is ignored
+    other = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                        debounce_window=4, checkpoint_path=path)
+    assert not other.load_checkpoint()
+
+
+
+def test_warm_restart_stale(tmp_path):
+    """Test that an old checkpoint is ignored: we can't tell what happened
+    to the nodes in the gap."""
+    path = str(tmp_path / "node_monitor.checkpoint")
+    nm = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                     checkpoint_path=path)
+    nm._resync(cached['control'])
+    nm.last_update = 0
+    nm.save_checkpoint()
+    restarted = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                            checkpoint_path=path)
+    assert not restarted.load_checkpoint()
+    assert len(restarted.snapshots) == 0
+
+
+
+def test_warm_restart_empty(tmp_path):
+    """Test that a checkpoint without snapshots falls back to a cold start."""
+    path = str(tmp_path / "node_monitor.checkpoint")
+    nm = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot))
+    write_checkpoint(path, time.time(), [], nm.node_states)
+    restarted = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                            checkpoint_path=path)
+    assert not restarted.load_checkpoint()
+    assert len(restarted.snapshots) == 0
+
+
+
+def sent(destinations, *args):
+    """A bot's post_messages() or post_emails() that sends everything."""
+    return dict.fromkeys(destinations)
+
+
+def test_outbox(tmp_path):
+    """Test that alerts are queued in the outbox rather than sent inline,
+    survive a restart, and that a retry only goes to the destinations
+    that failed."""
+    path = str(tmp_path / "outbox.sqlite3")
+    mock_email_bot = Mock(spec=EmailBot)
+    mock_email_bot.post_emails.side_effect = sent
+    mock_slack_bot = Mock(spec=SlackBot)
+    mock_slack_bot.post_messages.side_effect = sent
+    mock_telegram_bot = Mock(spec=TelegramBot)
+    mock_telegram_bot.post_messages.side_effect = \
+        lambda destinations, text: {chat_id: "Too Many Requests"
+                                    if chat_id == 'bad-chat' else None
+                                    for chat_id in destinations}
+    mock_db = Mock(spec=NodeProviderDB)
+    mock_db.get_node_labels_as_dict.return_value = {}
+    mock_db.get_subscribers_as_dict.return_value = \
+        mock_node_provider_db.get_subscribers_as_dict.return_value
+    mock_db.get_routing_table.return_value = {
+        node_provider_id: dict(route, telegram_chat_ids=['5734534558',
+                                                         'bad-chat'])
+        for node_provider_id, route
+        in mock_node_provider_db.get_routing_table.return_value.items()}
+    nm = NodeMonitor(mock_db, mock_email_bot,
+                     mock_slack_bot, mock_telegram_bot, outbox=Outbox(path))
+    nm._resync(cached['control'])
+    nm._resync(cached['two_nodes_down'])
+    nm._resync(cached['two_nodes_down'])
+    nm._analyze()
+    nm.broadcast_alerts()
+    nm.broadcast_alerts() # same step, same idempotency key
+    assert mock_email_bot.post_emails.call_count == 0
+    assert nm.outbox.pending() == 1
+
+    # A restart picks up where we left off
+    restarted = NodeMonitor(mock_db, mock_email_bot,
+                            mock_slack_bot, mock_telegram_bot,
+                            outbox=Outbox(path))
+    assert restarted.drain_outbox() == 1
+    assert [(d.destination, d.ok) for d in restarted.deliveries] == \
+        [('test_recipient@gmail.com', True), ('#node-monitor', True),
+         ('5734534558', True), ('bad-chat', False)]
+    assert restarted.outbox.pending() == 1
+
+    mock_telegram_bot.post_messages.side_effect = sent
+    with patch('time.time', return_value=time.time() + 60 * 60):
+        assert restarted.drain_outbox() == 1
+    assert [d.destination for d in restarted.deliveries] == ['bad-chat']
+    assert mock_email_bot.post_emails.call_count == 1
+    assert mock_telegram_bot.post_messages.call_args.args[0] == ['bad-chat']
+    assert restarted.outbox.pending() == 0
+
+
+
+def test_outbox_step_run_again(tmp_path):
+    """Test that a step that is run again after a restart, e.g. because
+    we crashed before saving the checkpoint, doesn't queue its alerts
+    again, while the same nodes going down again later do."""
+    path = str(tmp_path / "outbox.sqlite3")
+    checkpoint_path = str(tmp_path / "node_monitor.checkpoint")
+    def run_step(nm):
+        nm._resync(cached['two_nodes_down'])
+        nm._analyze()
+        nm.broadcast_alerts()
+    nm = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                     checkpoint_path=checkpoint_path, outbox=Outbox(path))
+    nm._resync(cached['control'])
+    nm._resync(cached['two_nodes_down'])
+    nm.save_checkpoint()
+    run_step(nm)
+    assert nm.outbox.pending() == 1
+
+    restarted = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                            checkpoint_path=checkpoint_path,
+                            outbox=Outbox(path))
+    assert restarted.load_checkpoint()
+    run_step(restarted)
+    assert restarted.outbox.pending() == 1
+
+    # The nodes recover, then go down again
+    restarted._resync(cached['control'])
+    restarted._resync(cached['two_nodes_down'])
+    run_step(restarted)
+    assert restarted.outbox.pending() == 2
+
+
+def test_outbox_routing_table_fails(tmp_path):
+    """Test that messages whose routes can't be fetched are retried with
+    backoff, like a failed delivery."""
+    mock_db = Mock(spec=NodeProviderDB)
+    mock_db.get_routing_table.side_effect = Exception("connection refused")
+    nm = NodeMonitor(mock_db, Mock(spec=EmailBot),
+                     outbox=Outbox(str(tmp_path / "outbox.sqlite3")))
+    nm._broadcast([("principal", "Alert", "nodes down")], key="alert:1")
+    assert nm.drain_outbox() == 1
+    assert nm.outbox.claim() == []
+    with patch('time.time', return_value=time.time() + 60 * 60):
+        [entry] = nm.outbox.claim()
+    assert entry.attempts == 1
+
+
+def test_outbox_worker_purges(tmp_path):
+    """Test that the outbox worker deletes old messages periodically,
+    not just once at startup."""
+    nm = NodeMonitor(mock_node_provider_db, Mock(spec=EmailBot),
+                     outbox=Mock(spec=Outbox))
+    nm._outbox_ready = Mock()
+    clock = iter(range(0, 10 * 60 * 60, 20 * 60)) # every 20 minutes
+    # Stop the worker (a daemon thread that runs forever) after 6 drains
+    nm.drain_outbox = Mock(side_effect=[0] * 6 + [SystemExit])
+    with patch('time.monotonic', side_effect=lambda: next(clock)):
+        with pytest.raises(SystemExit):
+            nm._outbox_worker()
+    assert nm.outbox.purge.call_count == 3
+
+
+def test_outbox_combines_only_one_broadcast(tmp_path):
+    """Test that messages queued by different broadcasts are never
+    combined into one, even when they are drained together."""
+    mock_email_bot = Mock(spec=EmailBot)
+    mock_email_bot.post_emails.side_effect = sent
+    mock_db = Mock(spec=NodeProviderDB)
+    mock_db.get_routing_table.return_value = {
+        k: dict(route, email_addresses=['ops@example.com'],
+                notify_slack=False, notify_telegram=False)
+        for k, route
+        in mock_node_provider_db.get_routing_table.return_value.items()}
+    providers = list(mock_db.get_routing_table.return_value)
+    nm = NodeMonitor(mock_db, mock_email_bot,
+                     outbox=Outbox(str(tmp_path / "outbox.sqlite3")))
+    nm._broadcast([(k, "Alert", "nodes down") for k in providers],
+                  key="alert:1")
+    nm._broadcast([(providers[0], "Status", "all good")],
+                  key="status_report:2026-10-18")
+    assert nm.drain_outbox() == 3
+    sent_emails = sorted(c.args[1:]
+                         for c in mock_email_bot.post_emails.call_args_list)
+    assert [subject for subject, _ in sent_emails] == ["Alert", "Status"]
+    assert sent_emails[0][1].startswith("Messages for 2 Node Providers")
+    assert sent_emails[1][1] == "all good"
@@ -1,7 +1,13 @@
+import re
+import time
 import pytest
 from devtools import debug
+import psycopg2, psycopg2.pool
+from unittest.mock import MagicMock, Mock, patch
 
 from node_monitor.node_provider_db import NodeProviderDB
+from node_monitor.node_provider_db_base import BaseNodeProviderDB
+from node_monitor.node_provider_db_sqlite import SQLiteNodeProviderDB
 from tests.conftest import cached
 import node_monitor.load_config as c
 
@@ -14,15 +20,18 @@ import node_monitor.load_config as c
 # We have to create this global var this as None, then assign its value in a
 # marked test, because the NodeProviderDB.__init__() instantiates a 
 # connection pool and will fail if we try and instantiate it with fake
-# credentials.
+# credentials. Without --db we test the SQLite backend instead.
 node_provider_db = None
 
 @pytest.mark.db
-def test_init_node_provider_db():
+def test_init_node_provider_db(request):
     global node_provider_db
-    node_provider_db = NodeProviderDB(
-        c.DB_HOST, c.DB_NAME, c.DB_PORT,
-        c.DB_USERNAME, c.DB_PASSWORD)
+    if request.config.getoption("--db"):
+        node_provider_db = NodeProviderDB(
+            c.DB_HOST, c.DB_NAME, c.DB_PORT,
+            c.DB_USERNAME, c.DB_PASSWORD, migrate=True)
+    else:
+        node_provider_db = SQLiteNodeProviderDB(":memory:")
 
 
 # In these fns we're testing a minimum schema. This means that these
@@ -91,3 +100,342 @@ def test_insert_and_delete_node_provider():
     assert 'test-dummy-principal-2' not in subs
 
     
+
+
+
+@pytest.mark.db
+def test_migrations():
+    # test_init_node_provider_db already brought the schema up to date
+    assert node_provider_db.migrate() == []
+    versions = node_provider_db._execute(
+        "SELECT version FROM schema_migrations ORDER BY version", ())
+    assert [row['version'] for row in versions] \
+        == list(range(1, len(node_provider_db.migrations) + 1))
+
+
+@pytest.mark.db
+@pytest.mark.postgres
+def test_migrations_indexes():
+    indexes = node_provider_db._execute(
+        "SELECT indexname FROM pg_indexes WHERE indexname LIKE %s",
+        ('%_node_provider_id_idx',))
+    assert len(indexes) == 3
+
+
+@pytest.mark.db
+def test_insert_node_providers_is_idempotent():
+    node_providers = {'test-dummy-principal-1': "Node Provider A",
+                      'test-dummy-principal-2': "Node Provider B"}
+    assert node_provider_db.insert_node_providers(node_providers) == 2
+    assert node_provider_db.insert_node_providers(node_providers) == 0
+    node_provider_db.delete_node_provider('test-dummy-principal-1')
+    node_provider_db.delete_node_provider('test-dummy-principal-2')
+
+
+@pytest.mark.db
+@pytest.mark.postgres
+def test_notify_invalidates_cache():
+    # Write behind the cache's back, the trigger's NOTIFY should drop it
+    node_provider_db.get_node_providers_as_dict()
+    node_provider_db._execute(
+        "INSERT INTO node_provider_lookup VALUES (%s, %s)",
+        ('test-dummy-principal-3', 'Node Provider C'))
+    time.sleep(0.1)
+    node_providers = node_provider_db.get_node_providers_as_dict()
+    assert node_providers['test-dummy-principal-3'] == "Node Provider C"
+    node_provider_db.delete_node_provider('test-dummy-principal-3')
+    assert 'test-dummy-principal-3' not in \
+        node_provider_db.get_node_providers_as_dict()
+
+
+
+@pytest.mark.db
+def test_get_routing_table():
+    subscribers = node_provider_db.get_subscribers_as_dict()
+    emails = node_provider_db.get_emails_as_dict()
+    routing_table = node_provider_db.get_routing_table()
+    assert routing_table.keys() == subscribers.keys()
+    for node_provider_id, route in routing_table.items():
+        assert route['email_addresses'] == emails.get(node_provider_id, [])
+    some_ids = list(subscribers)[:1] + ['not-a-subscriber']
+    node_provider_db.invalidate()
+    assert list(node_provider_db.get_routing_table(some_ids)) \
+        == list(subscribers)[:1]
+
+
+
+def test_sqlite_sees_writes_from_other_processes(tmp_path):
+    path = str(tmp_path / "node_provider_db.sqlite3")
+    db, other = SQLiteNodeProviderDB(path), SQLiteNodeProviderDB(path)
+    assert db.get_node_providers_as_dict() == {}
+    other.insert_node_providers({'test-dummy-principal-1': "Node Provider A"})
+    assert db.get_node_providers_as_dict() \
+        == {'test-dummy-principal-1': "Node Provider A"}
+
+
+
+def test_backend_must_implement_abstract_methods():
+    class Incomplete(BaseNodeProviderDB):
+        def _drain_notifications(self):
+            pass
+    with pytest.raises(TypeError, match="abstract"):
+        Incomplete()
+
+
+def test_sqlite_has_no_postgres_members():
+    db = SQLiteNodeProviderDB(":memory:")
+    assert not isinstance(db, NodeProviderDB)
+    for member in ['_listen', '_connection', '_checkout',
+                   'prepared_statements']:
+        assert not hasattr(db, member)
+    # Statements are passed to SQLite as written
+    assert db._execute("SELECT '100%s' AS s", ()) == [{'s': '100%s'}]
+
+
+
+##############################################
+## CACHE (no database needed)
+
+def offline_db(**kwargs):
+    """A NodeProviderDB whose queries are answered by a Mock."""
+    with patch('psycopg2.pool.ThreadedConnectionPool'):
+        db = NodeProviderDB('host', 'db', '5432', 'user', 'password',
+                            listen=False, migrate=False, **kwargs)
+    db._execute_prepared = Mock(return_value=[
+        {'node_id': 'node-1', 'node_label': 'label-1',
+         'node_provider_id': 'provider-1'}])
+    return db
+
+
+def test_cache_hit():
+    db = offline_db()
+    assert db.get_node_labels_as_dict() == {'node-1': 'label-1'}
+    assert db.get_node_labels_as_dict() == {'node-1': 'label-1'}
+    assert db._execute_prepared.call_count == 1
+    db.invalidate('node_label_lookup')
+    db.get_node_labels_as_dict()
+    assert db._execute_prepared.call_count == 2
+
+
+def test_cache_ttl():
+    db = offline_db(cache_ttl=0)
+    db.get_node_labels_as_dict()
+    db.get_node_labels_as_dict()
+    assert db._execute_prepared.call_count == 2
+
+
+def test_cache_notify():
+    db = offline_db()
+    db._listener = Mock(notifies=[])
+    db.get_node_labels_as_dict()
+    db.get_subscribers_as_dict()
+    db._listener.notifies.append(Mock(payload='node_label_lookup'))
+    db.get_node_labels_as_dict()
+    db.get_subscribers_as_dict()
+    assert db._execute_prepared.call_count == 3
+    # Once per lookup, and once more before caching what was loaded
+    assert db._listener.poll.call_count == 7
+
+
+def test_cache_listener_lost():
+    db = offline_db()
+    db._listener = Mock(notifies=[])
+    db.get_node_labels_as_dict()
+    db._listener.poll.side_effect = Exception("connection lost")
+    db._listen = Mock(
+        side_effect=lambda: setattr(db, '_listener', Mock(notifies=[])))
+    db.get_node_labels_as_dict()
+    assert db._execute_prepared.call_count == 2
+    db._listen.assert_called_once()
+
+
+def test_cache_listener_retried():
+    """A failed reconnect is retried once per TTL, rather than leaving the
+    cache on the TTL alone until the process restarts."""
+    db = offline_db()
+    db._listener = Mock(notifies=[])
+    db._listener.poll.side_effect = Exception("connection lost")
+    with patch('psycopg2.connect', side_effect=Exception("restarting")):
+        db.get_node_labels_as_dict()
+        db.get_node_labels_as_dict()
+    assert db._listener is None
+    with patch('psycopg2.connect') as connect:
+        connect.return_value.notifies = []
+        db.get_node_labels_as_dict()
+        connect.assert_not_called()
+        with patch('time.monotonic', return_value=time.monotonic() + 60 * 60):
+            db.get_node_labels_as_dict()
+        connect.assert_called_once()
+    assert db._listener is connect.return_value
+    # What we cached while not listening is dropped once we listen again
+    assert db._execute_prepared.call_count == 2
+
+
+def test_cache_invalidated_while_loading():
+    db = offline_db()
+    rows = db._execute_prepared.return_value
+    def load_racing_a_write(*args):
+        # The table changes after we read it, before we cache it
+        db.invalidate('node_label_lookup')
+        return rows
+    db._execute_prepared.side_effect = load_racing_a_write
+    db.get_node_labels_as_dict()
+    db._execute_prepared.side_effect = None
+    db.get_node_labels_as_dict()
+    db.get_node_labels_as_dict()
+    assert db._execute_prepared.call_count == 2
+
+
+def test_listen_only_listens():
+    db = offline_db()
+    with patch('psycopg2.connect') as connect:
+        db._listen()
+    cur = connect.return_value.cursor.return_value.__enter__.return_value
+    cur.execute.assert_called_once_with("LISTEN node_provider_db_changed")
+    db._execute_prepared.assert_not_called()
+
+
+def test_cache_routing_table():
+    db = offline_db()
+    db._execute_prepared.return_value = [{'node_provider_id': 'provider-1'},
+                                {'node_provider_id': 'provider-2'}]
+    # Filtered queries go to the database (which the mock doesn't filter),
+    # once the full table is cached they are filtered in memory
+    db.get_routing_table(['provider-2'])
+    db.get_routing_table()
+    assert list(db.get_routing_table(['provider-2'])) == ['provider-2']
+    assert db._execute_prepared.call_count == 2
+    db.invalidate('email_lookup')
+    db.get_routing_table()
+    assert db._execute_prepared.call_count == 3
+
+
+def test_insert_node_providers_one_statement():
+    with patch('psycopg2.pool.ThreadedConnectionPool'):
+        db = NodeProviderDB('host', 'db', '5432', 'user', 'password',
+                            listen=False, migrate=False)
+    node_providers = {f'principal-{i}': f'Node Provider {i}'
+                      for i in range(1000)}
+    conn = db.pool.getconn.return_value
+    conn.closed = 0
+    conn.cursor.return_value.__enter__.return_value.rowcount = 1000
+    with patch('node_monitor.node_provider_db.execute_values') as ev:
+        assert db.insert_node_providers(node_providers) == 1000
+    ev.assert_called_once()
+    _, sql, rows = ev.call_args.args
+    assert 'ON CONFLICT' in sql
+    assert rows == list(node_providers.items())
+    assert db.pool.getconn.return_value.commit.call_count == 1
+
+
+
+##############################################
+## POOL (no database needed)
+
+def pooled_db(**kwargs):
+    """A NodeProviderDB over a mock pool that hands out one connection."""
+    with patch('psycopg2.pool.ThreadedConnectionPool'):
+        db = NodeProviderDB('host', 'db', '5432', 'user', 'password',
+                            listen=False, migrate=False, **kwargs)
+    conn = MagicMock(closed=0)
+    db.pool.getconn.return_value = conn
+    cur = conn.cursor.return_value.__enter__.return_value
+    cur.fetchall.return_value = []
+    return db, conn, cur
+
+
+def test_pool_returns_connection_on_error():
+    db, conn, cur = pooled_db()
+    cur.execute.side_effect = psycopg2.ProgrammingError("syntax error")
+    for _ in range(10):
+        with pytest.raises(psycopg2.ProgrammingError):
+            db._execute("SELEC 1", ())
+    assert conn.rollback.call_count == 10
+    assert db.pool.putconn.call_count == 10
+    db.pool.putconn.assert_called_with(conn, close=False)
+
+
+def test_query_stats():
+    db, conn, cur = pooled_db()
+    cur.fetchall.return_value = [(1,), (2,)]
+    db._execute1("SELECT id FROM email_lookup WHERE id > %s", (0,))
+    cur.execute.side_effect = psycopg2.ProgrammingError("syntax error")
+    with pytest.raises(psycopg2.ProgrammingError):
+        db._execute1("SELECT id FROM email_lookup WHERE id > %s", (1,))
+    stats = db.query_stats()["SELECT id FROM email_lookup WHERE id > ?"]
+    assert stats['calls'] == 2
+    assert stats['errors'] == 1
+    assert stats['rows']['max'] == 2
+    assert stats['wait']['count'] == 2
+
+
+def test_pool_closes_broken_connection():
+    db, conn, cur = pooled_db()
+    cur.execute.side_effect = psycopg2.OperationalError("server closed")
+    with pytest.raises(psycopg2.OperationalError):
+        db._execute("SELECT 1", ())
+    db.pool.putconn.assert_called_with(conn, close=True)
+
+
+def test_pool_timeout():
+    db, conn, cur = pooled_db(pool_max=1, pool_timeout=0.01)
+    with db._connection():
+        with pytest.raises(psycopg2.pool.PoolError):
+            with db._connection():
+                pass
+
+
+def test_prepared_once_per_connection():
+    db, conn, cur = pooled_db()
+    db.get_node_labels_as_dict()
+    db.invalidate()
+    db.get_node_labels_as_dict()
+    statements = [c.args[0] for c in cur.execute.call_args_list]
+    assert statements == ["PREPARE select_node_label_lookup_0 AS "
+                          "SELECT * FROM node_label_lookup",
+                          "EXECUTE select_node_label_lookup_0",
+                          "EXECUTE select_node_label_lookup_0"]
+
+
+def test_get_schema_is_parameterized():
+    db, conn, cur = pooled_db()
+    db._get_schema("subscribers'; DROP TABLE subscribers; --")
+    sql, params = cur.execute.call_args.args
+    assert "DROP" not in sql
+    assert params == ("subscribers'; DROP TABLE subscribers; --",)
+
+
+
+##############################################
+## MIGRATIONS (no database needed)
+
+def test_create_table_ddl_is_valid():
+    # No trailing comma before the closing parenthesis
+    for migration in NodeProviderDB.migrations:
+        assert not re.search(r",\s*\)", migration)
+
+
+def test_migrate_applies_pending_versions():
+    db, conn, cur = pooled_db()
+    cur.fetchone.side_effect = [(1,), None, (3,)]
+    assert db.migrate() == [2]
+    statements = [c.args[0] for c in cur.execute.call_args_list]
+    assert NodeProviderDB.migrations[0] not in statements
+    assert NodeProviderDB.migrations[1] in statements
+    assert NodeProviderDB.migrations[2] not in statements
+
+
+def test_no_ddl_by_default():
+    """Starting up runs no DDL against the shared database, and deleting a
+    subscriber only cascades once add_foreign_keys() was run."""
+    with patch('psycopg2.pool.ThreadedConnectionPool') as pool:
+        NodeProviderDB('host', 'db', '5432', 'user', 'password', listen=False)
+    pool.return_value.getconn.assert_not_called()
+    assert not any("CASCADE" in m for m in NodeProviderDB.migrations)
+
+    db, conn, cur = pooled_db()
+    db.add_foreign_keys()
+    [(sql, params)] = [c.args for c in cur.execute.call_args_list]
+    assert sql == NodeProviderDB.create_foreign_keys and params == ()
+    assert sql.count("ON DELETE CASCADE NOT VALID") == 3
+
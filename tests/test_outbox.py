@@ -0,0 +1,74 @@
+import sqlite3
+import pytest
+from unittest.mock import patch
+
+from node_monitor.outbox import Outbox
+
+
+def test_put_is_idempotent():
+    outbox = Outbox(":memory:")
+    messages = [("alert:1:a", "a", "subject", "message"),
+                ("alert:1:b", "b", "subject", "message")]
+    assert outbox.put(messages) == 2
+    assert outbox.put(messages) == 0
+    assert outbox.pending() == 2
+
+
+def test_claim_leases_messages():
+    outbox = Outbox(":memory:", lease=60)
+    outbox.put([("k1", "a", "s", "m"), ("k2", "b", "s", "m")])
+    entries = outbox.claim(limit=1)
+    assert [e.key for e in entries] == ["k1"]
+    assert [e.key for e in outbox.claim()] == ["k2"]
+    assert outbox.claim() == []
+    # The lease runs out, e.g. because we crashed before delivering
+    with patch('time.time', return_value=1e10):
+        assert [e.key for e in outbox.claim()] == ["k1", "k2"]
+
+
+def test_retry_and_give_up(caplog):
+    outbox = Outbox(":memory:", max_attempts=2, retry_base=30)
+    outbox.put([("k1", "a", "s", "m")])
+    [entry] = outbox.claim()
+    outbox.retry(entry, [("email", "a@example.com")], "slack: ratelimited")
+    assert outbox.claim() == []
+    with patch('time.time', return_value=1e10):
+        [entry] = outbox.claim()
+    assert entry.attempts == 1
+    assert entry.delivered == {("email", "a@example.com")}
+    assert not caplog.records
+    outbox.retry(entry, [], "slack: ratelimited")
+    assert outbox.pending() == 0
+    [record] = caplog.records
+    assert record.levelname == 'ERROR'
+    assert "gave up on k1 after 2 attempts: slack: ratelimited" in record.message
+    with patch('time.time', return_value=2e10):
+        assert outbox.claim() == []
+        assert outbox.purge() == 1
+
+
+def test_done():
+    outbox = Outbox(":memory:")
+    outbox.put([("k1", "a", "s", "m")])
+    [entry] = outbox.claim()
+    outbox.done(entry)
+    assert outbox.pending() == 0
+    assert outbox.put([("k1", "a", "s", "m")]) == 0
+
+
+def test_entry_batch():
+    outbox = Outbox(":memory:")
+    outbox.put([("alert:1700000000.5:a-b-c", "a-b-c", "s", "m")])
+    [entry] = outbox.claim()
+    assert entry.batch == "alert:1700000000.5"
+
+
+def test_failed_statement_is_rolled_back():
+    """A statement that fails doesn't leave the connection inside a
+    transaction, which would fail every later put and claim."""
+    outbox = Outbox(":memory:")
+    with pytest.raises(sqlite3.Error):
+        outbox.put([("k1", "a", object(), "m")]) # can't be stored
+    assert not outbox._conn.in_transaction
+    assert outbox.put([("k1", "a", "s", "m")]) == 1
+    assert [e.key for e in outbox.claim()] == ["k1"]
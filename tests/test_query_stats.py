@@ -0,0 +1,49 @@
+import pytest
+
+from node_monitor.query_stats import QueryStats, Histogram, normalize
+
+
+def test_normalize():
+    assert normalize("SELECT *\n    FROM t  WHERE id = %s AND name = 'a''b'") \
+        == "SELECT * FROM t WHERE id = ? AND name = ?"
+    assert normalize("SELECT 1") == normalize("SELECT 42")
+    assert normalize("DROP INDEX email_lookup_node_provider_id_idx") \
+        == "DROP INDEX email_lookup_node_provider_id_idx"
+
+
+def test_histogram():
+    h = Histogram([1, 10, 100])
+    for value in [0.5, 1, 5, 5, 50, 500]:
+        h.record(value)
+    assert h.counts == [2, 2, 1, 1]
+    assert h.quantile(0.5) == 10
+    assert h.quantile(1) == 500
+    assert h.as_dict()['buckets'] == {'1': 2, '10': 2, '100': 1, 'inf': 1}
+    assert Histogram([1]).quantile(0.5) == 0.0
+
+
+def test_measure():
+    stats = QueryStats()
+    for rows in [1, 3]:
+        with stats.measure("SELECT * FROM t WHERE id = %s") as sample:
+            sample.checked_out()
+            sample.rows = rows
+    with pytest.raises(ValueError):
+        with stats.measure("SELECT * FROM t WHERE id = 7"):
+            raise ValueError
+    d = stats.snapshot()["SELECT * FROM t WHERE id = ?"]
+    assert d['calls'] == 3
+    assert d['errors'] == 1
+    assert d['rows']['count'] == 2
+    assert d['rows']['mean'] == 2
+    assert d['latency']['count'] == d['wait']['count'] == 3
+    stats.reset()
+    assert stats.snapshot() == {}
+
+
+def test_slow_query_is_logged(caplog):
+    stats = QueryStats(slow_query=0.5)
+    stats.record("SELECT 1", 0.1)
+    stats.record("SELECT 2", 0.9, wait=0.8)
+    assert len(caplog.records) == 1
+    assert "SELECT ?" in caplog.text and "0.800s waiting" in caplog.text
@@ -0,0 +1,55 @@
+import pytest
+
+from node_monitor.rate_limit import TokenBucket, TokenBuckets, \
+    parse_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_burst_then_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == []
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.5), pytest.approx(0.5)]
+    clock.now += 10
+    for _ in range(3):
+        bucket.acquire()
+    assert len(clock.slept) == 2
+
+
+def test_token_bucket_pause():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, capacity=5, clock=clock, sleep=clock.sleep)
+    bucket.pause(7)
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(7)]
+
+
+def test_token_buckets():
+    buckets = TokenBuckets(rate=1)
+    assert buckets["a"] is buckets["a"]
+    assert buckets["a"] is not buckets["b"]
+
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after("2.5") == 2.5
+    for malformed in [None, "", "soon", "Wed, 21 Oct 2026 07:28:00 GMT",
+                      "-1", "inf", "nan"]:
+        assert parse_retry_after(malformed) == 1
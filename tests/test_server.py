@@ -0,0 +1,30 @@
+import pytest
+from unittest.mock import Mock
+
+from node_monitor.node_monitor import NodeMonitor
+from node_monitor.bot_email import EmailBot
+from node_monitor.node_provider_db import NodeProviderDB
+from node_monitor.server import create_server
+
+from tests.conftest import cached
+
+
+def test_nodes_summary():
+    nm = NodeMonitor(Mock(spec=NodeProviderDB), Mock(spec=EmailBot))
+    client = create_server(nm, lambda: True).test_client()
+    assert client.get('/nodes').get_json() == {"nodes": 0}
+
+    nm._resync(cached['two_nodes_down'])
+    d = client.get('/nodes').get_json()
+    assert d["nodes"] == len(cached['two_nodes_down'].nodes)
+    assert d["status"]["DOWN"] == 2
+    assert d["node_providers"] == 1
+    assert client.get('/').get_json()["status"] == "online"
+
+
+def test_db_stats():
+    db = Mock(spec=NodeProviderDB)
+    db.query_stats.return_value = {'SELECT ?': {'calls': 1, 'errors': 0}}
+    nm = NodeMonitor(db, Mock(spec=EmailBot))
+    client = create_server(nm, lambda: True).test_client()
+    assert client.get('/db').get_json() == {'SELECT ?': {'calls': 1, 'errors': 0}}
@@ -0,0 +1,76 @@
+import requests
+from unittest.mock import Mock
+
+import node_monitor.ic_api as ic_api
+from node_monitor.node_monitor import NodeMonitor
+from node_monitor.bot_email import EmailBot
+from simulator.fleet import Fleet, scenarios
+from simulator.server import Simulator, serve_in_thread
+
+from benchmarks.bench_cycle import subscribed_db
+
+
+def test_fleet_is_deterministic():
+    a, b = Fleet(500, seed=1), Fleet(500, seed=1)
+    assert a.nodes == b.nodes
+    assert a.nodes != Fleet(500, seed=2).nodes
+    assert len(a.node_providers) == 5
+    assert len({node['node_id'] for node in a.nodes}) == 500
+
+
+def test_fleet_payload_parses():
+    fleet = scenarios['mixed'](Fleet(1000))
+    for t in range(10):
+        nodes = ic_api.parse_nodes(fleet.nodes_payload(t))
+        assert [n.model_dump() for n in nodes.nodes] == fleet.nodes_at(t)
+    providers = ic_api.parse_node_providers(fleet.node_providers_payload())
+    assert len(providers.node_providers) == 10
+
+
+def test_fleet_events():
+    fleet = Fleet(1000).dc_outage(start=2, duration=3, dc_id='an1') \
+        .flapping(5, start=0, duration=4).new_nodes(10, at=1)
+    dc = set(fleet.events[0].nodes)
+    assert dc and all(fleet.nodes[i]['dc_id'] == 'an1' for i in dc)
+    flapping = set(fleet.events[1].nodes)
+    statuses = [fleet.statuses(t) for t in range(6)]
+    assert all(statuses[t][i] == 'DOWN' for i in dc for t in (2, 3, 4))
+    assert not any(statuses[t][i] == 'DOWN' for i in dc - flapping
+                   for t in (0, 1, 5))
+    assert [statuses[t][min(flapping)] == 'DOWN' for t in range(6)] \
+        == [True, False, True, False, False, False]
+    assert [len(fleet.nodes_at(t)) for t in range(3)] == [1000, 1010, 1010]
+
+
+def test_server_conditional_requests():
+    fleet = Fleet(300).dc_outage(start=1, duration=1)
+    server, url = serve_in_thread(Simulator(fleet))
+    try:
+        client = ic_api.ICAPIClient(url)
+        first = client.get_snapshot_if_modified()
+        assert first is not None and len(first) == 300
+        assert client.get_snapshot_if_modified(first) is None
+        requests.post(f"{url}/advance")
+        assert client.get_snapshot_if_modified(first) is not None
+        provider_id = fleet.node_providers[0]['principal_id']
+        nodes = client.get_nodes(provider_id).nodes
+        assert {n.node_provider_id for n in nodes} == {provider_id}
+        assert len(client.get_node_providers().node_providers) == 3
+    finally:
+        server.shutdown()
+
+
+def test_node_monitor_against_simulator():
+    fleet = Fleet(2000, seed=3).nodes_down(4, start=1, duration=10)
+    server, url = serve_in_thread(Simulator(fleet))
+    try:
+        nm = NodeMonitor(subscribed_db(fleet), Mock(spec=EmailBot),
+                         ic_api_client=ic_api.ICAPIClient(url))
+        for _ in range(3):
+            nm._resync()
+            requests.post(f"{url}/advance")
+        nm._analyze()
+        down = {fleet.nodes[i]['node_id'] for i in fleet.events[0].nodes}
+        assert {n.node_id for n in nm.compromised_nodes} == down
+    finally:
+        server.shutdown()